@@ -0,0 +1,189 @@
+import json
+import math
+import os
+from threading import Lock
+from urllib import request
+
+from PySide2.QtCore import QObject, QThread, Signal
+import numpy
+
+from gis.geo_grid import GeoGrid
+import preferences
+
+BATHYMETRY_LAYER = 'Oceanographic:World_Bathymetric_Heightmap'
+REQUEST_TIMEOUT = 60  # seconds, a whole tile at BATHYMETRY_RESOLUTION is a few MB
+
+
+def readArcGrid(path):
+    """
+    Read an ESRI ASCII grid (the ArcGrid format GeoServer's WCS can return) into a GeoGrid.
+    No-data cells become NaN.
+    """
+    header = {}
+    with open(path) as gridFile:
+        headerLines = 0
+        for line in gridFile:
+            key, _, value = line.strip().partition(' ')
+            if not key or not key[0].isalpha():
+                break
+            header[key.lower()] = float(value)
+            headerLines += 1
+
+    values = numpy.loadtxt(path, skiprows=headerLines, dtype=numpy.float32, ndmin=2)
+    if 'nodata_value' in header:
+        values[values == header['nodata_value']] = numpy.nan
+
+    cellSize = header['cellsize']
+    lonMin = header['xllcorner'] if 'xllcorner' in header else header['xllcenter'] - cellSize / 2
+    latMin = header['yllcorner'] if 'yllcorner' in header else header['yllcenter'] - cellSize / 2
+    rows, columns = values.shape
+
+    return GeoGrid(values, lonMin, latMin, lonMax=lonMin + columns * cellSize, latMax=latMin + rows * cellSize)
+
+
+class BathymetryDownloader(QThread):
+    """ Pulls the heightmap for each area queued on a BathymetrySampler off the GUI thread. """
+
+    def __init__(self, sampler):
+        QThread.__init__(self)
+
+        self.sampler = sampler
+
+    def run(self):
+        while not self.isInterruptionRequested():
+            with self.sampler.lock:
+                if not self.sampler.queue:
+                    return
+                bbox = self.sampler.queue.pop(0)
+            try:
+                self.sampler.download(bbox)
+            except Exception as e:
+                print('BathymetryDownloader.run {}: {}'.format(bbox, e))
+
+
+class BathymetrySampler(QObject):
+    """
+    Depth lookups from a local copy of the bathymetric heightmap. The grid is pulled from
+    GeoServer (or imported from a local file) once and kept on disk as a memory-mapped NumPy
+    array, so a lookup is an interpolation rather than a network round trip. The main grid
+    covers BATHYMETRY_BBOX; anywhere else is pulled the first time it is asked for, in
+    BATHYMETRY_TILE_SIZE degree squares. Nothing is ever fetched while sampling: an area
+    that isn't on disk yet is queued for the downloader and is NaN until gridLoaded is
+    emitted, when it can be sampled again.
+    """
+    gridLoaded = Signal()
+
+    def __init__(self, path=preferences.BATHYMETRY_PATH, bbox=preferences.BATHYMETRY_BBOX,
+                 tileSize=preferences.BATHYMETRY_TILE_SIZE):
+        """
+        Constructor
+        """
+        QObject.__init__(self)
+
+        self.path = path
+        self.bbox = tuple(bbox)
+        self.tileSize = tileSize
+        self.grids = {}  # bbox: GeoGrid, for each area opened from disk
+        self.requested = set()  # bboxes queued or downloaded this session
+        self.queue = []
+        self.downloader = None
+        self.lock = Lock()
+
+    def gridPath(self, bbox):
+        """ Where the grid for the main area or a tile is kept. """
+        if bbox == self.bbox:
+            return self.path
+        return '{}_{:g}_{:g}.npy'.format(os.path.splitext(self.path)[0], bbox[0], bbox[1])
+
+    def grid(self, bbox):
+        """
+        The grid for the main area or a tile, opened from disk. If it hasn't been downloaded a
+        download is queued (once) and None is returned.
+        """
+        with self.lock:
+            grid = self.grids.get(bbox)
+            if grid is None:
+                path = self.gridPath(bbox)
+                # The metadata is written last, so the grid is complete once it exists.
+                if os.path.exists(path + '.json'):
+                    with open(path + '.json') as metaFile:
+                        gridBbox = json.load(metaFile)['bbox']
+                    grid = GeoGrid(numpy.load(path, mmap_mode='r'), *gridBbox)
+                    self.grids[bbox] = grid
+                elif bbox not in self.requested:
+                    self.requested.add(bbox)
+                    self.queue.append(bbox)
+                    self.startDownloader()
+            return grid
+
+    def startDownloader(self):
+        """ Call with the lock held. """
+        if self.downloader is None or not self.downloader.isRunning():
+            self.downloader = BathymetryDownloader(self)
+            self.downloader.finished.connect(self.downloaderFinished)
+            self.downloader.start()
+
+    def downloaderFinished(self):
+        with self.lock:
+            if self.queue:
+                self.startDownloader()  # queued as the downloader was finishing
+        self.gridLoaded.emit()
+
+    def download(self, bbox, resolution=preferences.BATHYMETRY_RESOLUTION):
+        """ Pull the heightmap for an area from GeoServer's WCS and cache it. """
+        lonMin, latMin, lonMax, latMax = bbox
+        path = 'http://{}:{}/geoserver/wcs?'.format(preferences.GEOSERVER_IP, preferences.GEOSERVER_PORT) + \
+               'SERVICE=WCS&' + \
+               'VERSION=1.0.0&' + \
+               'REQUEST=GetCoverage&' + \
+               'COVERAGE={}&'.format(BATHYMETRY_LAYER) + \
+               'CRS=EPSG:4326&' + \
+               'BBOX={},{},{},{}&'.format(lonMin, latMin, lonMax, latMax) + \
+               'WIDTH={}&'.format(math.ceil((lonMax - lonMin) / resolution)) + \
+               'HEIGHT={}&'.format(math.ceil((latMax - latMin) / resolution)) + \
+               'FORMAT=ArcGrid'
+        gridPath = self.gridPath(bbox) + '.asc'
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(gridPath, 'wb') as gridFile:
+            gridFile.write(request.urlopen(path, timeout=REQUEST_TIMEOUT).read())
+        self.importFile(gridPath, bbox)
+        os.remove(gridPath)
+
+    def importFile(self, gridPath, bbox=None):
+        """ Use a local ArcGrid (.asc) file as the bathymetry for an area (the main one by default). """
+        bbox = self.bbox if bbox is None else tuple(bbox)
+        grid = readArcGrid(gridPath)
+        path = self.gridPath(bbox)
+        numpy.save(path, grid.values)
+        with open(path + '.json', 'w') as metaFile:
+            json.dump({'bbox': grid.bbox()}, metaFile)
+        with self.lock:
+            self.grids.pop(bbox, None)
+
+    def sample(self, lat, lon):
+        """
+        Elevation relative to sea level (negative below the surface) at one location or an
+        array of locations. NaN where the heightmap isn't on disk yet.
+        """
+        shape = numpy.broadcast(numpy.asarray(lat), numpy.asarray(lon)).shape
+        lats, lons = [numpy.broadcast_to(numpy.asarray(value, dtype=float), shape).ravel() for value in (lat, lon)]
+        elevations = numpy.full(lats.shape, numpy.nan)
+
+        lonMin, latMin, lonMax, latMax = self.bbox
+        inMain = (lonMin <= lons) & (lons <= lonMax) & (latMin <= lats) & (lats <= latMax)
+        areas = [(self.bbox, inMain)] if inMain.any() else []
+
+        # Everything else by the tile it falls in.
+        outside = numpy.isfinite(lats) & numpy.isfinite(lons) & ~inMain
+        size = self.tileSize
+        tiles = numpy.column_stack((numpy.floor(lons / size), numpy.floor(lats / size)))
+        for column, row in numpy.unique(tiles[outside], axis=0).tolist():
+            areas.append(((column * size, row * size, (column + 1) * size, (row + 1) * size),
+                          outside & (tiles[:, 0] == column) & (tiles[:, 1] == row)))
+
+        for bbox, inside in areas:
+            grid = self.grid(bbox)
+            if grid is not None:
+                elevations[inside] = grid.sample(lats[inside], lons[inside])
+
+        return elevations.reshape(shape) if shape else float(elevations[0])
@@ -0,0 +1,113 @@
+import time
+
+from PySide2.QtCore import QObject, QTimer, Signal
+from cachetools import LRUCache
+
+from gis.ncwms_tools import getFieldGrid
+import preferences
+
+
+class FrameSequence(QObject):
+    """
+    The grids of an ncWMS layer over one bbox and depth at each of a list of times. Frames are
+    fetched concurrently on the query engine into a bounded cache, a window at a time from the
+    current frame, so playback and scrubbing are served from memory at display rate rather than
+    waiting on a request per frame. A frame that fails to load isn't asked for again until
+    NCWMS_RETRY_DELAY has passed.
+    """
+    frameChanged = Signal(int, object)  # index, GeoGrid of the frame now showing
+
+    def __init__(self, queryEngine, layerName, bbox, elevation, width, height, times,
+                 cacheSize=preferences.NCWMS_FRAME_CACHE_SIZE, frameRate=preferences.NCWMS_PLAYBACK_RATE):
+        """
+        Constructor
+        """
+        super().__init__()
+
+        self.queryEngine = queryEngine
+        self.layerName = layerName
+        self.bbox = tuple(bbox)
+        self.elevation = elevation
+        self.width = width
+        self.height = height
+        self.times = list(times)
+        self.frameIndices = {self.frameKey(index): index for index in range(len(self.times))}
+
+        self.frames = LRUCache(maxsize=cacheSize)
+        self.pending = {}  # frame index: Future of its fetch
+        self.failedAt = {}  # frame index: when its fetch was found to have failed
+        self.index = 0
+        self.shownIndex = None
+
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.step)
+        self.setFrameRate(frameRate)
+        self.queryEngine.resultReady.connect(self.frameArrived)
+
+    def frameKey(self, index):
+        return ('frame', self.layerName) + self.bbox + (self.elevation, self.width, self.height, self.times[index])
+
+    def prefetch(self, index):
+        """ Queue every frame from index onwards (wrapping) that will fit in the cache and isn't there yet. """
+        now = time.monotonic()
+        for offset in range(min(self.frames.maxsize - 1, len(self.times))):
+            frameIndex = (index + offset) % len(self.times)
+            future = self.pending.get(frameIndex)
+            if frameIndex in self.frames or (future is not None and not (future.done() and future.exception())):
+                continue
+            if future is not None:
+                # Failed; wait a while before asking again rather than on every playback step.
+                if now - self.failedAt.setdefault(frameIndex, now) < preferences.NCWMS_RETRY_DELAY:
+                    continue
+                del self.failedAt[frameIndex]
+            # Frames are held in this cache, so go round getFieldGrid's so a long sequence doesn't flush it.
+            self.pending[frameIndex] = self.queryEngine.submit(
+                self.frameKey(frameIndex), getFieldGrid.__wrapped__, self.layerName, *self.bbox, self.elevation,
+                self.width, self.height, self.times[frameIndex])
+
+    def frameArrived(self, key, grid):
+        """ Runs on the GUI thread when the query engine has finished any query. """
+        frameIndex = self.frameIndices.get(key)
+        if frameIndex is None or self.pending.pop(frameIndex, None) is None:
+            return
+
+        self.frames[frameIndex] = grid
+        if frameIndex == self.index and self.shownIndex != self.index:
+            self.show(self.index)
+
+    def show(self, index):
+        """ Scrub to a frame. It is shown now if it's in memory, otherwise as soon as it arrives. """
+        self.index = index % len(self.times)
+        self.prefetch(self.index)
+        grid = self.frames.get(self.index)
+        if grid is not None:
+            self.shownIndex = self.index
+            self.frameChanged.emit(self.index, grid)
+
+    def step(self):
+        """ Advance playback one frame, holding the current one if the next hasn't arrived yet. """
+        nextIndex = (self.index + 1) % len(self.times)
+        if nextIndex in self.frames:
+            self.show(nextIndex)
+        else:
+            self.prefetch(nextIndex)
+
+    def setFrameRate(self, frameRate):
+        self.timer.setInterval(int(1000 / frameRate))
+
+    def play(self):
+        self.prefetch(self.index)
+        self.timer.start()
+
+    def pause(self):
+        self.timer.stop()
+
+    def isPlaying(self):
+        return self.timer.isActive()
+
+    def stop(self):
+        """ Stop playback and stop listening for frames, e.g. because the sequence is being replaced. """
+        self.timer.stop()
+        self.queryEngine.resultReady.disconnect(self.frameArrived)
+        self.pending.clear()
+        self.failedAt.clear()
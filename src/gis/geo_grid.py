@@ -0,0 +1,98 @@
+import numpy
+
+
+class GeoGrid:
+    """
+    A regular lat/lon grid of values (depth, sound speed etc.) covering a bounding box.
+    Row 0 is the northern edge and column 0 the western edge; each value is for the centre
+    of its cell. The last two axes of values are rows/columns so a stack of grids (e.g. one
+    per depth level) can be held as a 3-D array.
+    """
+
+    def __init__(self, values, lonMin, latMin, lonMax, latMax):
+        """
+        Constructor
+        """
+        self.values = values
+        self.lonMin = lonMin
+        self.latMin = latMin
+        self.lonMax = lonMax
+        self.latMax = latMax
+
+        self.rows, self.columns = values.shape[-2:]
+        self.dLat = (latMax - latMin) / self.rows
+        self.dLon = (lonMax - lonMin) / self.columns
+
+    def bbox(self):
+        return self.lonMin, self.latMin, self.lonMax, self.latMax
+
+    def contains(self, lat, lon):
+        """ True where a location lies inside the grid. Works for scalars or arrays. """
+        return (self.latMin <= lat) & (lat <= self.latMax) & (self.lonMin <= lon) & (lon <= self.lonMax)
+
+    def cellCentres(self):
+        """ The lat/lon of the centre of every cell as two (rows, columns) arrays. """
+        lats = self.latMax - (numpy.arange(self.rows) + 0.5) * self.dLat
+        lons = self.lonMin + (numpy.arange(self.columns) + 0.5) * self.dLon
+        return numpy.meshgrid(lats, lons, indexing='ij')
+
+    def sample(self, lat, lon):
+        """
+        Bilinearly interpolated value(s) at a location. Scalars give a scalar, arrays give an
+        array of the same shape. Locations outside the grid are NaN.
+        """
+        lat = numpy.asarray(lat, dtype=float)
+        lon = numpy.asarray(lon, dtype=float)
+
+        row = numpy.clip((self.latMax - lat) / self.dLat - 0.5, 0, self.rows - 1)
+        column = numpy.clip((lon - self.lonMin) / self.dLon - 0.5, 0, self.columns - 1)
+        row0 = numpy.minimum(numpy.floor(row).astype(int), max(self.rows - 2, 0))
+        column0 = numpy.minimum(numpy.floor(column).astype(int), max(self.columns - 2, 0))
+        row1 = numpy.minimum(row0 + 1, self.rows - 1)
+        column1 = numpy.minimum(column0 + 1, self.columns - 1)
+        rowFraction = row - row0
+        columnFraction = column - column0
+
+        # No-data (NaN) neighbours are left out and the remaining weights rescaled.
+        total = 0
+        weights = 0
+        for cornerRow, cornerColumn, weight in ((row0, column0, (1 - rowFraction) * (1 - columnFraction)),
+                                                (row0, column1, (1 - rowFraction) * columnFraction),
+                                                (row1, column0, rowFraction * (1 - columnFraction)),
+                                                (row1, column1, rowFraction * columnFraction)):
+            corner = numpy.asarray(self.values[..., cornerRow, cornerColumn], dtype=float)
+            valid = ~numpy.isnan(corner)
+            total = total + numpy.where(valid, corner * weight, 0)
+            weights = weights + numpy.where(valid, weight, 0)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            value = numpy.where((weights > 0) & self.contains(lat, lon), total / weights, numpy.nan)
+
+        return value if value.ndim else float(value)
+
+
+class ProfileGrid:
+    """
+    A GeoGrid per depth level (e.g. the sound speed at every ELEVATION an ncWMS layer has)
+    held as one 3-D array, so the field at any depth is an in-memory slice.
+    """
+
+    def __init__(self, levels, grid):
+        """
+        Constructor
+        """
+        order = numpy.argsort(levels)
+        self.levels = numpy.asarray(levels, dtype=float)[order]
+        self.grid = GeoGrid(grid.values[order], *grid.bbox())
+
+    def atDepth(self, depth):
+        """
+        The 2-D grid at a depth, linearly interpolated between the levels either side of it.
+        Depths outside the levels get the nearest level.
+        """
+        upper = int(numpy.clip(numpy.searchsorted(self.levels, depth), 1, max(len(self.levels) - 1, 1)))
+        lower = upper - 1 if len(self.levels) > 1 else 0
+        upper = min(upper, len(self.levels) - 1)
+        span = self.levels[upper] - self.levels[lower]
+        fraction = numpy.clip((depth - self.levels[lower]) / span, 0, 1) if span else 0
+        values = (1 - fraction) * self.grid.values[lower] + fraction * self.grid.values[upper]
+        return GeoGrid(values, *self.grid.bbox())
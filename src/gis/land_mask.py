@@ -0,0 +1,111 @@
+import glob
+import os
+from threading import Lock
+
+from PySide2.QtGui import QImage
+import numpy
+
+from gis.mts_controller import TILE_DIMENSION, tileToGeographic
+import preferences
+
+
+def tileAlpha(path):
+    """ The alpha channel of a cached tile image as a (rows, columns) array. """
+    image = QImage(path).convertToFormat(QImage.Format_RGBA8888)
+    pixels = numpy.frombuffer(image.constBits(), dtype=numpy.uint8, count=image.byteCount())
+    return pixels.reshape(image.height(), image.bytesPerLine())[:, :image.width() * 4].reshape(
+        image.height(), image.width(), 4)[..., 3]
+
+
+class LandMask:
+    """
+    Land/sea lookup built from the cached landmass tiles. Any pixel the layer draws on is land.
+    The tiles for one zoom level are read once into a bit-packed raster (one bit per pixel),
+    which is kept on disk, so a lookup is an index into an array rather than a server request.
+    The mask is rebuilt when tiles newer than it have been cached, and isn't saved at all
+    while there are no tiles to build it from.
+    """
+
+    def __init__(self, layerName=preferences.LAND_MASK_LAYER, zoom=preferences.LAND_MASK_ZOOM, path=preferences.LAND_MASK_PATH):
+        """
+        Constructor
+        """
+        self.layerName = layerName
+        self.zoom = zoom
+        self.path = path
+        self.cellSize = 180 / ((1 << zoom) * TILE_DIMENSION)  # degrees per pixel, the same for lat and lon
+
+        self.bits = None
+        self.columns = 0
+        self.lonMin = 0
+        self.latMax = 0
+        self.loaded = False
+        self.lock = Lock()  # lookups come from the ncWMS worker threads too
+
+    def load(self):
+        """ Read the mask from disk, (re)building it from the tile cache first if that has newer tiles. """
+        with self.lock:
+            if not self.loaded:
+                tiles = self.cachedTiles()
+                if tiles and (not os.path.exists(self.path) or
+                              max(os.path.getmtime(tilePath) for tilePath in tiles.values()) >
+                              os.path.getmtime(self.path)):
+                    self.build(tiles)
+                if os.path.exists(self.path):
+                    with numpy.load(self.path) as mask:
+                        if mask['bits'].size:
+                            self.bits = mask['bits']
+                            self.columns = int(mask['columns'])
+                            self.lonMin, self.latMax = mask['origin']
+                self.loaded = True
+
+    def cachedTiles(self):
+        """ {(x, y): path} of the cached landmass tiles at the mask zoom level. """
+        tiles = {}
+        for cachePath in (preferences.CACHE_PATH, preferences.DEFAULT_CACHE_PATH):
+            for tilePath in glob.glob(os.path.join(str(cachePath), self.layerName, str(self.zoom), '*', '*.png')):
+                x = int(os.path.basename(os.path.dirname(tilePath)))
+                y = int(os.path.splitext(os.path.basename(tilePath))[0])
+                tiles.setdefault((x, y), tilePath)
+        return tiles
+
+    def build(self, tiles):
+        """ Rasterise cached tiles into a bitmap and save it. """
+        minX = min(x for x, _ in tiles)
+        maxY = max(y for _, y in tiles)
+        rows = (maxY - min(y for _, y in tiles) + 1) * TILE_DIMENSION
+        columns = (max(x for x, _ in tiles) - minX + 1) * TILE_DIMENSION
+
+        # Tile rows count up from the south, raster rows down from the north.
+        land = numpy.zeros((rows, columns), dtype=bool)
+        for (x, y), tilePath in tiles.items():
+            row = (maxY - y) * TILE_DIMENSION
+            column = (x - minX) * TILE_DIMENSION
+            land[row:row + TILE_DIMENSION, column:column + TILE_DIMENSION] = tileAlpha(tilePath) > 127
+
+        topLeft = tileToGeographic(minX, maxY + 1, self.zoom)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        numpy.savez_compressed(self.path, bits=numpy.packbits(land, axis=1), columns=columns,
+                               origin=(topLeft.y(), topLeft.x()))
+
+    def isWater(self, lat, lon):
+        """
+        True where a location is not land. Works for scalars or arrays. Anywhere the mask
+        doesn't cover counts as water so nothing is thrown away that might have data.
+        """
+        self.load()
+        lat = numpy.asarray(lat, dtype=float)
+        lon = numpy.asarray(lon, dtype=float)
+        if self.bits is None:
+            water = numpy.ones(numpy.broadcast(lat, lon).shape, dtype=bool)
+            return water if water.ndim else True
+
+        row = numpy.floor((self.latMax - lat) / self.cellSize).astype(int)
+        column = numpy.floor((lon - self.lonMin) / self.cellSize).astype(int)
+        inside = (0 <= row) & (row < self.bits.shape[0]) & (0 <= column) & (column < self.columns)
+        row = numpy.where(inside, row, 0)
+        column = numpy.where(inside, column, 0)
+        land = (self.bits[row, column >> 3] >> (7 - (column & 7))) & 1
+
+        water = ~(inside & land.astype(bool))
+        return water if water.ndim else bool(water)
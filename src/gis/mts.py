@@ -85,20 +85,49 @@ class MTSLayer(QWidget):
         self.painter = QPainter()
 
     def download(self):
-
+        """ Fetch (from memory, disk cache or GeoServer) every tile in the required range. """
         if not self.visible:
             return  # TODO: check if obscured by another higher z layer -> dont show
-        for xTile in range(self.controller.requiredTiles['left'], self.controller.requiredTiles['right'] + 1):
-            for yTile in range(self.controller.requiredTiles['bottom'], self.controller.requiredTiles['top'] + 1):
-                layerParameters = self.controller.layerParameters[self.workspace + ':' + self.layerName]
-                # Some layers don't have capabilities details so just use World bounds
-                if len(layerParameters) == 0:
-                    bounds = self.controller.layerParameters['land:World'][str(self.controller.tileZoomIndex)]
-                else:
-                    bounds = layerParameters[str(self.controller.tileZoomIndex)]
+        requiredTiles = self.controller.requiredTiles
+        self.downloadTiles(range(requiredTiles['left'], requiredTiles['right'] + 1),
+                           range(requiredTiles['bottom'], requiredTiles['top'] + 1))
+
+    def downloadExposedTiles(self, previousTiles):
+        """
+        After a pan, the tiles that were already in view are still in memory so only the
+        columns and rows that have just scrolled into view need to be evaluated.
+        """
+        if not self.visible:
+            return
+        requiredTiles = self.controller.requiredTiles
+        xTiles = range(requiredTiles['left'], requiredTiles['right'] + 1)
+        yTiles = range(requiredTiles['bottom'], requiredTiles['top'] + 1)
+        exposedColumns = [x for x in xTiles if not previousTiles['left'] <= x <= previousTiles['right']]
+        exposedRows = [y for y in yTiles if not previousTiles['bottom'] <= y <= previousTiles['top']]
+        if exposedColumns:
+            self.downloadTiles(exposedColumns, yTiles)
+        if exposedRows:
+            # Corners were already covered by the exposed columns.
+            self.downloadTiles([x for x in xTiles if x not in exposedColumns], exposedRows)
+
+    def downloadTiles(self, xTiles, yTiles, tileZoomIndex=None):
+        """
+        Make sure each tile in the given columns/rows is in memory, loading it if required.
+        Uses the current raster zoom level unless another one is given.
+        """
+        if tileZoomIndex is None:
+            tileZoomIndex = self.controller.tileZoomIndex
+        layerParameters = self.controller.layerParameters[self.workspace + ':' + self.layerName]
+        # Some layers don't have capabilities details so just use World bounds
+        if len(layerParameters) == 0:
+            bounds = self.controller.layerParameters['land:World'][str(tileZoomIndex)]
+        else:
+            bounds = layerParameters[str(tileZoomIndex)]
+        for xTile in xTiles:
+            for yTile in yTiles:
                 if bounds['MinTileCol'] < xTile < bounds['MaxTileCol'] and \
                         bounds['MinTileRow'] < yTile < bounds['MaxTileRow']:
-                    grab = TileKey(self.controller.tileZoomIndex, xTile, yTile)
+                    grab = TileKey(tileZoomIndex, xTile, yTile)
                     if grab not in self.tilePixmaps:
                         if preferences.USE_GEOSERVER:
                             tilePath = f'{preferences.CACHE_PATH}{os.sep}' + \
@@ -157,23 +186,46 @@ class MTSLayer(QWidget):
     def render(self):
         """
         This takes whatever tiles are in the range of tiles for GPS coordinates and fills them IF
-        the tile lies within the the canvas size.
+        the tile lies within the the canvas size. Only the visible range is looked up so the cost
+        of a repaint does not grow with the number of tiles held in memory.
         """
         width = self.controller.canvasSize.width()
         height = self.controller.canvasSize.height()
-        for tileKey, pic in self.tilePixmaps.items():
-            # only draw if it's in the visible map
-            if self.controller.requiredTiles['left'] <= tileKey.x <= self.controller.requiredTiles['right'] and \
-                    self.controller.requiredTiles['bottom'] <= tileKey.y <= self.controller.requiredTiles['top']:
-                tcX = self.controller.requiredTiles['left']
-                tcY = self.controller.requiredTiles['top']
-                offsetX = width / 2 - (self.controller.centrePoint.x() - tcX) * TILE_DIMENSION
-                offsetY = height / 2 + (self.controller.centrePoint.y() - (tcY + 1)) * TILE_DIMENSION
-
-                xPos = (tileKey.x - self.controller.requiredTiles['left']) * TILE_DIMENSION
-                yPos = (self.controller.requiredTiles['top'] - tileKey.y) * TILE_DIMENSION
+        requiredTiles = self.controller.requiredTiles
+        tcX = requiredTiles['left']
+        tcY = requiredTiles['top']
+        offsetX = width / 2 - (self.controller.centrePoint.x() - tcX) * TILE_DIMENSION
+        offsetY = height / 2 + (self.controller.centrePoint.y() - (tcY + 1)) * TILE_DIMENSION
+        for xTile in range(requiredTiles['left'], requiredTiles['right'] + 1):
+            for yTile in range(requiredTiles['bottom'], requiredTiles['top'] + 1):
+                xPos = (xTile - tcX) * TILE_DIMENSION
+                yPos = (tcY - yTile) * TILE_DIMENSION
                 box = QRect(xPos + offsetX, yPos + offsetY, TILE_DIMENSION, TILE_DIMENSION)
-                self.painter.drawPixmap(box, pic)
+                pic = self.tilePixmaps.get(TileKey(self.controller.tileZoomIndex, xTile, yTile))
+                if pic is not None:
+                    self.painter.drawPixmap(box, pic)
+                else:
+                    self.renderPreview(box, xTile, yTile)
+
+    def renderPreview(self, box, xTile, yTile):
+        """
+        Until a tile is available, fill its box with the matching part of a lower resolution
+        tile if one is in memory. Each zoom level splits a tile into 2 x 2 tiles.
+        """
+        for levels in range(1, preferences.PREVIEW_ZOOM_LEVELS + 1):
+            pic = self.tilePixmaps.get(TileKey(self.controller.tileZoomIndex - levels,
+                                               xTile >> levels,
+                                               yTile >> levels))
+            if pic is not None:
+                split = 1 << levels
+                size = TILE_DIMENSION / split
+                # tile rows count up from the bottom, image rows count down from the top
+                source = QRect((xTile % split) * size,
+                               (split - 1 - yTile % split) * size,
+                               size,
+                               size)
+                self.painter.drawPixmap(box, pic, source)
+                return
 
     def showHide(self, showHide):
         """ Show or hide this layer."""
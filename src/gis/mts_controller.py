@@ -1,19 +1,24 @@
-import json
+from collections import namedtuple
 from math import trunc, floor, radians, sin, cos, atan2, sqrt, atan, tan
 from urllib import request
 
-from PySide2.QtCore import QPointF, Qt, QRect
+from PySide2.QtCore import QPointF, Qt, QRect, QTimer
 from PySide2.QtWidgets import QGraphicsView
 from bs4 import BeautifulSoup
-from owslib.wms import WebMapService
+import numpy
 import pyproj
 from shapely.affinity import scale
 
+from gis.bathymetry import BathymetrySampler
+from graphics.render_scheduler import RenderScheduler
 import preferences
 
 # tile size in pixels
 TILE_DIMENSION = 256
 
+# Constructing a Geod is expensive so share one.
+WGS84_GEOD = pyproj.Geod(ellps='WGS84')
+
 
 def distanceBetweenTwoPoints(lat1, lon1, lat2, lon2):
     """
@@ -87,8 +92,7 @@ def angleBetweenTwoPoints(lat1, lon1, lat2, lon2):
     """
     Calculate the bearing from one location to another.
     """
-    g = pyproj.Geod(ellps='WGS84')
-    (az12, _, _) = g.inv(lon1, lat1, lon2, lat2)
+    (az12, _, _) = WGS84_GEOD.inv(lon1, lat1, lon2, lat2)
 
     return az12
 
@@ -178,6 +182,170 @@ def vincentyDirect(phi1, lembda1, alpha12, s):
     return QPointF(phi2, lambda2)
 
 
+def distanceBetweenPointsArray(lat1, lon1, lat2, lon2):
+    """
+    Vectorised version of distanceBetweenTwoPoints() for solving many point pairs at once.
+    Arguments are arrays (or scalars, which are broadcast) of decimal degrees. Each pair
+    stops iterating as soon as it has converged; pairs that fail to converge (where
+    distanceBetweenTwoPoints() returns None) or have a non-finite input are NaN.
+    """
+    # WGS 84
+    a = 6378137.0
+    f = 0.003352810681  # 1/298.25722210
+    b = 6356752.314245  # meters; b = (1 - f)a
+
+    MAX_ITERATIONS = 200
+    CONVERGENCE_THRESHOLD = 1e-12  # .000,000,000,001
+
+    lat1, lon1, lat2, lon2 = numpy.broadcast_arrays(*[numpy.asarray(value, dtype=float)
+                                                      for value in (lat1, lon1, lat2, lon2)])
+    shape = lat1.shape
+    lat1, lon1, lat2, lon2 = [value.ravel() for value in (lat1, lon1, lat2, lon2)]
+    U1 = numpy.arctan((1 - f) * numpy.tan(numpy.radians(lat1)))
+    U2 = numpy.arctan((1 - f) * numpy.tan(numpy.radians(lat2)))
+    L = numpy.radians(lon2 - lon1)
+    Lambda = L.copy()
+
+    sinU1 = numpy.sin(U1)
+    cosU1 = numpy.cos(U1)
+    sinU2 = numpy.sin(U2)
+    cosU2 = numpy.cos(U2)
+
+    sinSigma = numpy.zeros_like(L)
+    cosSigma = numpy.zeros_like(L)
+    sigma = numpy.zeros_like(L)
+    cosSqAlpha = numpy.zeros_like(L)
+    cos2SigmaM = numpy.zeros_like(L)
+    coincident = numpy.zeros(L.shape, dtype=bool)
+    # Non-finite inputs can never converge, so they aren't iterated at all.
+    finite = numpy.isfinite(U1) & numpy.isfinite(U2) & numpy.isfinite(L)
+    active = finite.copy()
+
+    for _ in range(MAX_ITERATIONS):
+        if not active.any():
+            break
+        index = numpy.flatnonzero(active)
+        lam = Lambda[index]
+        sinLambda = numpy.sin(lam)
+        cosLambda = numpy.cos(lam)
+        s1 = sinU1[index]
+        c1 = cosU1[index]
+        s2 = sinU2[index]
+        c2 = cosU2[index]
+        sinS = numpy.sqrt((c2 * sinLambda) ** 2 + (c1 * s2 - s1 * c2 * cosLambda) ** 2)
+        isCoincident = sinS == 0
+        sinS = numpy.where(isCoincident, 1.0, sinS)
+        cosS = s1 * s2 + c1 * c2 * cosLambda
+        sig = numpy.arctan2(sinS, cosS)
+        sinAlpha = c1 * c2 * sinLambda / sinS
+        cosSqA = 1 - sinAlpha ** 2
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            cos2SM = numpy.where(cosSqA != 0, cosS - 2 * s1 * s2 / cosSqA, 0.0)
+        C = f / 16 * cosSqA * (4 + f * (4 - 3 * cosSqA))
+        newLambda = L[index] + (1 - C) * f * sinAlpha * (sig + C * sinS *
+                                                          (cos2SM + C * cosS *
+                                                           (-1 + 2 * cos2SM ** 2)))
+
+        sinSigma[index] = sinS
+        cosSigma[index] = cosS
+        sigma[index] = sig
+        cosSqAlpha[index] = cosSqA
+        cos2SigmaM[index] = cos2SM
+        Lambda[index] = newLambda
+        coincident[index] = isCoincident
+
+        # Coincident points and converged pairs drop out of the next iteration.
+        done = isCoincident | (numpy.abs(newLambda - lam) < CONVERGENCE_THRESHOLD)
+        active[index[done]] = False
+
+    uSq = cosSqAlpha * (a ** 2 - b ** 2) / (b ** 2)
+    A = 1 + uSq / 16384 * (4096 + uSq * (-768 + uSq * (320 - 175 * uSq)))
+    B = uSq / 1024 * (256 + uSq * (-128 + uSq * (74 - 47 * uSq)))
+    deltaSigma = B * sinSigma * (cos2SigmaM + B / 4 * (cosSigma *
+                                                       (-1 + 2 * cos2SigmaM ** 2) - B / 6 * cos2SigmaM *
+                                                       (-3 + 4 * sinSigma ** 2) * (-3 + 4 * cos2SigmaM ** 2)))
+    s = b * A * (sigma - deltaSigma)
+    s[coincident] = 0.0
+    s[active | ~finite] = numpy.nan  # failure to converge
+
+    return s.reshape(shape)
+
+
+def vincentyDirectArray(phi1, lembda1, alpha12, s):
+    """
+    Vectorised version of vincentyDirect() for projecting many points at once. Arguments are
+    arrays (or scalars, which are broadcast) in decimal degrees and metres. Each point stops
+    iterating as soon as it has converged; points with a non-finite input, or that haven't
+    converged after MAX_ITERATIONS, are NaN.
+    Returns (latitudes, longitudes) as arrays in decimal degrees.
+    """
+    a = 6378137.0
+    f = 0.003352810681  # 1/298.25722210
+    b = a * (1.0 - f)
+
+    MAX_ITERATIONS = 200
+
+    phi1, lembda1, alpha12, s = numpy.broadcast_arrays(*[numpy.asarray(value, dtype=float)
+                                                         for value in (phi1, lembda1, alpha12, s)])
+    shape = phi1.shape
+    phi1, lembda1, alpha12, s = [value.ravel() for value in (phi1, lembda1, alpha12, s)]
+    phi1 = numpy.radians(phi1)
+    lembda1 = numpy.radians(lembda1)
+    alpha12 = numpy.mod(numpy.radians(alpha12), 2 * numpy.pi)
+
+    TanU1 = (1 - f) * numpy.tan(phi1)
+    U1 = numpy.arctan(TanU1)
+    sigma1 = numpy.arctan2(TanU1, numpy.cos(alpha12))
+    Sinalpha = numpy.cos(U1) * numpy.sin(alpha12)
+    cosalpha_sq = 1.0 - Sinalpha * Sinalpha
+    u2 = cosalpha_sq * (a * a - b * b) / (b * b)
+    A = 1.0 + (u2 / 16384) * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = (u2 / 1024) * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    # Starting with the approximate value
+    sigma = s / (b * A)
+    two_sigma_m = numpy.zeros_like(sigma)
+    # A zero distance has nothing to solve and a non-finite input can never converge.
+    active = (sigma != 0) & numpy.isfinite(sigma) & numpy.isfinite(sigma1) & numpy.isfinite(B)
+
+    for _ in range(MAX_ITERATIONS):
+        if not active.any():
+            break
+        index = numpy.flatnonzero(active)
+        sig = sigma[index]
+        tsm = 2 * sigma1[index] + sig
+        Bi = B[index]
+        delta_sigma = Bi * numpy.sin(sig) * (numpy.cos(tsm)
+                                             + (Bi / 4) * (numpy.cos(sig) *
+                                                           (-1 + 2 * numpy.cos(tsm) ** 2 -
+                                                            (Bi / 6) * numpy.cos(tsm) *
+                                                            (-3 + 4 * numpy.sin(sig) ** 2) *
+                                                            (-3 + 4 * numpy.cos(tsm) ** 2))))
+        newSigma = s[index] / (b * A[index]) + delta_sigma
+        two_sigma_m[index] = tsm
+        sigma[index] = newSigma
+        done = numpy.abs((sig - newSigma) / newSigma) <= 1.0e-9
+        active[index[done]] = False
+
+    sinU1 = numpy.sin(U1)
+    cosU1 = numpy.cos(U1)
+    sinSigma = numpy.sin(sigma)
+    cosSigma = numpy.cos(sigma)
+    cosAlpha12 = numpy.cos(alpha12)
+    phi2 = numpy.arctan2((sinU1 * cosSigma + cosU1 * sinSigma * cosAlpha12),
+                         ((1 - f) * numpy.sqrt(Sinalpha ** 2 +
+                                               (sinU1 * sinSigma - cosU1 * cosSigma * cosAlpha12) ** 2)))
+    lembda = numpy.arctan2((sinSigma * numpy.sin(alpha12)),
+                           (cosU1 * cosSigma - sinU1 * sinSigma * cosAlpha12))
+    C = (f / 16) * cosalpha_sq * (4 + f * (4 - 3 * cosalpha_sq))
+    omega = lembda - (1 - C) * f * Sinalpha * \
+        (sigma + C * sinSigma * (numpy.cos(two_sigma_m) + C * cosSigma * (-1 + 2 * numpy.cos(two_sigma_m) ** 2)))
+    lambda2 = lembda1 + omega
+    phi2[active] = numpy.nan  # failure to converge
+    lambda2[active] = numpy.nan
+
+    return numpy.degrees(phi2).reshape(shape), numpy.degrees(lambda2).reshape(shape)
+
+
 def tileToGeographic(tx, ty, zoom):
     """
     :param tx: floating point x coordinate, integer part is the tile number,
@@ -217,6 +385,108 @@ def geographicToTile(latitude, longitude, zoom):
     return QPointF(tx * zn * 2, ty * zn)
 
 
+class ViewState(namedtuple('ViewState', ['tileZoomIndex', 'scaleX', 'offsetX', 'scaleY', 'offsetY'])):
+    """
+    An immutable snapshot of the view, recomputed only on pan, zoom or resize. The tiles are
+    equirectangular so converting between lat/lon and canvas x, y is just a scale and an
+    offset on each axis:
+        x = scaleX * lon + offsetX
+        y = scaleY * lat + offsetY
+    """
+    __slots__ = ()
+
+    @classmethod
+    def create(cls, centrePoint, tileZoomIndex, canvasWidth, canvasHeight):
+        """ Work out the coefficients for a centre (in tile coordinates), raster zoom and canvas size. """
+        # There are 2^(zoom+1) x tiles over 360 degrees and 2^zoom y tiles over 180 degrees.
+        pixelsPerDegree = TILE_DIMENSION * (1 << tileZoomIndex) / 180.0
+        offsetX = 180.0 * pixelsPerDegree - centrePoint.x() * TILE_DIMENSION + canvasWidth / 2
+        # y grows down the canvas but up the tiles
+        offsetY = -90.0 * pixelsPerDegree + centrePoint.y() * TILE_DIMENSION + canvasHeight / 2
+
+        return cls(tileZoomIndex, pixelsPerDegree, offsetX, -pixelsPerDegree, offsetY)
+
+    def toCanvas(self, lat, lng):
+        """ Latitude/longitude to canvas x, y. """
+        return self.scaleX * lng + self.offsetX, self.scaleY * lat + self.offsetY
+
+    def toGeographic(self, x, y):
+        """ Canvas x, y to latitude/longitude. """
+        return (y - self.offsetY) / self.scaleY, (x - self.offsetX) / self.scaleX
+
+    def toCanvasArray(self, latLons):
+        """ An (N, 2) array of lat/lon to an (N, 2) array of canvas x, y. """
+        latLons = numpy.asarray(latLons, dtype=float).reshape(-1, 2)
+        xy = numpy.empty_like(latLons)
+        xy[:, 0] = latLons[:, 1] * self.scaleX + self.offsetX
+        xy[:, 1] = latLons[:, 0] * self.scaleY + self.offsetY
+        return xy
+
+    def toGeographicArray(self, xy):
+        """ An (N, 2) array of canvas x, y to an (N, 2) array of lat/lon. """
+        xy = numpy.asarray(xy, dtype=float).reshape(-1, 2)
+        latLons = numpy.empty_like(xy)
+        latLons[:, 0] = (xy[:, 1] - self.offsetY) / self.scaleY
+        latLons[:, 1] = (xy[:, 0] - self.offsetX) / self.scaleX
+        return latLons
+
+
+class FlyToAnimation:
+    """
+    Animates a move to a new centre and zoom. The final tiles and a lower resolution preview
+    are fetched before it starts, the frames in between only repaint what is in memory: while
+    it runs the controller doesn't download anything, even if a full tile update is asked for.
+    """
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.startCentre = None
+        self.endCentre = None
+        self.startZoom = 0
+        self.endZoom = 0
+        self.step = 0
+        self.steps = 1
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.nextFrame)
+
+    def start(self, centre, vectorZoom):
+        controller = self.controller
+        self.timer.stop()
+        self.startCentre = controller.centreCoordinate
+        self.startZoom = controller.view.vectorZoom
+        self.endCentre = centre
+        self.endZoom = vectorZoom
+
+        finalTileZoomIndex = floor(vectorZoom)
+        controller.prefetch(centre, finalTileZoomIndex)
+        controller.prefetch(centre, max(1, finalTileZoomIndex - preferences.PREVIEW_ZOOM_LEVELS))
+
+        frameInterval = int(1000 / preferences.MAX_FRAME_RATE)
+        self.steps = max(1, round(preferences.FLY_TO_DURATION / frameInterval))
+        self.step = 0
+        self.timer.start(frameInterval)
+
+    def isRunning(self):
+        return self.timer.isActive()
+
+    def nextFrame(self):
+        self.step += 1
+        if self.step >= self.steps:
+            self.timer.stop()
+            self.controller.setView(self.endCentre, self.endZoom)
+            return
+
+        t = self.step / self.steps
+        self.controller.centreCoordinate = QPointF(
+            self.startCentre.x() + (self.endCentre.x() - self.startCentre.x()) * t,
+            self.startCentre.y() + (self.endCentre.y() - self.startCentre.y()) * t)
+        self.controller.view.vectorZoom = self.startZoom + (self.endZoom - self.startZoom) * t
+        self.controller.tileZoomIndex = floor(self.controller.view.vectorZoom)
+        self.controller.getTiles()
+        self.controller.view.renderScheduler.requestUpdate(RenderScheduler.REPAINT)
+        self.controller.view.update()
+
+
 class MTSController:
 
     def __init__(self, view, canvasSize, centreCoordinate):
@@ -232,6 +502,7 @@ class MTSController:
         self.maxZoom = 19
         self.centrePoint = None
         self.requiredTiles = None
+        self.viewState = None
 
         self.wfsLayers = {}
         self.aust = {}
@@ -244,6 +515,9 @@ class MTSController:
         self.allLayers = []
         self.layerParameters = {}
 
+        self.flyToAnimation = FlyToAnimation(self)
+        self.bathymetry = BathymetrySampler()
+
         self.getLayerParameters()
         self.getTiles()
 
@@ -327,7 +601,7 @@ class MTSController:
         """
         self.tileZoomIndex = floor(self.view.vectorZoom)
         self.getTiles()
-        self.update()
+        self.requestUpdate()
 
     def updateCentre(self, centre):
         """
@@ -336,7 +610,7 @@ class MTSController:
         """
         self.centreCoordinate = centre
         self.getTiles()
-        self.update()
+        self.requestUpdate()
 
     def updateCanvasSize(self, width, height):
         """
@@ -344,10 +618,25 @@ class MTSController:
         and therefore required tiles might change as well.
         """
         self.canvasSize = QRect(0, 0, width, height)
-        self.update()
+        self.getTiles()
+        self.requestUpdate()
+
+    def requestUpdate(self):
+        """ Tiles are resolved and rendered once per frame rather than on every change. """
+        self.view.renderScheduler.requestUpdate(RenderScheduler.TILES)
+
+    def repaint(self):
+        """ Redraw the tiles already in memory at the current centre/zoom without downloading any. """
+        for tileLayer in self.allLayers:
+            if tileLayer.visible:
+                tileLayer.update()
+        self.view.scene.update()
 
     def update(self):
         """ Download and render all layers based on current lat/lon, zoom and canvas size. """
+        if self.flyToAnimation.isRunning():
+            self.repaint()  # the final view is downloaded when the animation lands
+            return
         for tileLayer in self.allLayers:
             if tileLayer.visible:
                 tileLayer.download()
@@ -360,19 +649,30 @@ class MTSController:
         Based on the location of the mouse and the current raster zoom level,
         determine the bounds of the tiles that are required to be displayed.
         """
-        self.centrePoint = geographicToTile(self.centreCoordinate.x(),
-                                            self.centreCoordinate.y(),
-                                            self.tileZoomIndex)
+        self.centrePoint, self.requiredTiles = self.tileRange(self.centreCoordinate, self.tileZoomIndex)
+        self.viewState = ViewState.create(self.centrePoint,
+                                          self.tileZoomIndex,
+                                          self.canvasSize.width(),
+                                          self.canvasSize.height())
 
-        left = trunc(self.centrePoint.x() - self.canvasSize.width() / (TILE_DIMENSION * 2))
-        right = trunc(self.centrePoint.x() + self.canvasSize.width() / (TILE_DIMENSION * 2))
-        bottom = trunc(self.centrePoint.y() - self.canvasSize.height() / (TILE_DIMENSION * 2))
-        top = trunc(self.centrePoint.y() + self.canvasSize.height() / (TILE_DIMENSION * 2))
+    def tileRange(self, centreCoordinate, tileZoomIndex):
+        """
+        The tile coordinates of a location and the bounds of the tiles required to fill
+        the canvas around it at a given raster zoom level.
+        """
+        centrePoint = geographicToTile(centreCoordinate.x(),
+                                       centreCoordinate.y(),
+                                       tileZoomIndex)
 
-        self.requiredTiles = {'left': left,
-                              'right': right,
-                              'top': top,
-                              'bottom': bottom}
+        left = trunc(centrePoint.x() - self.canvasSize.width() / (TILE_DIMENSION * 2))
+        right = trunc(centrePoint.x() + self.canvasSize.width() / (TILE_DIMENSION * 2))
+        bottom = trunc(centrePoint.y() - self.canvasSize.height() / (TILE_DIMENSION * 2))
+        top = trunc(centrePoint.y() + self.canvasSize.height() / (TILE_DIMENSION * 2))
+
+        return centrePoint, {'left': left,
+                             'right': right,
+                             'top': top,
+                             'bottom': bottom}
 
     def getBoundary(self):
         """ The lat/lon of the visible map. """
@@ -382,16 +682,8 @@ class MTSController:
                      (self.requiredTiles['top'] - self.requiredTiles['bottom']) * 256)
 
     def toCanvasCoordinates(self, lat, lng):
-        """ Convert canvas x, y to geographic lat/lon. """
-        tcX = self.requiredTiles['left']
-        tcY = self.requiredTiles['top']
-        offsetX = self.canvasSize.width() / 2 - (self.centrePoint.x() - tcX) * TILE_DIMENSION
-        offsetY = self.canvasSize.height() / 2 + (self.centrePoint.y() - (tcY + 1)) * TILE_DIMENSION
-
-        pt = geographicToTile(lat, lng, self.tileZoomIndex)
-
-        x = ((pt.x() - self.requiredTiles['left']) * TILE_DIMENSION) + offsetX
-        y = ((self.requiredTiles['top'] - pt.y() + 1) * TILE_DIMENSION) + offsetY
+        """ Convert geographic lat/lon to canvas x, y. """
+        x, y = self.viewState.toCanvas(lat, lng)
 
         return QPointF(x, y)
 
@@ -399,35 +691,29 @@ class MTSController:
         """
         Convert a given canvas x,y coordinate into latitude/longitude.
         """
-        tcX = self.requiredTiles['left']
-        tcY = self.requiredTiles['top']
-        offsetX = self.canvasSize.width() / 2 - (self.centrePoint.x() - tcX) * TILE_DIMENSION
-        offsetY = self.canvasSize.height() / 2 + (self.centrePoint.y() - (tcY + 1)) * TILE_DIMENSION
+        lat, lon = self.viewState.toGeographic(x, y)
 
-        ptX = ((x - offsetX) / TILE_DIMENSION) + self.requiredTiles['left']
-        ptY = 1 + self.requiredTiles['top'] - ((y - offsetY) / TILE_DIMENSION)
+        return QPointF(lat, lon)
 
-        pt = tileToGeographic(ptX, ptY, self.tileZoomIndex)
+    def toCanvasCoordinatesArray(self, latLons):
+        """
+        Convert an (N, 2) array of lat/lon to an (N, 2) array of canvas x, y. Use this instead
+        of toCanvasCoordinates() when moving lots of points with each pan/zoom.
+        """
+        return self.viewState.toCanvasArray(latLons)
 
-        return QPointF(pt.x(), pt.y())
+    def toGeographicalCoordinatesArray(self, xy):
+        """ Convert an (N, 2) array of canvas x, y to an (N, 2) array of lat/lon. """
+        return self.viewState.toGeographicArray(xy)
 
     def depthAtLatLon(self, lat, lon):
         """
-        Uses bathymetric heightmap database from GeoServer to determine depth at a location.
+        Uses a local copy of the bathymetric heightmap from GeoServer to determine depth at a
+        location. lat/lon can also be arrays to look up many locations at once. Areas not copied
+        yet are NaN and are downloaded in the background; self.bathymetry.gridLoaded is emitted
+        when they can be looked up again.
         """
-        wms = WebMapService('http://{}:{}/geoserver/wms'.format(preferences.GEOSERVER_IP, preferences.GEOSERVER_PORT))
-        response = wms.getfeatureinfo(layers=['Oceanographic:World_Bathymetric_Heightmap'],
-                                      srs='EPSG:4326',
-                                      bbox=(lon, lat - 1.1096191406, lon + 1.1096191406, lat),
-                                      # 1.1096191406 is a magic number
-                                      size=(self.canvasSize.width(), self.canvasSize.height()),
-                                      format='image/jpeg',
-                                      query_layers=['Oceanographic:World_Bathymetric_Heightmap'],
-                                      info_format='application/json',
-                                      xy=(50, 50))
-        info = json.loads(response.read())
-
-        return info['features'][0]['properties']['Elevation_relative_to_sea_level']
+        return self.bathymetry.sample(lat, lon)
 
     def moveToGeographicLocation(self, lat, lon):
         """
@@ -436,6 +722,38 @@ class MTSController:
         self.centreCoordinate = QPointF(lat, lon)
         self.updateCentre(self.centreCoordinate)
 
+    def flyTo(self, lat, lon, vectorZoom=None, animate=False):
+        """
+        Moves the map to a location and zoom level in a single step so the tiles are only
+        resolved once, for the final view. If animated, only the final tiles and a low
+        resolution preview are fetched; the frames in between are drawn from those.
+        """
+        if vectorZoom is None:
+            vectorZoom = self.view.vectorZoom
+
+        if animate:
+            self.flyToAnimation.start(QPointF(lat, lon), vectorZoom)
+        else:
+            self.setView(QPointF(lat, lon), vectorZoom)
+
+    def setView(self, centre, vectorZoom):
+        """ Set the centre and zoom together and request one render of the result. """
+        self.centreCoordinate = centre
+        self.view.vectorZoom = vectorZoom
+        self.tileZoomIndex = floor(vectorZoom)
+        self.getTiles()
+        self.requestUpdate()
+        self.view.update()
+
+    def prefetch(self, centre, tileZoomIndex):
+        """ Load the tiles for a view that will be shown soon so it can be drawn straight away. """
+        _, requiredTiles = self.tileRange(centre, tileZoomIndex)
+        for tileLayer in self.allLayers:
+            if tileLayer.visible:
+                tileLayer.downloadTiles(range(requiredTiles['left'], requiredTiles['right'] + 1),
+                                        range(requiredTiles['bottom'], requiredTiles['top'] + 1),
+                                        tileZoomIndex)
+
     def moveToCanvasLocation(self, x, y):
         """
         Moves the map at the current zoom level to the location specified.
@@ -469,8 +787,7 @@ class MTSController:
                                             self.centreCoordinate.y())
             self.updateCentre(self.centreCoordinate)
 
-        self.updateCanvasSize(self.canvasSize.width(), self.canvasSize.height())
-        self.view.scene.update()
+        self.view.update()
 
     def keyReleaseEvent(self, event):
         pass
@@ -522,8 +839,24 @@ class MTSController:
         factor = 2.0
         panRestrictor = factor ** self.view.vectorZoom
         dxDy = QPointF(delta)
+        previousTiles = self.requiredTiles
         self.centreCoordinate = QPointF(self.centreCoordinate.x() + dxDy.y() / panRestrictor,
                                         self.centreCoordinate.y() - dxDy.x() / panRestrictor)
-        self.updateCentre(self.centreCoordinate)
+        self.getTiles()
+        self.view.renderScheduler.requestPan(previousTiles)
 
         self.view.update()
+
+    def pan(self, previousTiles):
+        """
+        The zoom has not changed so the tiles already in memory are simply repainted at their
+        new offset. Only the column/row that has just been exposed is checked for download.
+        """
+        if self.flyToAnimation.isRunning():
+            self.repaint()
+            return
+        for tileLayer in self.allLayers:
+            if tileLayer.visible:
+                if previousTiles != self.requiredTiles:
+                    tileLayer.downloadExposedTiles(previousTiles)
+                tileLayer.update()
@@ -0,0 +1,59 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from PySide2.QtCore import QObject, Signal
+
+import preferences
+
+
+class NCWMSQueryEngine(QObject):
+    """
+    Runs ncWMS point queries (GetFeatureInfo etc.) on a pool of worker threads so a batch of
+    them costs roughly one round trip rather than one round trip per point. The number of
+    requests hitting the server at once is capped, and a query that is already in flight is
+    shared rather than sent again.
+    """
+    resultReady = Signal(object, object)  # key, value
+
+    def __init__(self, maxInFlight=preferences.NCWMS_MAX_IN_FLIGHT):
+        """
+        Constructor
+        """
+        super().__init__()
+
+        self.executor = ThreadPoolExecutor(max_workers=maxInFlight, thread_name_prefix='ncwms')
+        self.inFlight = {}
+        self.lock = threading.RLock()  # a finished Future runs its callback straight away
+
+    def submit(self, key, function, *args):
+        """
+        Queue function(*args) and return a Future for its result. key identifies the query;
+        while a query with the same key is running its Future is returned instead.
+        resultReady is emitted with the key and value once it completes.
+        """
+        with self.lock:
+            future = self.inFlight.get(key)
+            if future is None:
+                future = self.executor.submit(function, *args)
+                self.inFlight[key] = future
+                future.add_done_callback(lambda done: self.finished(key, done))
+        return future
+
+    def finished(self, key, future):
+        """ Runs on the worker thread; Qt queues the signal across to the GUI thread. """
+        with self.lock:
+            self.inFlight.pop(key, None)
+        if not future.cancelled() and future.exception() is None:
+            self.resultReady.emit(key, future.result())
+
+    def map(self, queries):
+        """
+        Run a batch of (key, function, args) queries concurrently and block until they have
+        all finished. Results are returned in the same order as the queries. This waits on the
+        network, so it's for worker threads; the GUI thread uses submit() and resultReady.
+        """
+        futures = [self.submit(key, function, *args) for key, function, args in queries]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
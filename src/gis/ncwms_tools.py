@@ -1,24 +1,229 @@
+import json
+from threading import Lock
 import urllib.request
 
 from cachetools import cached, TTLCache
+import numpy
 
+from gis.geo_grid import GeoGrid, ProfileGrid
+from gis.point_cache import PointCache
 import preferences
 import xml.etree.ElementTree as ET
 
+SOUND_SPEED_LAYER = '003/soundspeed'
+MAX_DEPTH_LAYER = '003/max_depth'
+REQUEST_TIMEOUT = 30  # seconds
+
+# The caches are used from the query engine's and the fill/refinement workers' threads.
+fieldCache = TTLCache(maxsize=50, ttl=300)
+fieldCacheLock = Lock()
+layerDetailsCache = TTLCache(maxsize=10, ttl=3600)
+layerDetailsCacheLock = Lock()
+timestepsCache = TTLCache(maxsize=100, ttl=3600)  # one entry per layer per day
+timestepsCacheLock = Lock()
+pointCache = PointCache(preferences.NCWMS_CACHE_PATH)
+
+
+def axisValues(axis):
+    """ The coordinates along a CoverageJSON axis, given either as a list or as start/stop/num. """
+    if 'values' in axis:
+        return numpy.asarray(axis['values'], dtype=float)
+    return numpy.linspace(axis['start'], axis['stop'], axis['num'])
+
+
+def parseCoverageJson(coverage):
+    """
+    Turn the CoverageJSON ncWMS2 returns for a GetMap into a GeoGrid. Any time/elevation axes
+    are single valued for a GetMap so they are dropped. Missing values become NaN.
+    """
+    axes = coverage['domain']['axes']
+    lons = axisValues(axes['x'])
+    lats = axisValues(axes['y'])
+
+    dataRange = next(iter(coverage['ranges'].values()))
+    values = numpy.array([numpy.nan if value is None else value for value in dataRange['values']],
+                         dtype=numpy.float32).reshape(dataRange['shape'])
+    axisNames = dataRange['axisNames']
+    values = values.reshape([size for name, size in zip(axisNames, dataRange['shape']) if name in ('y', 'x')])
+    if [name for name in axisNames if name in ('y', 'x')] == ['x', 'y']:
+        values = values.T
+
+    # GeoGrid wants the northern row first.
+    if len(lats) > 1 and lats[0] < lats[-1]:
+        lats = lats[::-1]
+        values = values[::-1]
+
+    # Axis values are cell centres, the grid bbox is the outside edge of the cells.
+    dLon = abs(lons[-1] - lons[0]) / max(len(lons) - 1, 1)
+    dLat = abs(lats[0] - lats[-1]) / max(len(lats) - 1, 1)
+    return GeoGrid(numpy.ascontiguousarray(values),
+                   lonMin=lons.min() - dLon / 2, latMin=lats.min() - dLat / 2,
+                   lonMax=lons.max() + dLon / 2, latMax=lats.max() + dLat / 2)
+
+
+@cached(fieldCache, lock=fieldCacheLock)
+def getFieldGrid(layerName, lonMin, latMin, lonMax, latMax, elevation, width, height, time=preferences.NCWMS_TIME):
+    """
+    Pull the values of an ncWMS layer over a whole bbox in one GetMap request, rather than
+    one GetFeatureInfo request per point.
+    """
+    mapRequest = 'http://{}:{}/ncWMS2/wms?'.format(preferences.GEOSERVER_IP, preferences.GEOSERVER_PORT) + \
+                 'LAYERS={}&'.format(layerName) + \
+                 'STYLES=default-scalar/default&' + \
+                 'SERVICE=WMS&' + \
+                 'VERSION=1.1.1&' + \
+                 'REQUEST=GetMap&' + \
+                 'BBOX={},{},{},{}&'.format(lonMin, latMin, lonMax, latMax) + \
+                 'HEIGHT={}&'.format(height) + \
+                 'WIDTH={}&'.format(width) + \
+                 'FORMAT=application/prs.coverage+json&' + \
+                 'SRS=EPSG:4326&' + \
+                 'TIME={}&'.format(time) + \
+                 'ELEVATION={}'.format(elevation)
+    url = urllib.request.urlopen(mapRequest, timeout=REQUEST_TIMEOUT)
+    return parseCoverageJson(json.loads(url.read()))
+
+
+@cached(layerDetailsCache, lock=layerDetailsCacheLock)
+def getLayerDetails(layerName):
+    """ ncWMS2's layerDetails metadata for a layer (depth levels, dates with data etc.). """
+    metadataRequest = 'http://{}:{}/ncWMS2/wms?'.format(preferences.GEOSERVER_IP, preferences.GEOSERVER_PORT) + \
+                      'REQUEST=GetMetadata&' + \
+                      'ITEM=layerDetails&' + \
+                      'LAYERNAME={}'.format(layerName)
+    url = urllib.request.urlopen(metadataRequest, timeout=REQUEST_TIMEOUT)
+    return json.loads(url.read())
+
+
+def getElevations(layerName):
+    """ The ELEVATION values a layer has data for. """
+    return tuple(getLayerDetails(layerName)['zaxis']['values'])
+
+
+@cached(timestepsCache, lock=timestepsCacheLock)
+def getTimesteps(layerName, day):
+    """ The times of day (e.g. '00:00:00.000Z') a layer has data for on a day given as YYYY-MM-DD. """
+    metadataRequest = 'http://{}:{}/ncWMS2/wms?'.format(preferences.GEOSERVER_IP, preferences.GEOSERVER_PORT) + \
+                      'REQUEST=GetMetadata&' + \
+                      'ITEM=timesteps&' + \
+                      'LAYERNAME={}&'.format(layerName) + \
+                      'DAY={}'.format(day)
+    url = urllib.request.urlopen(metadataRequest, timeout=REQUEST_TIMEOUT)
+    return tuple(json.loads(url.read())['timesteps'])
+
+
+def getTimes(layerName, start, end):
+    """
+    The TIME values a layer has data for from start to end inclusive, in order. Times are ISO
+    8601 strings in the form NCWMS_TIME is in, so they compare as strings.
+    """
+    times = []
+    for year, months in getLayerDetails(layerName).get('datesWithData', {}).items():
+        for month, days in months.items():
+            for day in days:
+                # The months in datesWithData count from 0.
+                date = '{:04d}-{:02d}-{:02d}'.format(int(year), int(month) + 1, int(day))
+                if start[:10] <= date <= end[:10]:
+                    times.extend(date + 'T' + timestep for timestep in getTimesteps(layerName, date)
+                                 if start <= date + 'T' + timestep <= end)
+    return sorted(times)
+
+
+def getProfileGrid(layerName, lonMin, latMin, lonMax, latMax, width, height, queryEngine,
+                   time=preferences.NCWMS_TIME):
+    """
+    Every depth level of a layer over a bbox. The levels are fetched as concurrent GetMap
+    requests and stacked into a ProfileGrid. This waits for them all, so call it from a worker
+    thread (e.g. a ProfileLoader or the SpirographFillWorker).
+    """
+    elevations = getElevations(layerName)
+    futures = [queryEngine.submit((layerName, lonMin, latMin, lonMax, latMax, elevation, width, height, time),
+                                  getFieldGrid, layerName, lonMin, latMin, lonMax, latMax, elevation, width, height,
+                                  time)
+               for elevation in elevations]
+    grids = [future.result() for future in futures]
+    return ProfileGrid(elevations, GeoGrid(numpy.stack([grid.values for grid in grids]), *grids[0].bbox()))
+
+
+def featureInfoRequest(layerName, bbox, width, height, x, y, elevation, time=preferences.NCWMS_TIME):
+    """ The GetFeatureInfo URL for the value of a layer at pixel x, y of a width x height map of bbox. """
+    lonMin, latMin, lonMax, latMax = bbox
+    return 'http://{}:{}/ncWMS2/wms?'.format(preferences.GEOSERVER_IP, preferences.GEOSERVER_PORT) + \
+           'LAYERS={}&'.format(layerName) + \
+           'QUERY_LAYERS={}&'.format(layerName) + \
+           'STYLES=default-scalar/default&' + \
+           'SERVICE=WMS&' + \
+           'VERSION=1.1.1&' + \
+           'REQUEST=GetFeatureInfo&' + \
+           'BBOX={},{},{},{}&'.format(lonMin, latMin, lonMax, latMax) + \
+           'FEATURE_COUNT=5&' + \
+           'HEIGHT={}&'.format(height) + \
+           'WIDTH={}&'.format(width) + \
+           'FORMAT=image/png&' + \
+           'INFO_FORMAT=text/xml&' + \
+           'SRS=EPSG:4326&' + \
+           'X={}&'.format(round(x)) + \
+           'Y={}&'.format(round(y)) + \
+           'TIME={}&'.format(time) + \
+           'ELEVATION={}'.format(elevation)
+
+
+def getFeatureInfo(xmlRequest):
+    """ Make a GetFeatureInfo request and return the value it found, NaN if there is no data there. """
+    url = urllib.request.urlopen(xmlRequest, timeout=REQUEST_TIMEOUT)
+    tree = ET.fromstring(url.read())
+    try:
+        return float(tree.findall("./Feature/FeatureInfo/value")[0].text)
+    except (IndexError, TypeError, ValueError):
+        return numpy.nan
+
+
+def pixelToLatLon(bbox, width, height, x, y):
+    """ The lat/lon at the centre of pixel x, y of a width x height map of bbox. """
+    lonMin, latMin, lonMax, latMax = bbox
+    return latMax - (round(y) + 0.5) * (latMax - latMin) / height, lonMin + (round(x) + 0.5) * (lonMax - lonMin) / width
+
+
+def pointKey(layerName, lat, lon, elevation, time=preferences.NCWMS_TIME):
+    """
+    The pointCache key for a location: its cell on the NCWMS_CACHE_RESOLUTION grid, plus the
+    elevation exactly as it is requested (layers have levels less than a metre apart) and time.
+    """
+    resolution = preferences.NCWMS_CACHE_RESOLUTION
+    return layerName, round(lat / resolution), round(lon / resolution), float(elevation), time
+
+
+def getValueAtLatLon(layerName, lat, lon, elevation, time=preferences.NCWMS_TIME):
+    """
+    The value of a layer at a location, NaN if there is no data there. Each cache cell is
+    queried once with a one pixel map of just that cell; after that it is served from
+    pointCache (and from disk in later sessions).
+    """
+    key = pointKey(layerName, lat, lon, elevation, time)
+    value = pointCache.get(key)
+    if value is None:
+        _, row, column, elevation, time = key
+        resolution = preferences.NCWMS_CACHE_RESOLUTION
+        lat, lon = row * resolution, column * resolution
+        bbox = (lon - resolution / 2, lat - resolution / 2, lon + resolution / 2, lat + resolution / 2)
+        value = getFeatureInfo(featureInfoRequest(layerName, bbox, 1, 1, 0, 0, elevation, time))
+        pointCache.put(key, value)
+    return value
 
-soundSpeedCache = TTLCache(maxsize=1000, ttl=300)
-depthCache = TTLCache(maxsize=1000, ttl=300)
 
 class NCWMSTools:
     """
     These tools are used to interrogate an ncWMS or NetCDF data source and return values that can be used,
     for example, to determine the speed of sound at a specified location and depth.
     """
-    def __init__(self, view):
+    def __init__(self, view, time=preferences.NCWMS_TIME):
         """
         Constructor
         """
         self.view = view
+        self.queryEngine = view.ncwmsQueryEngine
+        self.landMask = view.landMask
+        self.time = time  # the ncWMS TIME every query is for
 
         self.maxDepth = 155
         self.visible = True
@@ -32,84 +237,110 @@ class NCWMSTools:
         self.latMin = view.mapController.toGeographicalCoordinates(canvasRect.x(), 0+canvasRect.height()).x()
         
     def getMaxDepth(self, latLonList):
-        """ Use the getDepth() function to determine the maximum depth of a location. """
-        dataList = []
-
-        for latLon in latLonList:
-            xy = self.view.mapController.toCanvasCoordinates(latLon.x(), latLon.y())
-            depth = self.getDepth(xy.x(), xy.y())
-            if depth > 1:
-                dataList.append(depth)
-                
+        """ Determine the maximum depth over a set of locations. """
+        lats = numpy.array([latLon.x() for latLon in latLonList])
+        lons = numpy.array([latLon.y() for latLon in latLonList])
+        depths = self.sampleLayer(MAX_DEPTH_LAYER, lats, lons, 1)
+        depths = depths[depths > 1]
+
         # it is possible that there are no data points available e.g. over land.
-        if len(dataList) > 0:
-            self.maxDepth = max(dataList)
-        
+        if len(depths) > 0:
+            self.maxDepth = float(depths.max())
+
         return self.maxDepth
-        
-    @cached(depthCache)
-    def getDepth(self, x, y):
+
+    def sampleLayer(self, layerName, lats, lons, elevation):
+        """
+        Values of an ncWMS layer at a set of locations. One grid covering all of them is fetched
+        and sampled locally; if that fails the points are queried one at a time. Locations
+        without data are NaN.
+        """
+        lats = numpy.asarray(lats, dtype=float)
+        lons = numpy.asarray(lons, dtype=float)
+        if lats.size == 0:
+            return numpy.empty(0)
+
+        grid = self.getGridCovering(layerName, lats, lons, elevation)
+        if grid is not None:
+            return grid.sample(lats, lons)
+        return self.queryPoints(layerName, lats, lons, elevation)
+
+    def bboxCovering(self, lats, lons):
+        """ A bbox around every location given. """
+        # Pad the bbox so the outermost points are still inside a cell, not on the edge.
+        latMargin = max((lats.max() - lats.min()) * 0.05, 0.01)
+        lonMargin = max((lons.max() - lons.min()) * 0.05, 0.01)
+        return (round(lons.min() - lonMargin, 4), round(lats.min() - latMargin, 4),
+                round(lons.max() + lonMargin, 4), round(lats.max() + latMargin, 4))
+
+    def getGridCovering(self, layerName, lats, lons, elevation):
+        """ One grid of a layer covering every location given, or None if it can't be fetched. """
+        try:
+            return getFieldGrid(layerName, *self.bboxCovering(lats, lons),
+                                elevation, preferences.NCWMS_GRID_SIZE, preferences.NCWMS_GRID_SIZE, self.time)
+        except Exception:
+            print('NCWMSTools.getGridCovering {} falling back to per point queries'.format(layerName))
+            return None
+
+    def getProfileCovering(self, layerName, lats, lons):
+        """ Every depth level of a layer covering every location given, or None if it can't be fetched. """
+        try:
+            return getProfileGrid(layerName, *self.bboxCovering(lats, lons), preferences.NCWMS_GRID_SIZE,
+                                  preferences.NCWMS_GRID_SIZE, self.queryEngine, self.time)
+        except Exception:
+            print('NCWMSTools.getProfileCovering {} failed'.format(layerName))
+            return None
+
+    def queryPoints(self, layerName, lats, lons, elevation):
+        """
+        Values of a layer at a set of locations, one concurrent GetFeatureInfo per location. Land
+        never has data so it is NaN without asking the server.
+        """
+        values = numpy.full(len(lats), numpy.nan)
+        water = numpy.flatnonzero(self.landMask.isWater(lats, lons))
+        if layerName == MAX_DEPTH_LAYER:
+            queries = [(pointKey(layerName, lats[index], lons[index], 1, self.time), self.getDepthAtLatLon,
+                        (lats[index], lons[index])) for index in water]
+        else:
+            queries = [(pointKey(layerName, lats[index], lons[index], elevation, self.time),
+                        self.getSoundSpeedAtLatLon, (elevation, lats[index], lons[index])) for index in water]
+        values[water] = self.queryEngine.map(queries)
+        return values
+
+    def getDepthAtLatLon(self, lat, lon):
         """
         Get the maximum depth of a location. This is used to set the limit the depth
         the user can enter and build the ratio for probability of detection.
         """
         depth = 1
-        xmlRequest = 'http://{}:{}/ncWMS2/wms?'.format(preferences.GEOSERVER_IP, preferences.GEOSERVER_PORT) + \
-                     'LAYERS=003/max_depth&' + \
-                     'QUERY_LAYERS=003/max_depth&' + \
-                     'STYLES=default-scalar/default&' + \
-                     'SERVICE=WMS&' + \
-                     'VERSION=1.1.1&' + \
-                     'REQUEST=GetFeatureInfo&' + \
-                     'BBOX={},{},{},{}&'.format(self.lonMin, self.latMin, self.lonMax, self.latMax) + \
-                     'FEATURE_COUNT=5&' + \
-                     'HEIGHT={}&'.format(self.height) + \
-                     'WIDTH={}&'.format(self.width) + \
-                     'FORMAT=image/png&' + \
-                     'INFO_FORMAT=text/xml&' + \
-                     'SRS=EPSG:4326&' + \
-                     'X={}&'.format(round(x)) + \
-                     'Y={}&'.format(round(y)) + \
-                     'TIME=2017-06-28T00:00:00.000Z&' + \
-                     'ELEVATION={}'.format(depth)  
         try:
-            url = urllib.request.urlopen(xmlRequest)
-            tree = ET.fromstring(url.read())
-                
-            depth = float(tree.findall("./Feature/FeatureInfo/value")[0].text)
+            value = getValueAtLatLon(MAX_DEPTH_LAYER, lat, lon, depth, self.time)
+            if not numpy.isnan(value):
+                depth = value
         except:
-            print('NCWMSTools.getDepth {}'.format(xmlRequest))
+            print('NCWMSTools.getDepthAtLatLon {}, {}'.format(lat, lon))
         return depth
- 
-    @cached(soundSpeedCache)
-    def getSoundSpeedForPoint(self, depth, x, y):
 
+    def getSoundSpeedAtLatLon(self, depth, lat, lon):
         """
         Get the probability of detection based on the current depth for a certain location.
         """
         speed = -1
-        xmlRequest = 'http://{}:{}/ncWMS2/wms?'.format(preferences.GEOSERVER_IP, preferences.GEOSERVER_PORT) + \
-                     'LAYERS=003/soundspeed&' + \
-                     'QUERY_LAYERS=003/soundspeed&' + \
-                     'STYLES=default-scalar/default&' + \
-                     'SERVICE=WMS&' + \
-                     'VERSION=1.1.1&' + \
-                     'REQUEST=GetFeatureInfo&' + \
-                     'BBOX={},{},{},{}&'.format(self.lonMin, self.latMin, self.lonMax, self.latMax) + \
-                     'FEATURE_COUNT=5&' + \
-                     'HEIGHT={}&'.format(self.height) + \
-                     'WIDTH={}&'.format(self.width) + \
-                     'FORMAT=image/png&' + \
-                     'INFO_FORMAT=text/xml&' + \
-                     'SRS=EPSG:4326&' + \
-                     'X={}&'.format(round(x)) + \
-                     'Y={}&'.format(round(y)) + \
-                     'TIME=2017-06-28T00:00:00.000Z&' + \
-                     'ELEVATION={}'.format(depth)
         try:
-            url = urllib.request.urlopen(xmlRequest)
-            tree = ET.fromstring(url.read())
-            speed = float(tree.findall("./Feature/FeatureInfo/value")[0].text)
+            value = getValueAtLatLon(SOUND_SPEED_LAYER, lat, lon, depth, self.time)
+            if not numpy.isnan(value):
+                speed = value
         except:
-            print('NCWMSTools.getSoundSpeedForPoint {}'.format(xmlRequest))
+            print('NCWMSTools.getSoundSpeedAtLatLon {}, {}'.format(lat, lon))
         return speed
+
+    def pixelToLatLon(self, x, y):
+        return pixelToLatLon((self.lonMin, self.latMin, self.lonMax, self.latMax), self.width, self.height, x, y)
+
+    def getDepth(self, x, y):
+        """ getDepthAtLatLon() for pixel x, y of the view. """
+        return self.getDepthAtLatLon(*self.pixelToLatLon(x, y))
+
+    def getSoundSpeedForPoint(self, depth, x, y):
+        """ getSoundSpeedAtLatLon() for pixel x, y of the view. """
+        return self.getSoundSpeedAtLatLon(depth, *self.pixelToLatLon(x, y))
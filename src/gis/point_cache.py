@@ -0,0 +1,85 @@
+import atexit
+import os
+import shelve
+from threading import Lock
+
+from cachetools import LRUCache
+import numpy
+
+
+def shelfKey(key):
+    """
+    The shelve file's key for a cache key tuple, e.g. 'layer|-3213|11525|5.0|time'. numpy scalars
+    are made plain Python numbers first so the same location always gives the same string.
+    """
+    return '|'.join(str(part.item() if isinstance(part, numpy.generic) else part) for part in key)
+
+
+class PointCache:
+    """
+    Results of point queries (depth, sound speed etc.) shared by the whole process. Keys are
+    geographic (quantised lat/lon plus depth, time etc.) rather than canvas pixels, so a value
+    is reused whatever the pan, zoom or the object asking for it. Given a path, values are also
+    written to a shelve file so the next session starts with them. They are written in batches
+    of writeBatch, and whatever is left over when the cache is closed (at exit at the latest).
+    """
+
+    def __init__(self, path=None, maxsize=100000, writeBatch=500):
+        """
+        Constructor
+        """
+        self.path = path
+        self.values = LRUCache(maxsize=maxsize)
+        self.shelf = None
+        self.unwritten = {}  # shelf key: value, not yet written to the shelf
+        self.writeBatch = writeBatch
+        self.lock = Lock()  # used from the query engine's worker threads
+
+    def open(self):
+        if self.shelf is None and self.path:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.shelf = shelve.open(self.path)
+            atexit.register(self.close)
+        return self.shelf
+
+    def get(self, key):
+        """ The cached value for a key, or None. """
+        with self.lock:
+            value = self.values.get(key)
+            if value is None and self.open() is not None:
+                name = shelfKey(key)
+                value = self.unwritten.get(name)
+                if value is None:
+                    value = self.shelf.get(name)
+                if value is not None:
+                    self.values[key] = value
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.values[key] = value
+            if self.open() is not None:
+                self.unwritten[shelfKey(key)] = value
+                if len(self.unwritten) >= self.writeBatch:
+                    self.write()
+
+    def write(self):
+        """ Write the values put since the last write to the shelf. Call with the lock held. """
+        if self.unwritten:
+            self.shelf.update(self.unwritten)
+            self.shelf.sync()
+            self.unwritten.clear()
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+            self.unwritten.clear()
+            if self.open() is not None:
+                self.shelf.clear()
+
+    def close(self):
+        with self.lock:
+            if self.shelf is not None:
+                self.write()
+                self.shelf.close()
+                self.shelf = None
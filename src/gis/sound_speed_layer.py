@@ -1,14 +1,17 @@
-import operator
-import urllib.request
+import time
 
-from PySide2.QtCore import Qt
-from PySide2.QtGui import QPen, QBrush, QColor
-from PySide2.QtWidgets import QGraphicsItemGroup, QGraphicsBlurEffect
+from PySide2.QtCore import Qt, QThread, QTimer
+from PySide2.QtGui import QImage, QPixmap, QTransform
+from PySide2.QtWidgets import QGraphicsPixmapItem
+from cachetools import LRUCache
 import numpy
 
 import enums
+from gis.frame_sequence import FrameSequence
+from gis.geo_grid import GeoGrid
+from gis.ncwms_tools import getFieldGrid, getProfileGrid, getTimes, getValueAtLatLon, pixelToLatLon, pointKey, \
+    MAX_DEPTH_LAYER, SOUND_SPEED_LAYER
 import preferences
-import xml.etree.ElementTree as ET
 
 
 def getColourForRatio(ratio):
@@ -27,6 +30,42 @@ def getColourForRatio(ratio):
     return rgb
 
 
+def getColoursForRatios(ratios):
+    """
+    getColourForRatio() for a whole array of ratios at once. Returns uint8 RGB with an extra
+    last axis of 3.
+    """
+    ratios = numpy.asarray(ratios)
+    colours = numpy.select([(0 < ratios) & (ratios <= 0.25), (0.25 < ratios) & (ratios <= 0.75)],
+                           [0, 1], default=2)
+    return numpy.array([(49, 173, 0), (232, 228, 13), (232, 11, 11)], dtype=numpy.uint8)[colours]
+
+
+class ProfileLoader(QThread):
+    """
+    Fetches the sound speed at every depth level for a SoundSpeedLayer off the GUI thread. If
+    the profile can't be fetched, the layer's cells are queried one at a time at the depth
+    asked for instead.
+    """
+
+    def __init__(self, layer, depth, time):
+        QThread.__init__(self)
+
+        self.layer = layer
+        self.depth = depth
+        self.time = time
+        self.profile = None
+        self.soundSpeeds = None
+
+    def run(self):
+        layer = self.layer
+        try:
+            self.profile = getProfileGrid(SOUND_SPEED_LAYER, layer.lonMin, layer.latMin, layer.lonMax, layer.latMax,
+                                          layer.tileCount, layer.tileCount, layer.view.ncwmsQueryEngine, self.time)
+        except Exception:
+            self.soundSpeeds = layer.queryCells(SOUND_SPEED_LAYER, self.depth, layer.getSoundSpeedAtLatLon)
+
+
 class SoundSpeedLayer:
     """
 
@@ -40,12 +79,35 @@ class SoundSpeedLayer:
 
         self.depth = 0
         self.maxDepth = 0
-        self.graphicsGroup = QGraphicsItemGroup(scene=self.view.scene)
-#         self.map.scene.addItem(self.graphicsGroup)
-#         self.graphicsGroup.setValue(1)
-        
+        self.time = preferences.NCWMS_TIME
+        self.maxDepthFetched = False
+        self.profile = None  # sound speed at every depth level, fetched once
+        self.profileLoader = None
+        self.drawWhenLoaded = False
+        self.heatmapItem = QGraphicsPixmapItem()
+        self.heatmapItem.setTransformationMode(Qt.SmoothTransformation)
+        self.heatmapItem.setZValue(enums.ZVALUE_MetaDialogs-1)
+        self.heatmapItem.hide()
+        self.view.scene.addItem(self.heatmapItem)
+
         self.visible = True
-        self.dataMap = {}
+        self.soundSpeedGrid = None
+
+        # Progressive refinement. Tiles are keyed by (level, row, column); level 0 is the whole
+        # area and each level splits a tile into quarters, each fetched at tileCount x tileCount.
+        self.tileValues = {}
+        self.pendingTiles = {}
+        self.soundSpeedRange = 0
+        self.timeBudget = preferences.SOUND_SPEED_TIME_BUDGET
+        self.refineStart = 0
+        self.refineTimer = QTimer()
+        self.refineTimer.setSingleShot(True)
+        self.refineTimer.timeout.connect(self.checkRefinement)
+
+        # Time range playback. Each frame is coloured once and its pixmap kept for replays.
+        self.frameTimes = []
+        self.frameSequence = None
+        self.framePixmaps = LRUCache(maxsize=preferences.NCWMS_FRAME_CACHE_SIZE)
 
         canvasRect = view.mapToScene(view.viewport().geometry()).boundingRect()
         self.width = int(canvasRect.width())
@@ -63,153 +125,338 @@ class SoundSpeedLayer:
         self.signLon = self.lonMax/abs(self.startLon)
                    
     def getMaxDepth(self):
-        """ Use the getDepth() function to determine the maximum depth of a location. """
-        dataList = []
-        
-        for lat in numpy.arange(abs(self.startLat), abs(self.endLat), self.dLat):
-            for lon in numpy.arange(abs(self.startLon), abs(self.endLon), self.dLon):
-                xy = self.view.mapController.toCanvasCoordinates(self.signLat*lat, self.signLon*lon)
-                depth = self.getDepth(xy.x()-self.width, xy.y())
-                if depth > 1:
-                    dataList.append(depth)
-                
-        maxDepth = max(dataList)
-        self.maxDepth = maxDepth
-        
-        return maxDepth
-        
-    def getDepth(self, x, y):
+        """
+        Determine the maximum depth over the visible area from a single grid of depths. The area
+        doesn't change over the life of the layer so this is only fetched once.
+        """
+        if self.maxDepthFetched:
+            return self.maxDepth
+
+        try:
+            depths = getFieldGrid(MAX_DEPTH_LAYER, self.lonMin, self.latMin, self.lonMax, self.latMax, 1,
+                                  self.tileCount, self.tileCount, self.time).values.ravel()
+        except Exception:
+            depths = self.queryCells(MAX_DEPTH_LAYER, 1, self.getDepthAtLatLon)
+
+        depths = depths[depths > 1]
+        if len(depths) > 0:
+            self.maxDepth = float(depths.max())
+        self.maxDepthFetched = True
+
+        return self.maxDepth
+
+    def cellCentres(self):
+        """ The lat/lon of the centre of each cell, row by row from the north west. """
+        lats = self.latMax - (numpy.arange(self.tileCount) + 0.5) * self.dLat
+        lons = self.lonMin + (numpy.arange(self.tileCount) + 0.5) * self.dLon
+        lats, lons = numpy.meshgrid(lats, lons, indexing='ij')
+        return lats.ravel(), lons.ravel()
+
+    def queryCells(self, layerName, elevation, function):
+        """
+        Query every cell over water concurrently, one GetFeatureInfo each. Land cells are NaN.
+        Used if the grid fetch fails.
+        """
+        lats, lons = self.cellCentres()
+        values = numpy.full(len(lats), numpy.nan)
+        water = numpy.flatnonzero(self.view.landMask.isWater(lats, lons))
+        queries = [(pointKey(layerName, lats[index], lons[index], elevation, self.time), function,
+                    (lats[index], lons[index])) for index in water]
+        values[water] = self.view.ncwmsQueryEngine.map(queries)
+        return values
+
+    def getDepthAtLatLon(self, lat, lon):
         """
         Get the maximum depth of a location. This is used to set the limit the depth
         the user can enter and build the ratio for probability of detection.
         """
         depth = 1
-        xmlRequest = 'http://{}:{}/ncWMS2/wms?'.format(preferences.GEOSERVER_IP, preferences.GEOSERVER_PORT) + \
-                     'LAYERS=003/max_depth&' + \
-                     'QUERY_LAYERS=003/max_depth&' + \
-                     'STYLES=default-scalar/default&' + \
-                     'SERVICE=WMS&' + \
-                     'VERSION=1.1.1&' + \
-                     'REQUEST=GetFeatureInfo&' + \
-                     'BBOX={},{},{},{}&'.format(self.lonMin, self.latMin, self.lonMax, self.latMax) + \
-                     'FEATURE_COUNT=5&' + \
-                     'HEIGHT={}&'.format(self.height) + \
-                     'WIDTH={}&'.format(self.width) + \
-                     'FORMAT=image/png&' + \
-                     'INFO_FORMAT=text/xml&' + \
-                     'SRS=EPSG:4326&' + \
-                     'X={}&'.format(round(x)) + \
-                     'Y={}&'.format(round(y)) + \
-                     'TIME=2017-06-28T00:00:00.000Z&' + \
-                     'ELEVATION={}'.format(depth)  
-
         try:
-            url = urllib.request.urlopen(xmlRequest)
-            tree = ET.fromstring(url.read())
-                
-            depth = float(tree.findall("./Feature/FeatureInfo/value")[0].text)
+            value = getValueAtLatLon(MAX_DEPTH_LAYER, lat, lon, depth, self.time)
+            if not numpy.isnan(value):
+                depth = value
         except:
             pass
         return depth
- 
-    def getSoundSpeedForPoint(self, x, y):
 
+    def getSoundSpeedAtLatLon(self, lat, lon):
         """
         Get the probability of detection based on the current depth for a certain location.
         """
         speed = 1
-        xmlRequest = 'http://{}:{}/ncWMS2/wms?'.format(preferences.GEOSERVER_IP, preferences.GEOSERVER_PORT) + \
-                     'LAYERS=003/soundspeed&' + \
-                     'QUERY_LAYERS=003/soundspeed&' + \
-                     'STYLES=default-scalar/default&' + \
-                     'SERVICE=WMS&' + \
-                     'VERSION=1.1.1&' + \
-                     'REQUEST=GetFeatureInfo&' + \
-                     'BBOX={},{},{},{}&'.format(self.lonMin, self.latMin, self.lonMax, self.latMax) + \
-                     'FEATURE_COUNT=5&' + \
-                     'HEIGHT={}&'.format(self.height) + \
-                     'WIDTH={}&'.format(self.width) + \
-                     'FORMAT=image/png&' + \
-                     'INFO_FORMAT=text/xml&' + \
-                     'SRS=EPSG:4326&' + \
-                     'X={}&'.format(round(x)) + \
-                     'Y={}&'.format(round(y)) + \
-                     'TIME=2017-06-28T00:00:00.000Z&' + \
-                     'ELEVATION={}'.format(self.depth)
         try:
-            url = urllib.request.urlopen(xmlRequest)
-            tree = ET.fromstring(url.read())
-            speed = float(tree.findall("./Feature/FeatureInfo/value")[0].text)
+            value = getValueAtLatLon(SOUND_SPEED_LAYER, lat, lon, self.depth, self.time)
+            if not numpy.isnan(value):
+                speed = value
         except:
             pass
         return speed
- 
+
+    def pixelToLatLon(self, x, y):
+        return pixelToLatLon((self.lonMin, self.latMin, self.lonMax, self.latMax), self.width, self.height, x, y)
+
+    def getDepth(self, x, y):
+        """ getDepthAtLatLon() for pixel x, y of the view. """
+        return self.getDepthAtLatLon(*self.pixelToLatLon(x, y))
+
+    def getSoundSpeedForPoint(self, x, y):
+        """ getSoundSpeedAtLatLon() for pixel x, y of the view. """
+        return self.getSoundSpeedAtLatLon(*self.pixelToLatLon(x, y))
+
     def updateDepth(self, depthChange):
         """ Get the probability of detection based on an increase or decrease of depth. """
         if self.depth == 0:
             self.depth = self.maxDepth / 2
         else:    
+            step = self.getMaxDepth() / 10
             if depthChange == 'up':
-                if (self.depth + (self.getMaxDepth() / 10)) <= self.maxDepth:
-                    self.depth += (self.getMaxDepth() / 10)
+                if (self.depth + step) <= self.maxDepth:
+                    self.depth += step
             else:
-                if (self.depth - (self.getMaxDepth() / 10)) >= 0:
-                    self.depth -= (self.getMaxDepth() / 10)
+                if (self.depth - step) >= 0:
+                    self.depth -= step
         self.getSoundSpeedData()
 
     def updateDepthByValue(self, depth):
         """ Get the probability of detection based on a depth entered in the depth text box. """
 
-        if (self.depth + (self.getMaxDepth() / 10)) <= self.maxDepth and \
-           (self.depth - (self.getMaxDepth() / 10)) >= 0:
+        step = self.getMaxDepth() / 10
+        if (self.depth + step) <= self.maxDepth and \
+           (self.depth - step) >= 0:
             self.depth = depth
             
         self.getSoundSpeedData()
         
-    def getSoundSpeedData(self):
-        """ Get the probability of detection (sound speed atm) based on lat/lon and depth. """
-        for lat in numpy.arange(abs(self.startLat), abs(self.endLat), self.dLat):
-            for lon in numpy.arange(abs(self.startLon), abs(self.endLon), self.dLon):
-                xy = self.view.mapController.toCanvasCoordinates(self.signLat*lat, self.signLon*lon)
-                ss = self.getSoundSpeedForPoint(xy.x()-self.width, xy.y())
-                if ss > 1:
-                    self.dataMap[(xy.x(), xy.y())] = ss        
-        
-    def drawSoundSpeed(self):
-        """ Fill in the circles around a ruler path based on the probability of detection. """
-        pen = QPen(Qt.transparent, 1)
+    def getSoundSpeedData(self, draw=False):
+        """
+        Get the probability of detection (sound speed atm) based on lat/lon and depth, drawing it
+        too if draw is set. The first time, the profile (every depth level) is fetched by a
+        ProfileLoader and the data is set when it lands; after that a change of depth is just a
+        slice of the profile, no server traffic.
+        """
+        self.drawWhenLoaded = self.drawWhenLoaded or draw
+        if self.profile is not None:
+            self.setSoundSpeeds(self.profile.atDepth(self.depth).values.ravel())
+        elif self.profileLoader is None or not self.profileLoader.isRunning():
+            self.profileLoader = ProfileLoader(self, self.depth, self.time)
+            self.profileLoader.finished.connect(self.profileLoaded)
+            self.profileLoader.start()
+        # Otherwise profileLoaded() picks up the current depth when the running load finishes.
+
+    def profileLoaded(self):
+        """ Use what the ProfileLoader fetched, unless the time or depth has moved on since it started. """
+        loader = self.profileLoader
+        if loader.time != self.time or (loader.profile is None and loader.depth != self.depth):
+            self.getSoundSpeedData()
+            return
+
+        if loader.profile is not None:
+            self.profile = loader.profile
+            self.setSoundSpeeds(self.profile.atDepth(self.depth).values.ravel())
+        else:
+            self.setSoundSpeeds(loader.soundSpeeds)
+
+    def setSoundSpeeds(self, soundSpeeds):
+        """ The sound speed at the centre of each cell at the current depth. """
+        self.stopRefinement()
+        self.tileValues = {(0, 0, 0): soundSpeeds.reshape(self.tileCount, self.tileCount)}
+        self.soundSpeedGrid = self.compositeGrid()
+        validValues = self.soundSpeedGrid.values[~numpy.isnan(self.soundSpeedGrid.values)]
+        self.soundSpeedRange = validValues.max() - validValues.min() if len(validValues) else 0
+
+        if self.frameSequence is not None:
+            self.loadFrames()
+        if self.drawWhenLoaded:
+            self.drawWhenLoaded = False
+            self.drawSoundSpeed()
+
+    def compositeGrid(self):
+        """ All the tiles fetched so far laid into one grid at the finest resolution, finer tiles on top. """
+        maxLevel = max(level for level, _, _ in self.tileValues)
+        size = self.tileCount * 2 ** maxLevel
+        values = numpy.full((size, size), numpy.nan)
+        for (level, row, column), tileValues in sorted(self.tileValues.items()):
+            scale = 2 ** (maxLevel - level)
+            span = self.tileCount * scale
+            values[row * span:(row + 1) * span, column * span:(column + 1) * span] = \
+                numpy.repeat(numpy.repeat(tileValues, scale, axis=0), scale, axis=1)
+
+        # Cells without data are left out (NaN) rather than coloured.
+        values = numpy.where(values > 1, values, numpy.nan)
+        return GeoGrid(values, self.lonMin, self.latMin, self.lonMax, self.latMax)
+
+    def setTimeBudget(self, seconds):
+        """ How long refinement may keep fetching after the coarse grid has been drawn. """
+        self.timeBudget = seconds
 
+    def refine(self):
+        """ Start fetching finer tiles wherever the coarse grid shows the sound speed changing quickly. """
+        self.refineStart = time.perf_counter()
+        for tile, tileValues in self.tileValues.items():
+            self.refineTile(tile, tileValues)
+        if self.pendingTiles:
+            self.refineTimer.start(50)
+
+    def refineTile(self, tile, tileValues):
+        """ Queue the four quarters of a tile if it is not at the finest level and its values vary enough. """
+        level, row, column = tile
+        validValues = tileValues[tileValues > 1]
+        if level >= preferences.SOUND_SPEED_MAX_LEVEL or len(validValues) == 0 or \
+           validValues.max() - validValues.min() <= preferences.SOUND_SPEED_REFINE_THRESHOLD * self.soundSpeedRange:
+            return
+
+        for child in ((level + 1, row * 2 + dRow, column * 2 + dColumn) for dRow in (0, 1) for dColumn in (0, 1)):
+            bbox = self.tileBbox(child)
+            self.pendingTiles[child] = self.view.ncwmsQueryEngine.submit(
+                (SOUND_SPEED_LAYER,) + bbox + (self.depth, self.tileCount, self.tileCount, self.time),
+                getFieldGrid, SOUND_SPEED_LAYER, *bbox, self.depth, self.tileCount, self.tileCount, self.time)
+
+    def tileBbox(self, tile):
+        level, row, column = tile
+        dLat = (self.latMax - self.latMin) / 2 ** level
+        dLon = (self.lonMax - self.lonMin) / 2 ** level
+        latMax = self.latMax - row * dLat
+        lonMin = self.lonMin + column * dLon
+        return lonMin, latMax - dLat, lonMin + dLon, latMax
+
+    def checkRefinement(self):
+        """ Draw whichever tiles have arrived since the last check and queue their quarters if needed. """
+        landed = [tile for tile, future in self.pendingTiles.items() if future.done()]
+        for tile in landed:
+            future = self.pendingTiles.pop(tile)
+            if future.exception() is None and future.result().values.shape == (self.tileCount, self.tileCount):
+                self.tileValues[tile] = future.result().values
+                self.refineTile(tile, self.tileValues[tile])
+
+        if landed:
+            self.soundSpeedGrid = self.compositeGrid()
+            self.drawSoundSpeed(refine=False)
+
+        if time.perf_counter() - self.refineStart > self.timeBudget:
+            self.stopRefinement()
+        elif self.pendingTiles:
+            self.refineTimer.start(50)
+
+    def stopRefinement(self):
+        self.refineTimer.stop()
+        for future in self.pendingTiles.values():
+            future.cancel()
+        self.pendingTiles.clear()
+
+    def setTime(self, frameTime):
+        """ Show the sound speed at a single ncWMS TIME, ending any time range playback. """
+        self.clearFrames()
+        self.time = frameTime
+        self.profile = None
+        self.getSoundSpeedData(draw=True)
+
+    def setTimeRange(self, start, end):
+        """
+        Load the sound speed at every time step the server has from start to end (ISO 8601) at
+        the current depth, ready to scrub through or play. The first frame is shown as it lands.
+        """
+        self.clearFrames()
+        self.frameTimes = getTimes(SOUND_SPEED_LAYER, start, end) or [self.time]
+        self.loadFrames()
+
+    def loadFrames(self):
+        """ (Re)start the frame sequence for the current depth, e.g. after the depth has changed. """
+        index = self.frameSequence.index if self.frameSequence is not None else 0
+        self.clearFrames()
+        self.stopRefinement()
+        self.frameSequence = FrameSequence(self.view.ncwmsQueryEngine, SOUND_SPEED_LAYER,
+                                           (self.lonMin, self.latMin, self.lonMax, self.latMax), self.depth,
+                                           preferences.NCWMS_GRID_SIZE, preferences.NCWMS_GRID_SIZE, self.frameTimes)
+        self.frameSequence.frameChanged.connect(self.showFrame)
+        self.frameSequence.show(index)
+
+    def clearFrames(self):
+        if self.frameSequence is not None:
+            self.frameSequence.stop()
+            self.frameSequence = None
+        self.framePixmaps.clear()
+
+    def showFrame(self, index, grid):
+        """ Put one frame of the time range on screen, colouring it the first time it's shown. """
+        self.time = self.frameTimes[index]
+        self.soundSpeedGrid = GeoGrid(numpy.where(grid.values > 1, grid.values, numpy.nan), *grid.bbox())
+        if numpy.isnan(self.soundSpeedGrid.values).all():
+            return
+
+        pixmap = self.framePixmaps.get(index)
+        if pixmap is None:
+            pixmap = QPixmap.fromImage(self.buildHeatmap(self.soundSpeedGrid))
+            self.framePixmaps[index] = pixmap
+        self.heatmapItem.setPixmap(pixmap)
+        self.update()
+        self.show()
+
+    def scrubTo(self, index):
+        if self.frameSequence is not None:
+            self.frameSequence.show(index)
+
+    def play(self):
+        if self.frameSequence is not None:
+            self.frameSequence.play()
+
+    def pause(self):
+        if self.frameSequence is not None:
+            self.frameSequence.pause()
+
+    def drawSoundSpeed(self, refine=True):
+        """
+        Colour the area by sound speed. The data grid is interpolated up to one image, coloured
+        and smoothed once here; the scene then only has a single pixmap to draw. The coarse grid
+        is drawn straight away and then refined in the background.
+        """
         # It is possible that there is no data for a particular location/depth.
-        if len(self.dataMap) > 0:
-            maxSoundSpeed = max(self.dataMap.items(), key=operator.itemgetter(1))[1]
-            minSoundSpeed = min(self.dataMap.items(), key=operator.itemgetter(1))[1]
-            endDelta = maxSoundSpeed - minSoundSpeed
-            for xy, ss in self.dataMap.items():            
-                markerValue = (ss - minSoundSpeed) / (endDelta if endDelta > 0 else 1)
-                r = self.view.scene.addRect(xy[0]-self.width, 
-                                            xy[1], 
-                                            self.width/(self.tileCount/1.05),
-                                            self.height/self.tileCount)
-                
-                rgb = getColourForRatio(markerValue)
-                brush = QBrush(QColor(rgb[0], rgb[1], rgb[2]))
-                r.setBrush(brush)
-                r.setOpacity((markerValue/2))
-                r.setPen(pen)
-                self.graphicsGroup.addToGroup(r)
-
-            self.graphicsGroup.setZValue(enums.ZVALUE_MetaDialogs-1)
-            effect = QGraphicsBlurEffect()
-            effect.setBlurRadius(50)
-            self.graphicsGroup.setGraphicsEffect(effect)
+        if self.soundSpeedGrid is not None and not numpy.isnan(self.soundSpeedGrid.values).all():
+            self.heatmapItem.setPixmap(QPixmap.fromImage(self.buildHeatmap(self.soundSpeedGrid)))
+            self.update()
             self.show()
+            # A time range is played from whole frames, so only a single time is refined.
+            if refine and self.frameSequence is None:
+                self.refine()
 
         self.view.mainWindow.netDataLabel.setText('Sound Speed')
-        
+
+    def buildHeatmap(self, grid):
+        """ An RGBA image of the grid, green for the slowest sound speed to red for the fastest. """
+        size = preferences.SOUND_SPEED_IMAGE_SIZE
+        imageGrid = GeoGrid(numpy.empty((size, size)), *grid.bbox())
+        soundSpeeds = grid.sample(*imageGrid.cellCentres())
+
+        minSoundSpeed = numpy.nanmin(grid.values)
+        endDelta = numpy.nanmax(grid.values) - minSoundSpeed
+        ratios = (soundSpeeds - minSoundSpeed) / (endDelta if endDelta > 0 else 1)
+
+        pixels = numpy.zeros((size, size, 4), dtype=numpy.uint8)
+        pixels[..., :3] = getColoursForRatios(ratios)
+        pixels[..., 3] = numpy.nan_to_num(ratios / 2 * 255, nan=0).clip(0, 255)
+
+        image = QImage(pixels.data, size, size, size * 4, QImage.Format_RGBA8888)
+        # Soften the colour band edges the way the blur effect used to, but only the once.
+        smoothScale = size // 8
+        return image.scaled(smoothScale, smoothScale, Qt.IgnoreAspectRatio, Qt.SmoothTransformation) \
+                    .scaled(size, size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+    def update(self):
+        """ Keep the heatmap over its area as the map is panned or zoomed. """
+        if self.soundSpeedGrid is None or self.heatmapItem.pixmap().isNull():
+            return
+
+        lonMin, latMin, lonMax, latMax = self.soundSpeedGrid.bbox()
+        topLeft = self.view.mapController.toCanvasCoordinates(latMax, lonMin)
+        bottomRight = self.view.mapController.toCanvasCoordinates(latMin, lonMax)
+        pixmap = self.heatmapItem.pixmap()
+        self.heatmapItem.setPos(topLeft)
+        self.heatmapItem.setTransform(QTransform.fromScale((bottomRight.x() - topLeft.x()) / pixmap.width(),
+                                                           (bottomRight.y() - topLeft.y()) / pixmap.height()))
+
     def show(self):
-        self.graphicsGroup.show()
+        self.heatmapItem.show()
         self.visible = True
 
     def hide(self):
-        self.graphicsGroup.hide()
+        self.heatmapItem.hide()
         self.visible = False
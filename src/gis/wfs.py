@@ -1,126 +1,295 @@
-from PySide2.QtCore import QObject
+from collections import namedtuple
+import codecs
+import json
+import math
+import re
+
+from PySide2.QtCore import QObject, QThread, Signal
+import numpy
 import requests
 
 from model.feature import Feature
+from model.layers import FeatureLayer
 import preferences
 
+REQUEST_TIMEOUT = 30  # seconds
+
+# typeName: workspace:layer on the GeoServer. geometryName: the layer's geometry attribute.
+# propertyNames: (label, attribute) pairs shown, in order, in a feature's pop-up dialog.
+# sortBy: attributes that put the features in a fixed order, so STARTINDEX pages don't overlap or skip.
+WFSLayer = namedtuple('WFSLayer', 'typeName title geometryName propertyNames sortBy iconFile iconScale')
+
+WFS_LAYERS = {
+    'Australian Airports': WFSLayer('Landmarks:Aust_Airports', 'Landmarks:Austtralian Airports', 'the_geom',
+                                    (('Name', 'name_en'),),
+                                    ('name_en',),
+                                    'airport.svg', 10),
+    'Australian Ports': WFSLayer('Landmarks:Aust_Ports', 'Landmarks:Australian Ports', 'the_geom',
+                                 (('Name', 'PORT_NAME'),),
+                                 ('PORT_NAME',),
+                                 'port.svg', 0.5),
+    'Cities': WFSLayer('Landmarks:Aust_Cities', 'Landmarks:Aust_Cities', 'the_geom',
+                       (('Name', 'name'), ('Country', 'adm0name'), ('State', 'adm1name'), ('Population', 'pop_max')),
+                       ('adm0name', 'adm1name', 'name'),
+                       'city.svg', 0.5)
+}
+
+
+def featureRequest(layer, bbox=None, startIndex=0, maxFeatures=preferences.WFS_PAGE_SIZE):
+    """
+    The GetFeature URL for one page of a layer, limited to a bbox (lon min, lat min, lon max,
+    lat max) and to the attributes the layer's features use.
+    """
+    request = 'http://{}:{}/geoserver/wfs?'.format(preferences.GEOSERVER_IP, preferences.GEOSERVER_PORT) + \
+              'SERVICE=wfs&' + \
+              'VERSION=1.1.0&' + \
+              'REQUEST=GetFeature&' + \
+              'TYPENAME={}&'.format(layer.typeName) + \
+              'PROPERTYNAME={}&'.format(','.join([layer.geometryName] +
+                                                 [attribute for _, attribute in layer.propertyNames])) + \
+              'SRSNAME=EPSG:4326&' + \
+              'MAXFEATURES={}&'.format(maxFeatures) + \
+              'STARTINDEX={}&'.format(startIndex) + \
+              'SORTBY={}&'.format(','.join(layer.sortBy)) + \
+              'outputFormat=json'
+    if bbox is not None:
+        request += '&BBOX={},{},{},{},EPSG:4326'.format(*bbox)
+    return request
+
+
+def iterFeatures(chunks):
+    """
+    Yield the features of a GeoJSON FeatureCollection one at a time, from an iterable of text
+    chunks, as soon as each has been received. Only the unparsed tail of the text is kept.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    inFeatures = False
+    for chunk in chunks:
+        buffer += chunk
+        position = 0
+        if not inFeatures:
+            start = re.search(r'"features"\s*:\s*\[', buffer)
+            if start is None:
+                continue
+            position = start.end()
+            inFeatures = True
+
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position == len(buffer):
+                break
+            if buffer[position] == ']':
+                return
+            try:
+                feature, position = decoder.raw_decode(buffer, position)
+            except ValueError:
+                break  # the rest of this feature hasn't arrived yet
+            yield feature
+        buffer = buffer[position:]
+
+
+def textChunks(response, chunkSize=65536):
+    """ The body of a streamed requests response as text, decoded a chunk at a time. """
+    decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')()
+    for chunk in response.iter_content(chunk_size=chunkSize):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+
+def featureRecords(layer, bbox=None, pageSize=preferences.WFS_PAGE_SIZE):
+    """
+    (id, lat, lon, properties) for every point feature of a layer inside a bbox. The layer is
+    requested a page at a time and each page is parsed as it streams in.
+    """
+    startIndex = 0
+    while True:
+        response = requests.get(featureRequest(layer, bbox, startIndex, pageSize), stream=True,
+                                timeout=REQUEST_TIMEOUT)
+        count = 0
+        try:
+            for feature in iterFeatures(textChunks(response)):
+                count += 1
+                geometry = feature.get('geometry')
+                if geometry is None:
+                    continue
+                lon, lat = geometry['coordinates'][:2]
+                yield feature.get('id'), float(lat), float(lon), feature.get('properties') or {}
+        finally:
+            response.close()
+
+        if count < pageSize:
+            return
+        startIndex += pageSize
+
+
+class WFSLoader(QThread):
+    """
+    Fetches WFS layers off the GUI thread. Records are handed back in small batches as they are
+    parsed so the first features can be drawn while the rest are still downloading.
+    """
+    recordsLoaded = Signal(str, object)  # layer name, list of (id, lat, lon, properties)
+    jobLoaded = Signal(str, object)  # layer name, bbox; only for jobs loaded completely, after their last batch
+
+    def __init__(self, jobs):
+        QThread.__init__(self)
+
+        self.jobs = jobs  # (layer name, bbox) pairs
+        self.failed = False
+
+    def run(self):
+        for layerName, bbox in self.jobs:
+            batch = []
+            try:
+                for record in featureRecords(WFS_LAYERS[layerName], bbox):
+                    if self.isInterruptionRequested():
+                        return
+                    batch.append(record)
+                    if len(batch) == preferences.WFS_BATCH_SIZE:
+                        self.recordsLoaded.emit(layerName, batch)
+                        batch = []
+            except Exception as e:
+                print('WFSLoader.run {}: {}'.format(layerName, e))
+                self.failed = True
+                continue
+            if batch:
+                self.recordsLoaded.emit(layerName, batch)
+            self.jobLoaded.emit(layerName, bbox)
+
 
 class WFS(QObject):
     """
     Manages all the data required for a Web Feature Service layer. This typically consists of point data
-    for features such as ports, airport and cities.
+    for features such as ports, airport and cities. Only the features around the view are loaded, and more
+    are loaded as the view moves. What has been loaded is recorded on a grid of WFS_CELL_SIZE
+    cells over the world, so it takes the same memory however much the view has moved about.
     """
 
     def __init__(self, view):
+        QObject.__init__(self)
         self.view = view
-        self.layers = {}
+        self.layers = {}  # layer name: FeatureLayer
+        self.loadedCells = {}  # layer name: (rows, columns) bool array, True for cells already loaded
+        self.featureIds = {}  # layer name: ids of the features already on the map
+        self.loader = None
 
-    def getAirports(self):
+    def addLayer(self, layerName, visible=True):
+        """ An empty FeatureLayer for one of WFS_LAYERS that fills in as the view moves over it. """
+        layer = FeatureLayer(self.view, [], visible)
+        self.layers[layerName] = layer
+        size = preferences.WFS_CELL_SIZE
+        self.loadedCells[layerName] = numpy.zeros((math.ceil(180 / size), math.ceil(360 / size)), dtype=bool)
+        self.featureIds[layerName] = set()
+        return layer
 
-        features = []
-        response = requests.get('http://{}:{}/geoserver/wfs?'.format(preferences.GEOSERVER_IP,
-                                                                     preferences.GEOSERVER_PORT) +
-                                'SERVICE=wfs&' +
-                                'VERSION=1.1.0&' +
-                                'REQUEST=GetFeature&' +
-                                'TYPENAME=Landmarks:Aust_Airports&' +
-                                'outputFormat=json  ')
-        responseDict = response.json()
-        for dictLists in responseDict['features']:
-            level0 = dictLists['geometry']['coordinates']
-            lat = float(level0[1])
-            lon = float(level0[0])
-            name = dictLists['properties']['name_en']
-
-            newFeature = Feature(view=self.view,
-                                 layerName='Aust_Airports',
-                                 meta={'title': 'Landmarks:Austtralian Airports',
-                                       'Name': '{}: '.format(name),
-                                       'Location': '{:.2f}, {:.2f}: '.format(lat, lon)},
-                                 lat=lat,
-                                 lon=lon,
-                                 iconPath=str(preferences.ICON_PATH / "airport.svg"),
-                                 iconScale=10)
-
-            features.append(newFeature)
-        self.layers['Australian Airports'] = features
-        return features
-
-    def getPorts(self):
+    def loadVisible(self):
+        """
+        For any visible layer that hasn't already been loaded over the whole viewport, request
+        the cells not loaded yet within the viewport plus WFS_MARGIN of its size on each side.
+        Called as the view moves; cheap if nothing new has come into view. An area that failed
+        to load is tried again the next time the view moves.
+        """
+        if self.loader is not None and self.loader.isRunning():
+            return  # checked again when the current load finishes
 
-        features = []
-        response = requests.get(
-            'http://{}:{}/geoserver/wfs?'.format(preferences.GEOSERVER_IP, preferences.GEOSERVER_PORT) +
-            'SERVICE=wfs&' +
-            'VERSION=1.1.0&' +
-            'REQUEST=GetFeature&' +
-            'TYPENAME=Landmarks:Aust_Ports&' +
-            'outputFormat=json')
-        responseDict = response.json()
-        for dictLists in responseDict['features']:
-            level0 = dictLists['geometry']['coordinates']
-            lat = float(level0[1])
-            lon = float(level0[0])
-            name = dictLists['properties']['PORT_NAME']
-
-            newFeature = Feature(view=self.view,
-                                 layerName='Aust_Ports',
-                                 meta={'title': 'Landmarks:Australian Ports',
-                                       'Name': '{}: '.format(name),
-                                       'Location': '{:.2f}, {:.2f}: '.format(lat, lon)},
-                                 lat=lat,
-                                 lon=lon,
-                                 iconPath=str(preferences.ICON_PATH / "port.svg"),
-                                 iconScale=0.5)
-
-            features.append(newFeature)
-        self.layers['Australian Ports'] = features
-        return features
-
-    def getCities(self):
+        inView = self.cells(self.view.viewportBbox())
+        rows, columns = self.cells(self.view.viewportBbox(preferences.WFS_MARGIN))
+
+        jobs = []
+        for layerName, layer in self.layers.items():
+            loaded = self.loadedCells[layerName]
+            if layer.visible and not loaded[inView].all():
+                missing = ~loaded[rows, columns]
+                missingRows = numpy.flatnonzero(missing.any(axis=1)) + rows.start
+                missingColumns = numpy.flatnonzero(missing.any(axis=0)) + columns.start
+                jobs.append((layerName, self.cellsBbox(slice(int(missingRows[0]), int(missingRows[-1]) + 1),
+                                                       slice(int(missingColumns[0]), int(missingColumns[-1]) + 1))))
+
+        if jobs:
+            self.loader = WFSLoader(jobs)
+            self.loader.recordsLoaded.connect(self.addRecords)
+            self.loader.jobLoaded.connect(self.jobLoaded)
+            self.loader.finished.connect(self.loaderFinished)
+            self.loader.start()
+
+    @staticmethod
+    def cells(bbox):
+        """ The (rows, columns) slices of the loaded cells a bbox covers, rows counting up from -90. """
+        size = preferences.WFS_CELL_SIZE
+        lonMin, latMin, lonMax, latMax = bbox
+        # Allow for rounding so a bbox made by cellsBbox() maps back to exactly the same cells.
+        return (slice(max(math.floor((latMin + 90) / size + 1e-9), 0), math.ceil((latMax + 90) / size - 1e-9)),
+                slice(max(math.floor((lonMin + 180) / size + 1e-9), 0), math.ceil((lonMax + 180) / size - 1e-9)))
+
+    @staticmethod
+    def cellsBbox(rows, columns):
+        """ The bbox of a block of cells. """
+        size = preferences.WFS_CELL_SIZE
+        return (columns.start * size - 180, rows.start * size - 90,
+                min(columns.stop * size - 180, 180), min(rows.stop * size - 90, 90))
 
+    def jobLoaded(self, layerName, bbox):
+        self.loadedCells[layerName][self.cells(bbox)] = True
+
+    def loaderFinished(self):
+        """ Catch up with the view if it moved during the load, unless the server is failing. """
+        if not self.loader.failed:
+            self.loadVisible()
+
+    def addRecords(self, layerName, records):
+        """ Create and draw the features for a batch of records, skipping any already on the map. """
+        featureIds = self.featureIds[layerName]
         features = []
-        response = requests.get(
-            'http://{}:{}/geoserver/wfs?'.format(preferences.GEOSERVER_IP, preferences.GEOSERVER_PORT) +
-            'SERVICE=wfs&' +
-            'VERSION=1.1.0&' +
-            'REQUEST=GetFeature&' +
-            'TYPENAME=Landmarks:Aust_Cities&' +
-            'outputFormat=json')
-        responseDict = response.json()
-        for dictLists in responseDict['features']:
-            level0 = dictLists['geometry']['coordinates']
-            lat = float(level0[1])
-            lon = float(level0[0])
-            name = dictLists['properties']['name']
-            state = dictLists['properties']['adm1name']
-            country = dictLists['properties']['adm0name']
-            population = dictLists['properties']['pop_max']
-
-            newFeature = Feature(view=self.view,
-                                 layerName='Aust_Cities',
-                                 meta={'title': 'Landmarks:Aust_Cities',
-                                       'Name': '{}: '.format(name),
-                                       'Country': '{}: '.format(country),
-                                       'State': '{}: '.format(state),
-                                       'Population': '{}: '.format(population),
-                                       'Location': '{:.2f}, {:.2f}: '.format(lat, lon)},
-                                 lat=lat,
-                                 lon=lon,
-                                 iconPath=str(preferences.ICON_PATH / "city.svg"),
-                                 iconScale=0.5)
-
-            features.append(newFeature)
-        self.layers['Cities'] = features
-        return features
+        for record in records:
+            if record[0] is not None:
+                if record[0] in featureIds:
+                    continue
+                featureIds.add(record[0])
+            features.append(self.createFeature(layerName, record))
+        self.layers[layerName].addFeatures(features)
+
+    def createFeature(self, layerName, record):
+        layer = WFS_LAYERS[layerName]
+        _, lat, lon, properties = record
+
+        meta = {'title': layer.title}
+        for label, attribute in layer.propertyNames:
+            meta[label] = '{}: '.format(properties.get(attribute))
+        meta['Location'] = '{:.2f}, {:.2f}: '.format(lat, lon)
+
+        return Feature(view=self.view,
+                       layerName=layer.typeName.split(':')[1],
+                       meta=meta,
+                       lat=lat,
+                       lon=lon,
+                       iconPath=preferences.ICON_PATH + layer.iconFile,
+                       iconScale=layer.iconScale)
+
+    def getFeatures(self, layerName, bbox=None):
+        """ Every feature of a layer inside a bbox (the whole layer if None), fetched there and then. """
+        return [self.createFeature(layerName, record) for record in featureRecords(WFS_LAYERS[layerName], bbox)]
+
+    def getAirports(self, bbox=None):
+        return self.getFeatures('Australian Airports', bbox)
+
+    def getPorts(self, bbox=None):
+        return self.getFeatures('Australian Ports', bbox)
+
+    def getCities(self, bbox=None):
+        return self.getFeatures('Cities', bbox)
 
     def getLayerFeatures(self, layerName):
-        return self.layers[layerName]
+        return self.layers[layerName].features
 
     def drawSpiroPolygons(self, layerName):
-        for feature in self.layers[layerName]:
+        for feature in self.layers[layerName].features:
             feature.drawSpiroPolygons()
 
     def update(self, layerName):
-        for feature in self.layers[layerName]:
-            feature.update()
+        self.layers[layerName].update()
+
+    def cancel(self):
+        if self.loader is not None and self.loader.isRunning():
+            self.loader.requestInterruption()
+            self.loader.wait()
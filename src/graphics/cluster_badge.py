@@ -0,0 +1,82 @@
+from PySide2.QtCore import QRectF, Qt
+from PySide2.QtGui import QBrush, QColor, QFont, QPen
+from PySide2.QtWidgets import QGraphicsItem
+
+import preferences
+
+BADGE_COLOUR = QColor(30, 60, 120, 210)
+
+
+class ClusterBadge(QGraphicsItem):
+    """ A circle with the number of points it stands in for, drawn the same size at any zoom. """
+
+    font = None  # shared by every badge, made on first paint as it needs the QApplication
+
+    def __init__(self, zValue):
+        """
+        Constructor
+        """
+        QGraphicsItem.__init__(self)
+        self.setFlag(QGraphicsItem.ItemIgnoresTransformations)
+        self.setZValue(zValue)
+        self.count = 0
+        self.radius = 0
+
+    def setCount(self, count):
+        if count == self.count:
+            return
+        self.prepareGeometryChange()
+        self.count = count
+        self.radius = 9 + 3 * len(str(count))
+
+    def boundingRect(self):
+        return QRectF(-self.radius - 1, -self.radius - 1, 2 * self.radius + 2, 2 * self.radius + 2)
+
+    def paint(self, painter, option, widget=None):
+        painter.setRenderHint(painter.Antialiasing)
+        painter.setPen(QPen(Qt.white, 1.5))
+        painter.setBrush(QBrush(BADGE_COLOUR))
+        painter.drawEllipse(QRectF(-self.radius, -self.radius, 2 * self.radius, 2 * self.radius))
+
+        if ClusterBadge.font is None:
+            ClusterBadge.font = QFont()
+            ClusterBadge.font.setBold(True)
+            ClusterBadge.font.setPixelSize(11)
+        painter.setFont(ClusterBadge.font)
+        painter.drawText(self.boundingRect(), Qt.AlignCenter, str(self.count))
+
+
+class ClusterBadges:
+    """
+    The badges for one layer's clusters. Badges are reused from one update to the next rather
+    than being created and removed from the scene each time the view moves.
+    """
+
+    def __init__(self, view, zValue=preferences.ZVALUE_WFS):
+        """
+        Constructor
+        """
+        self.view = view
+        self.zValue = zValue
+        self.badges = []
+        self.shown = 0
+
+    def update(self, latLons, counts):
+        """ Show a badge for each cluster centre (an (M, 2) array of lat/lon) and hide the rest. """
+        while len(self.badges) < len(counts):
+            badge = ClusterBadge(self.zValue)
+            self.view.scene.addItem(badge)
+            self.badges.append(badge)
+
+        if len(counts):
+            xy = self.view.mapController.toCanvasCoordinatesArray(latLons)
+            for badge, (x, y), count in zip(self.badges, xy, counts):
+                badge.setCount(int(count))
+                badge.setPos(x, y)
+                badge.show()
+        for badge in self.badges[len(counts):self.shown]:
+            badge.hide()
+        self.shown = len(counts)
+
+    def clear(self):
+        self.update([], [])
@@ -0,0 +1,55 @@
+from PySide2.QtCore import QObject, QTimer
+
+from gis.mts_controller import WGS84_GEOD
+import preferences
+
+
+class CursorReadout(QObject):
+    """
+    Works out the lat/lon of the cursor and its bearing/distance from ownship for the
+    location label. Mouse moves only record the cursor position; the geodesic maths is
+    done at most once per display frame, and not at all if neither the location under the
+    cursor nor ownship has moved. The map moving under a still cursor counts as a move.
+    """
+
+    def __init__(self, view):
+        """
+        Constructor
+        """
+        super().__init__()
+
+        self.view = view
+        self.position = None
+        self.lastKey = None  # cursor lat/lon and ownship lat/lon the label was last worked out for
+
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.refresh)
+
+    def cursorMoved(self, position):
+        """ Called from the mouse move event so must stay cheap. """
+        self.position = position
+        if not self.timer.isActive():
+            self.timer.start(int(1000 / preferences.MAX_FRAME_RATE))
+
+    def viewMoved(self):
+        """ Called when the map has been panned or zoomed, which moves it under the cursor. """
+        if self.position is not None:
+            self.cursorMoved(self.position)
+
+    def refresh(self):
+        """ Update the location label for the latest cursor position. """
+        position = self.position
+        ownship = self.view.ownship
+        if ownship is None or position is None:
+            return
+
+        ll = self.view.mapController.toGeographicalCoordinates(position.x(), position.y())
+        mouseLat, mouseLon = ll.x(), ll.y()
+        key = (mouseLat, mouseLon, ownship.lat, ownship.lon)
+        if key == self.lastKey:
+            return
+        self.lastKey = key
+
+        bearing, _, distance = WGS84_GEOD.inv(ownship.lon, ownship.lat, mouseLon, mouseLat)
+        self.view.mainWindow.updateLocationLabel(mouseLat, mouseLon, bearing, distance)
@@ -1,6 +1,5 @@
 from builtins import str
 import json
-from math import radians
 import random
 
 from PySide2.QtCore import QPoint, Qt, QPointF, QRect, QEvent, QTimer, Signal
@@ -10,17 +9,21 @@ from PySide2.QtWidgets import QGraphicsView, QGraphicsScene, QLabel, QFrame, \
 from owslib.wms import WebMapService
 
 from gis.mts import MTSLayer
+from gis.land_mask import LandMask
 from gis.mts_controller import MTSController
-from gis.wfs import WFS
+from gis.ncwms_query_engine import NCWMSQueryEngine
+from gis.wfs import WFS, WFS_LAYERS
+from graphics.cluster_badge import ClusterBadges
+from graphics.cursor_readout import CursorReadout
+from graphics.render_scheduler import RenderScheduler
 from graphics.toolbox import Toolbox
-from model.feature import Feature
 from model.layers import TacticalLayer, AnnotationsLayer, RulerLayer, \
-    SpirographLayer, NavChartsTemplateLayer
+    SpirographLayer, NavChartsTemplateLayer, FeatureLayer
+from model.clustering import PointClusters
 from model.ownship import Ownship
+from model.spatial_index import SpatialGrid
 import preferences
 
-from src.gis.mts_controller import distanceBetweenTwoPoints, angleBetweenTwoPoints
-
 
 class Map(QGraphicsView):
     """
@@ -66,7 +69,16 @@ class Map(QGraphicsView):
         self.truthEntities = {}
         self.contacts = {}
         self.ownship = None
-
+        self.wfs = None
+        self.entityIndex = SpatialGrid()  # of the entity objects themselves
+        self.shownEntities = set()  # entities not culled, i.e. on screen as of the last frame
+        self.contactClusters = PointClusters()
+        self.contactBadges = ClusterBadges(self, preferences.ZVALUE_Icons)
+
+        self.renderScheduler = RenderScheduler(self)
+        self.cursorReadout = CursorReadout(self)
+        self.ncwmsQueryEngine = NCWMSQueryEngine()
+        self.landMask = LandMask()
         self.mapController = MTSController(self,
                                            QRect(0,
                                                  0,
@@ -83,7 +95,7 @@ class Map(QGraphicsView):
         self.metaDialogProxy = None
 
         self.viewport().installEventFilter(self)
-        self.update()
+        self.updateOverlays()
 
         self.runCacheBuilder = False
         self.cacheBuilder()
@@ -112,9 +124,15 @@ class Map(QGraphicsView):
         self.setSceneRect(0, 0, self.frameSize().width(), self.frameSize().height())
 
     def update(self):
+        """ Overlays are repositioned once per frame by the render scheduler. """
+        self.renderScheduler.requestUpdate(RenderScheduler.OVERLAYS)
+
+    def updateOverlays(self):
 
         self.updateAllGraphicsLayers()
         self.updateOwnship()
+        self.cullEntities()
+        self.clusterContacts()
 
     #         self.updateSolutions()
     #         self.updateTruth()
@@ -137,7 +155,7 @@ class Map(QGraphicsView):
                               osSpeed,
                               osCourse)
 
-            self.truthEntities['OS'] = ownship
+            self.addEntity('OS', ownship)
             self.tacticalLayers['Ownship'] = ownship
             self.ownship = ownship
             self.toolbox.createOwnshipMenu()
@@ -174,15 +192,15 @@ class Map(QGraphicsView):
     #             if entityId not in self.truthEntities:
     #                 # If this is not us, add
     #                 if entity.entityId != preferences.user.vessel.VESSEL_OWNSHIP_ID:
-    #                     self.truthEntities[entityId] = TruthEntity(self,
-    #                                                                str(entityId),
-    #                                                                self.mapController.toCanvasCoordinates(lat, lng).x(),
-    #                                                                self.mapController.toCanvasCoordinates(lat, lng).y(),
-    #                                                                entity.speed,
-    #                                                                entity.course,
-    #                                                                rnge,
-    #                                                                bearing,
-    #                                                                classification)
+    #                     self.addEntity(entityId, TruthEntity(self,
+    #                                                          str(entityId),
+    #                                                          self.mapController.toCanvasCoordinates(lat, lng).x(),
+    #                                                          self.mapController.toCanvasCoordinates(lat, lng).y(),
+    #                                                          entity.speed,
+    #                                                          entity.course,
+    #                                                          rnge,
+    #                                                          bearing,
+    #                                                          classification))
     #
     #             # we have a record of this entity so just need to maintain its parameters
     #             else:
@@ -194,6 +212,11 @@ class Map(QGraphicsView):
 
     #     def updateSolutions(self):
     #
+    #         # Contacts that have been dropped come off the map.
+    #         contactIds = {contact.getId() for contact in self.cruseData.getContacts()}
+    #         for contactId in set(self.contacts) - contactIds:
+    #             self.removeEntity(contactId)
+    #
     #         for contact in self.cruseData.getContacts():
     #
     #             contactId = contact.getId()
@@ -207,17 +230,17 @@ class Map(QGraphicsView):
     #             if contactId not in self.contacts:
     #                 # If this is not us, add
     #                 if contactId != preferences.user.vessel.VESSEL_OWNSHIP_ID:
-    #                     self.contacts[contactId] = Entity(self,
-    #                                                       'S{}'.format(contactId),
-    #                                                       contact.getAffiliation(),
-    #                                                       xy.x(),
-    #                                                       xy.y(),
-    #                                                       contact.getSpeed(),
-    #                                                       contact.getCourse(),
-    #                                                       contact.getRange(),
-    #                                                       contact.getBearing(),
-    #                                                       contact.getClassification(),
-    #                                                       30)
+    #                     self.addEntity(contactId, Entity(self,
+    #                                                      'S{}'.format(contactId),
+    #                                                      contact.getAffiliation(),
+    #                                                      xy.x(),
+    #                                                      xy.y(),
+    #                                                      contact.getSpeed(),
+    #                                                      contact.getCourse(),
+    #                                                      contact.getRange(),
+    #                                                      contact.getBearing(),
+    #                                                      contact.getClassification(),
+    #                                                      30), contact=True)
     #
     #             # we have a record of this entity so just need to maintain its parameters
     #             else:
@@ -244,9 +267,11 @@ class Map(QGraphicsView):
 
         self.navChartTemplates.update()
 
-        # Update location of all WFS icons
+        # Update location of all WFS icons, and load any that have come into view.
         for key in self.gisLayers:
             self.gisLayers[key].update()
+        if self.wfs is not None:
+            self.wfs.loadVisible()
 
     ''' ------------------------------------------------------------------------------------------------
                                             GIS FUNCTIONS
@@ -262,17 +287,11 @@ class Map(QGraphicsView):
 
     def wfsLoader(self):
 
-        # wfsConnection = WFS(self)
-        #
-        # self.bathy['Australian Airports'] = FeatureLayer(self, wfsConnection.getAirports(), True)
-        # self.bathy['Australian Airports'].draw()
-        #
-        # self.bathy['Australian Ports'] = FeatureLayer(self, wfsConnection.getPorts(), True)
-        # self.bathy['Australian Ports'].draw()
-        #
-        # self.bathy['Cities'] = FeatureLayer(self, wfsConnection.getCities(), True)
-        # self.bathy['Cities'].draw()
-        pass
+        """ WFS layers start empty and are filled in around the view as it moves. """
+        self.wfs = WFS(self)
+        for layerName in WFS_LAYERS:
+            self.gisLayers[layerName] = self.wfs.addLayer(layerName)
+        self.wfs.loadVisible()
 
     def loadLayers(self):
 
@@ -364,10 +383,6 @@ class Map(QGraphicsView):
         """
         Move map around or start drawing.
         """
-        # update location label
-        ll = self.mapController.toGeographicalCoordinates(event.pos().x(), event.pos().y())
-        mouseLat, mouseLon = ll.x(), ll.y()
-
         if self.currentlyDrawing:
             self.annotationLayers.layers[self.annotationLayers.activeLayerName].mouseMoveEvent(event)
         elif self.rulerLayer.currentlyRuling and self.rulerLayer.lineObject is not None:
@@ -375,15 +390,8 @@ class Map(QGraphicsView):
             endY = event.pos().y()
             self.rulerLayer.updateLine(endX, endY)
         elif self.ownship:
-            bearing = angleBetweenTwoPoints(radians(self.ownship.lat),
-                                            radians(self.ownship.lon),
-                                            radians(mouseLat),
-                                            radians(mouseLon))
-            distance = distanceBetweenTwoPoints(self.ownship.lat,
-                                                self.ownship.lon,
-                                                mouseLat,
-                                                mouseLon)
-            self.mainWindow.updateLocationLabel(mouseLat, mouseLon, bearing, distance)
+            # update location label
+            self.cursorReadout.cursorMoved(event.pos())
 
         if event.buttons() == Qt.LeftButton:
             # scroll map around
@@ -403,8 +411,7 @@ class Map(QGraphicsView):
         Move map around or start drawing.
         """
         clickedItem = self.itemAt(event.pos())
-
-        allEntities = list(self.contacts.values()) + list(self.truthEntities.values())
+        clickedEntity = self.entityAt(event.pos(), clickedItem)
         # Set start and end points of lineSegmentList in the ruler tool if ruling.
         if self.rulerLayer.currentlyRuling:
             if self.rulerLayer.lineObject is not None:
@@ -421,34 +428,142 @@ class Map(QGraphicsView):
                     self.previousItem.showHideMetaDialog(False)
 
             if event.buttons() == Qt.LeftButton:
-                if type(clickedItem) == Feature:
+                clickedFeature = self.featureAt(event.pos())
+                if clickedFeature is not None:
                     self.metaDialogVisible = True
-                    self.previousItem = clickedItem
-                    clickedItem.showHideMetaDialog(True)
+                    self.previousItem = clickedFeature
+                    clickedFeature.showHideMetaDialog(True)
 
-                for entity in allEntities:
-                    if clickedItem in entity.graphicsLayers[preferences.ICON].graphicObjects:
-                        self.metaDialogVisible = True
-                        self.previousItem = entity
-                        entity.showHideMetaDialog(self.metaDialogVisible)
-                        break
+                if clickedEntity is not None:
+                    self.metaDialogVisible = True
+                    self.previousItem = clickedEntity
+                    clickedEntity.showHideMetaDialog(self.metaDialogVisible)
 
                 self.leftClickSignal.emit(event)
 
             elif event.buttons() == Qt.RightButton:
-                clickedEntity = False
-                for entity in allEntities:
-                    if clickedItem in entity.graphicsLayers[preferences.ICON].graphicObjects:
-                        clickedEntity = True
-                        self.rightClickSignal.emit([event, entity])
-                        self.previousItem = entity
-                        break
-                if not clickedEntity:
-                    self.rightClickSignal.emit([event, None])
+                if clickedEntity is not None:
+                    self.previousItem = clickedEntity
+                self.rightClickSignal.emit([event, clickedEntity])
 
         self.cursorPosition = event.pos()
         super().mousePressEvent(event)
 
+    def viewportBbox(self, margin=0):
+        """
+        The area on screen, plus margin of its size on each side, as lon min, lat min, lon max,
+        lat max. It never goes past the edge of the world.
+        """
+        canvasRect = self.mapToScene(self.viewport().geometry()).boundingRect()
+        topLeft = self.mapController.toGeographicalCoordinates(canvasRect.left(), canvasRect.top())
+        bottomRight = self.mapController.toGeographicalCoordinates(canvasRect.right(), canvasRect.bottom())
+        lonMargin = (bottomRight.y() - topLeft.y()) * margin
+        latMargin = (topLeft.x() - bottomRight.x()) * margin
+        return (max(topLeft.y() - lonMargin, -180), max(bottomRight.x() - latMargin, -90),
+                min(bottomRight.y() + lonMargin, 180), min(topLeft.x() + latMargin, 90))
+
+    def hitTestArea(self, pos, radius=preferences.HIT_TEST_RADIUS):
+        """ The lat/lon of a view position and the bbox radius pixels around it. """
+        scenePos = self.mapToScene(pos)
+        latLon = self.mapController.toGeographicalCoordinates(scenePos.x(), scenePos.y())
+        topLeft = self.mapController.toGeographicalCoordinates(scenePos.x() - radius, scenePos.y() - radius)
+        bottomRight = self.mapController.toGeographicalCoordinates(scenePos.x() + radius, scenePos.y() + radius)
+        return latLon, (topLeft.y(), bottomRight.x(), bottomRight.y(), topLeft.x())
+
+    def featureAt(self, pos):
+        """ The WFS feature nearest a click, if there is one within HIT_TEST_RADIUS pixels. """
+        latLon, bbox = self.hitTestArea(pos)
+        lat, lon = latLon.x(), latLon.y()
+        maxDistance = (bbox[3] - bbox[1]) / 2
+        features = [layer.featureAt(lat, lon, maxDistance) for layer in self.gisLayers.values()
+                    if isinstance(layer, FeatureLayer) and layer.visible]
+        return min((feature for feature in features if feature is not None),
+                   key=lambda feature: (feature.lat - lat) ** 2 + (feature.long - lon) ** 2, default=None)
+
+    def shutdown(self):
+        """ Stop background work that would otherwise be torn down mid-run when the app quits. """
+        if self.wfs is not None:
+            self.wfs.cancel()
+
+    def addEntity(self, key, entity, contact=False):
+        """ Put a truth entity (or a contact) on the map and in the entity index. """
+        (self.contacts if contact else self.truthEntities)[key] = entity
+        self.entityIndex.insert(entity, entity.lat, entity.lon)
+        self.shownEntities.add(entity)  # culled on the next frame if it's off screen
+
+    def removeEntity(self, key):
+        """ Take a contact or truth entity, e.g. a dropped track, off the map and out of the index. """
+        entity = self.contacts.pop(key) if key in self.contacts else self.truthEntities.pop(key)
+        self.entityIndex.remove(entity)
+        self.shownEntities.discard(entity)
+        for layer in entity.graphicsLayers.values():
+            layer.removeAllGraphicsObjects()
+        self.update()
+
+    def entityMoved(self, entity):
+        """ Called by an entity once it has updated its position and graphics. """
+        if entity in self.entityIndex:
+            self.entityIndex.insert(entity, entity.lat, entity.lon)
+            self.shownEntities.add(entity)  # its update may have shown its graphics again
+
+    def cullEntities(self):
+        """
+        Hide the graphics of entities that have gone off screen (with a margin for their icons and
+        lines), found from the entity index, and show those that have come back on as their
+        layers are set. Ownship is never culled as its distance markers reach well off it.
+        """
+        onScreen = set(self.entityIndex.query(self.viewportBbox(0.1)))
+        if self.ownship is not None:
+            onScreen.add(self.ownship)
+
+        for entity in self.shownEntities - onScreen:
+            for layer in entity.graphicsLayers.values():
+                for item in layer.graphicObjects:
+                    item.hide()
+        for entity in onScreen - self.shownEntities:
+            for layer in entity.graphicsLayers.values():
+                for item in layer.graphicObjects:
+                    if layer.visible:
+                        item.show()
+        self.shownEntities = onScreen
+
+    def clusterContacts(self):
+        """
+        Zoomed out, contacts whose icons would be drawn on top of each other are replaced by a
+        badge with their count. Ownship is never clustered.
+        """
+        contacts = list(self.contacts.values())
+        self.contactClusters.setPoints([(contact.lat, contact.lon) for contact in contacts])
+        singles, clusters, level = self.contactClusters.split(self.mapController.tileZoomIndex,
+                                                              range(len(contacts)))
+        singles = set(singles.tolist())
+        for position, contact in enumerate(contacts):
+            if contact not in self.shownEntities:
+                continue  # culled
+            iconLayer = contact.graphicsLayers[preferences.ICON]
+            for item in iconLayer.graphicObjects:
+                item.setVisible(iconLayer.visible and position in singles)
+
+        if len(clusters):
+            self.contactBadges.update(level.latLons[clusters], level.counts[clusters])
+        else:
+            self.contactBadges.clear()
+
+    def entityAt(self, pos, clickedItem):
+        """
+        The contact or truth entity whose icon was clicked. Only the entities within the clicked
+        item's size of the click (from the entity index) are checked.
+        """
+        if clickedItem is None:
+            return None
+
+        itemRect = clickedItem.sceneBoundingRect()
+        _, bbox = self.hitTestArea(pos, max(itemRect.width(), itemRect.height(), preferences.HIT_TEST_RADIUS))
+        for entity in self.entityIndex.query(bbox):
+            if clickedItem in entity.graphicsLayers[preferences.ICON].graphicObjects:
+                return entity
+        return None
+
     def testUrl(self, location):
 
         # CRUSE:Aust_Benthic_Substrate
@@ -538,22 +653,18 @@ class Map(QGraphicsView):
                                             NAVIGATION FUNCTIONS
         ------------------------------------------------------------------------------------------------ '''
 
-    def zoomOwnship(self):
+    def zoomOwnship(self, animate=False):
         """
         Moves the canvas to be centred over OWNSHIP at a suitable zoom level.
         """
-        self.vectorZoom = 8
+        # The zoom the old stepped loop (8 grown by 10% while under 9) used to end on.
         self.rasterZoom = 8
-        while self.vectorZoom < 9:
-            self.mapController.moveToGeographicLocation(self.ownship.lat, self.ownship.lon)
-            self.vectorZoom *= 1.1
-            self.mapController.updateZoom()
+        self.mapController.flyTo(self.ownship.lat, self.ownship.lon, 8 * 1.1 ** 2, animate)
 
         self.ownship.update(self.ownship.x,
                             self.ownship.y,
                             self.ownship.speed,
                             self.ownship.course)
-        self.scene.update()
 
     ''' ------------------------------------------------------------------------------------------------
                                             UTILITY FUNCTIONS
@@ -570,6 +681,8 @@ class Map(QGraphicsView):
                         print('{}, {} @ {}'.format(easting, northing, zoom))
                         self.mapController.tileZoomIndex = zoom
                         self.mapController.updateZoom()
+                        # Building the cache can't wait for the next frame.
+                        self.mapController.update()
 
     ''' ------------------------------------------------------------------------------------------------
                                             TEST/DEMO FUNCTIONS
@@ -670,15 +783,15 @@ class Map(QGraphicsView):
         r = random.randint(0, 3)
         if r == 0:
             # Perth
-            self.moveToGeographicLocation(-32.2138204, 115.0387413)
+            self.mapController.flyTo(-32.2138204, 115.0387413)
             print('Perth')
         elif r == 1:
             # Adelaide
-            self.moveToGeographicLocation(-35.09138204, 138.07387413)
+            self.mapController.flyTo(-35.09138204, 138.07387413)
             print('Adelaide')
         elif r == 2:
             # London
-            self.moveToGeographicLocation(51.5074, 0.1278)
+            self.mapController.flyTo(51.5074, 0.1278)
             print('London')
 
     def drawRandomThreatArc(self, move):
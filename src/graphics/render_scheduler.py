@@ -0,0 +1,98 @@
+import time
+
+from PySide2.QtCore import QObject, QTimer
+
+import preferences
+
+
+class RenderScheduler(QObject):
+    """
+    Map mutations (pan, zoom, key presses, entity updates) only mark the view state as dirty.
+    The actual tile and overlay work is done once per display frame, no matter how many
+    events arrived in between.
+    """
+    TILES = 0x1  # centre/zoom/canvas changed: resolve and render the full tile set
+    PAN = 0x2  # centre moved at the same zoom: only newly exposed tiles are needed
+    OVERLAYS = 0x4  # features, entities, rulers etc. need repositioning
+    REPAINT = 0x8  # redraw the tiles already in memory, don't fetch anything
+
+    def __init__(self, view, frameRate=preferences.MAX_FRAME_RATE):
+        """
+        Constructor
+        """
+        super().__init__()
+
+        self.view = view
+        self.dirty = 0
+        self.panOrigin = None
+        self.frameInterval = 0
+        self.lastFrameTime = 0
+
+        # statistics
+        self.requestCount = 0
+        self.mergedCount = 0
+        self.frameCount = 0
+        self.droppedFrameCount = 0
+
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.renderFrame)
+
+        self.setFrameRate(frameRate)
+
+    def setFrameRate(self, frameRate):
+        """ Cap the number of frames rendered per second. """
+        self.frameInterval = 1 / frameRate
+
+    def requestUpdate(self, flags):
+        """ Mark part of the view as dirty. It will be rendered at the start of the next frame. """
+        self.requestCount += 1
+        if self.dirty:
+            # Another event already scheduled this frame.
+            self.mergedCount += 1
+        self.dirty |= flags
+
+        if not self.timer.isActive():
+            wait = self.frameInterval - (time.perf_counter() - self.lastFrameTime)
+            self.timer.start(max(0, int(wait * 1000)))
+
+    def requestPan(self, previousTiles):
+        """
+        Keep the tile range that was on screen when the first pan of this frame happened so
+        that all the pans merged into the frame only fetch what has been exposed since then.
+        """
+        if self.panOrigin is None:
+            self.panOrigin = previousTiles
+        self.requestUpdate(self.PAN)
+
+    def renderFrame(self):
+        """ Do one consolidated tile/overlay update for everything that happened since the last frame. """
+        start = time.perf_counter()
+        dirty, self.dirty = self.dirty, 0
+        panOrigin, self.panOrigin = self.panOrigin, None
+
+        controller = self.view.mapController
+        if dirty & self.TILES:
+            controller.update()
+        elif dirty & self.PAN:
+            controller.pan(panOrigin)
+        elif dirty & self.REPAINT:
+            controller.repaint()
+
+        if dirty & self.OVERLAYS:
+            self.view.updateOverlays()
+        if dirty & (self.TILES | self.PAN | self.REPAINT):
+            self.view.cursorReadout.viewMoved()
+
+        self.frameCount += 1
+        self.lastFrameTime = time.perf_counter()
+
+        # Any whole frame intervals spent in here are frames the display did not get.
+        self.droppedFrameCount += int((self.lastFrameTime - start) / self.frameInterval)
+
+    def statistics(self):
+        """ Counters to show how much work is being saved (or lost) by the scheduler. """
+        return {'requests': self.requestCount,
+                'merged': self.mergedCount,
+                'frames': self.frameCount,
+                'dropped': self.droppedFrameCount}
@@ -0,0 +1,111 @@
+from math import ceil
+
+from PySide2.QtCore import QRectF, Qt
+from PySide2.QtGui import QPainter, QPixmap
+from PySide2.QtSvg import QGraphicsSvgItem, QSvgRenderer
+
+import preferences
+
+renderers = {}  # SVG file path: QSvgRenderer
+
+
+def sharedRenderer(path):
+    """ The one QSvgRenderer for an SVG file, which is only parsed the first time it's asked for. """
+    path = str(path)
+    renderer = renderers.get(path)
+    if renderer is None:
+        renderer = QSvgRenderer(path)
+        renderers[path] = renderer
+    return renderer
+
+
+class SymbolAtlas:
+    """
+    Symbols rasterised at the pixel sizes they are drawn at, packed in rows (shelves) into a few
+    large pixmaps. Small symbols are then drawn as a copy out of an atlas page rather than
+    rendering the SVG again on every paint.
+    """
+
+    def __init__(self, size=preferences.SYMBOL_ATLAS_SIZE, padding=1):
+        """
+        Constructor
+        """
+        self.size = size
+        self.padding = padding
+        self.pages = []
+        self.entries = {}  # (path, width, height): (page index, QRectF)
+        self.shelfX = 0
+        self.shelfY = 0
+        self.shelfHeight = 0
+
+    def symbol(self, path, width, height):
+        """ The atlas page and the rectangle on it holding a symbol at width x height pixels. """
+        key = (path, width, height)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.add(path, width, height)
+            self.entries[key] = entry
+        page, rect = entry
+        return self.pages[page], rect
+
+    def add(self, path, width, height):
+        # Start a new shelf when this row is full and a new page when the page is.
+        if self.shelfX + width > self.size:
+            self.shelfX = 0
+            self.shelfY += self.shelfHeight + self.padding
+            self.shelfHeight = 0
+        if not self.pages or self.shelfY + height > self.size:
+            page = QPixmap(self.size, self.size)
+            page.fill(Qt.transparent)
+            self.pages.append(page)
+            self.shelfX = 0
+            self.shelfY = 0
+            self.shelfHeight = 0
+
+        rect = QRectF(self.shelfX, self.shelfY, width, height)
+        painter = QPainter(self.pages[-1])
+        painter.setRenderHint(QPainter.Antialiasing)
+        sharedRenderer(path).render(painter, rect)
+        painter.end()
+
+        self.shelfX += width + self.padding
+        self.shelfHeight = max(self.shelfHeight, height)
+        return len(self.pages) - 1, rect
+
+    def clear(self):
+        self.pages.clear()
+        self.entries.clear()
+        self.shelfX = 0
+        self.shelfY = 0
+        self.shelfHeight = 0
+
+
+symbolAtlas = SymbolAtlas()
+
+
+class SymbolItem(QGraphicsSvgItem):
+    """
+    A QGraphicsSvgItem that shares one renderer with every other item showing the same SVG file.
+    While it is no more than SYMBOL_ATLAS_MAX_SIZE pixels on screen (i.e. zoomed out) it is
+    drawn from the symbol atlas; bigger than that it is rendered from the SVG as usual.
+    """
+
+    def __init__(self, path, parent=None):
+        """
+        Constructor
+        """
+        QGraphicsSvgItem.__init__(self, parent)
+        self.symbolPath = str(path)
+        self.setSharedRenderer(sharedRenderer(self.symbolPath))
+
+    def paint(self, painter, option, widget=None):
+        bounds = self.boundingRect()
+        levelOfDetail = option.levelOfDetailFromTransform(painter.worldTransform())
+        width = ceil(bounds.width() * levelOfDetail)
+        height = ceil(bounds.height() * levelOfDetail)
+        if max(width, height) > preferences.SYMBOL_ATLAS_MAX_SIZE or min(width, height) < 1:
+            QGraphicsSvgItem.paint(self, painter, option, widget)
+            return
+
+        page, source = symbolAtlas.symbol(self.symbolPath, width, height)
+        painter.drawPixmap(bounds, page, source)
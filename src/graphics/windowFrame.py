@@ -153,6 +153,7 @@ class WindowFrame(QWidget):
         self.distanceLabel = QLabel('MullsyMaps')
         self.progress = ''
         self.progressUpdateThread = ProgressWorker()
+        self.progressUpdateThread.tickSignal.connect(self.updateProgress)
 
     def initUi(self):
 
@@ -329,19 +330,27 @@ class WindowFrame(QWidget):
         Starts drawing and updating the progress bar to show that something is happening.
         """
         if not self.progressUpdateThreadRunning:
-            self.progressUpdateThread.tickSignal.connect(self.updateProgress)
             self.progressUpdateThread.start()
             self.progressUpdateThreadRunning = True
 
     def stopProgressUpdateThread(self):
         """ Stops the progress bar when lengthy computations are complete. """
         if self.progressUpdateThreadRunning:
-            self.progressUpdateThread.terminate()
+            self.progressUpdateThread.requestInterruption()
+            self.progressUpdateThread.wait()
             self.statusValueLabel.setText('')
             self.progressUpdateThreadRunning = False
 
-    def updateProgress(self):
-        """ Adds at 'tick' to the progress bar every half second. """
+    def updateProgress(self, done=None, total=None):
+        """
+        Adds at 'tick' to the progress bar every half second. Work that knows how far through
+        it is passes done/total instead and the bar shows that.
+        """
+        if total:
+            self.progress = '|' * round(10 * done / total)
+            self.statusValueLabel.setText('{} {}/{}'.format(self.progress, done, total))
+            return
+
         self.progress += '|'
         if self.progress == '|||||||||||':
             self.progress = ''
@@ -355,7 +364,7 @@ class WindowFrame(QWidget):
 
     def zoomOwnship(self):
         """ Move to centre of ownShip and zoom in. """
-        self.map.zoomOwnship()
+        self.map.zoomOwnship(animate=True)
 
     def updateLocationLabel(self, mouseLat, mouseLon, bearing, distance):
         """
@@ -419,6 +428,10 @@ class ProgressWorker(QThread):
 
     @Slot()
     def run(self):
-        while True:
+        while not self.isInterruptionRequested():
             self.tickSignal.emit()
-            time.sleep(0.5)
+            # Sleep in short steps so a stop request doesn't have to wait out the whole tick.
+            for _ in range(10):
+                if self.isInterruptionRequested():
+                    break
+                time.sleep(0.05)
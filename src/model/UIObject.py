@@ -1,7 +1,7 @@
 from PySide2.QtCore import QObject
-from PySide2.QtSvg import QGraphicsSvgItem
 
 from graphics.mil_std_icon import MilStdIcon
+from graphics.symbol_cache import SymbolItem
 
 
 class UIObject(QObject):
@@ -15,7 +15,7 @@ class UIObject(QObject):
         """
         super(UIObject, self).__init__()
         self.map = map
-        self.icon = QGraphicsSvgItem(str(MilStdIcon(affiliation, classification).getIconPath()))
+        self.icon = SymbolItem(MilStdIcon(affiliation, classification).getIconPath())
         self.decorators = {}
         self.designation = designation
         self.affiliation = affiliation
@@ -0,0 +1,146 @@
+import numpy
+
+from gis.mts_controller import TILE_DIMENSION
+import preferences
+
+
+def cellSize(zoom, radius=preferences.CLUSTER_RADIUS):
+    """ Degrees covered by radius pixels at a raster zoom level (the tiles are equirectangular). """
+    return radius * 180.0 / (TILE_DIMENSION * (1 << zoom))
+
+
+def grow(array, length):
+    """ array, or a zero padded copy with room for at least length rows (doubling, so appends are cheap). """
+    if length <= len(array):
+        return array
+    grown = numpy.zeros((max(length, 2 * len(array)),) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class ClusterLevel:
+    """
+    The clusters at one zoom level: one per occupied grid cell, centred on the mean of its
+    points. Points can be added to it at any time.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.cellClusters = {}  # (row, column): cluster index
+        self.sums = numpy.zeros((0, 2))  # lat/lon totals of each cluster's points
+        self.clusterCounts = numpy.zeros(0, dtype=int)
+        self.pointLabels = numpy.zeros(0, dtype=int)
+        self.size = 0  # points added
+
+    @property
+    def counts(self):
+        """ (M,) points in each cluster. """
+        return self.clusterCounts[:len(self.cellClusters)]
+
+    @property
+    def labels(self):
+        """ (N,) the cluster each point belongs to. """
+        return self.pointLabels[:self.size]
+
+    @property
+    def latLons(self):
+        """ (M, 2) cluster centres. """
+        return self.sums[:len(self.cellClusters)] / self.counts[:, None]
+
+    def add(self, cells, latLons):
+        """ Add points, given the (row, column) of the cell each falls in at this level. """
+        uniqueCells, inverse = numpy.unique(cells, axis=0, return_inverse=True)
+        clusters = numpy.array([self.cellClusters.setdefault(cell, len(self.cellClusters))
+                                for cell in map(tuple, uniqueCells.tolist())], dtype=int)
+        labels = clusters[inverse.reshape(-1)]
+
+        self.clusterCounts = grow(self.clusterCounts, len(self.cellClusters))
+        self.sums = grow(self.sums, len(self.cellClusters))
+        numpy.add.at(self.clusterCounts, labels, 1)
+        numpy.add.at(self.sums, labels, latLons)
+
+        self.pointLabels = grow(self.pointLabels, self.size + len(labels))
+        self.pointLabels[self.size:self.size + len(labels)] = labels
+        self.size += len(labels)
+
+
+class PointClusters:
+    """
+    Groups points that would be drawn within CLUSTER_RADIUS pixels of each other at each raster
+    zoom level. Each level is a grid over the points, and a grid cell is exactly four cells of
+    the level above, so the clusters nest from maxZoom down. A level is only worked out the
+    first time it's needed and is kept until the points change; points that are added (e.g. a
+    batch of WFS features) are just added to the levels already worked out.
+    """
+
+    def __init__(self, radius=preferences.CLUSTER_RADIUS, maxZoom=preferences.CLUSTER_MAX_ZOOM):
+        """
+        Constructor
+        """
+        self.radius = radius  # pixels
+        self.maxZoom = maxZoom  # above this nothing is clustered
+        self.latLons = numpy.zeros((0, 2))  # rows past self.count are room to grow
+        self.cells = numpy.zeros((0, 2), dtype=numpy.int64)  # each point's grid cell at maxZoom
+        self.count = 0
+        self.levels = {}  # raster zoom: ClusterLevel
+
+    def __len__(self):
+        return self.count
+
+    def points(self):
+        return self.latLons[:self.count]
+
+    def setPoints(self, latLons):
+        """ Replace the points being clustered. The cached levels are kept if nothing has moved. """
+        latLons = numpy.asarray(latLons, dtype=float).reshape(-1, 2)
+        if numpy.array_equal(latLons, self.points()):
+            return
+        self.count = 0
+        self.levels.clear()
+        self.addPoints(latLons)
+
+    def addPoints(self, latLons):
+        """ Add points to those being clustered, and to each level worked out so far. """
+        latLons = numpy.asarray(latLons, dtype=float).reshape(-1, 2)
+        if not len(latLons):
+            return
+        start = self.count
+        self.count += len(latLons)
+        self.latLons = grow(self.latLons, self.count)
+        self.latLons[start:self.count] = latLons
+        self.cells = grow(self.cells, self.count)
+        self.cells[start:self.count] = numpy.floor(latLons / cellSize(self.maxZoom, self.radius))
+
+        for zoom, level in self.levels.items():
+            level.add(self.cells[start:self.count] >> (self.maxZoom - zoom), latLons)
+
+    def level(self, zoom):
+        """ The clusters at a raster zoom level, or None if points aren't clustered at that zoom. """
+        if zoom > self.maxZoom or not self.count:
+            return None
+        zoom = max(zoom, 0)
+
+        level = self.levels.get(zoom)
+        if level is None:
+            level = ClusterLevel()
+            # Halving the cell index (rounding down) is the cell one zoom level out.
+            level.add(self.cells[:self.count] >> (self.maxZoom - zoom), self.points())
+            self.levels[zoom] = level
+        return level
+
+    def split(self, zoom, positions):
+        """
+        Split the points at positions into those drawn on their own and the clusters the rest
+        belong to. Returns (positions of single points, indices of clusters, the ClusterLevel).
+        Nothing is clustered if the level is None.
+        """
+        positions = numpy.asarray(positions, dtype=int)
+        level = self.level(zoom)
+        if level is None or not len(positions):
+            return positions, numpy.empty(0, dtype=int), level
+
+        labels = level.labels[positions]
+        grouped = level.counts[labels] > 1
+        return positions[~grouped], numpy.unique(labels[grouped]), level
@@ -0,0 +1,93 @@
+import numpy
+
+import preferences
+
+METRES_PER_YARD = 0.9144
+ISOTHERMAL_GRADIENT = 0.0163  # m/s per m, the sound speed gradient due to pressure alone
+MAX_LAYER_DEPTH = 300  # metres, deeper sound speed maxima are the deep channel, not a surface duct
+SHALLOW_WATER_DEPTH = 200  # metres, the bottom only traps sound in water shallower than this
+
+
+def erfc(x):
+    """ Complementary error function for arrays (Abramowitz & Stegun 7.1.26, error < 1.5e-7). """
+    x = numpy.asarray(x, dtype=float)
+    z = numpy.abs(x)
+    t = 1 / (1 + 0.3275911 * z)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    value = poly * numpy.exp(-z * z)
+    return numpy.where(x >= 0, value, 2 - value)
+
+
+def thorpAbsorption(frequency):
+    """ Thorp's sea water absorption coefficient in dB/km for a frequency in kHz. """
+    f2 = frequency ** 2
+    return 0.11 * f2 / (1 + f2) + 44 * f2 / (4100 + f2) + 2.75e-4 * f2 + 0.003
+
+
+def layerDepth(levels, soundSpeeds):
+    """
+    Sonic layer depth: the depth of the sound speed maximum in the upper ocean, below which
+    sound is refracted downwards. levels are the depths of the first axis of soundSpeeds; the
+    remaining axes are locations. 0 where there is no surface duct or no data.
+    """
+    levels = numpy.abs(numpy.asarray(levels, dtype=float))
+    soundSpeeds = numpy.asarray(soundSpeeds, dtype=float)
+    shallow = levels <= MAX_LAYER_DEPTH
+    if not shallow.any():
+        return numpy.zeros(soundSpeeds.shape[1:])
+
+    upper = soundSpeeds[shallow]
+    maxima = numpy.argmax(numpy.where(numpy.isnan(upper), -numpy.inf, upper), axis=0)
+    return numpy.where(numpy.isnan(upper).all(axis=0), 0, levels[shallow][maxima])
+
+
+def isShallow(waterDepths):
+    """ True where the bottom traps the sound, so a surface duct makes no difference. """
+    waterDepths = numpy.asarray(waterDepths, dtype=float)
+    with numpy.errstate(invalid='ignore'):
+        return (0 < waterDepths) & (waterDepths < SHALLOW_WATER_DEPTH)
+
+
+def transmissionLoss(ranges, waterDepths, layerDepths, soundSpeeds, frequency=preferences.DETECTION_FREQUENCY):
+    """
+    One way transmission loss (dB) over a range in metres. Spreading is spherical out to a
+    transition range and cylindrical beyond it, where the sound is trapped either by the
+    bottom in shallow water (transition at the water depth) or, in deep water, by a surface
+    duct of depth D (Urick's transition range sqrt(R * D / 8), R being the radius of curvature
+    of the duct's limiting ray). Thorp absorption is added on top. All arguments broadcast
+    against each other.
+    """
+    ranges = numpy.maximum(numpy.asarray(ranges, dtype=float), 1)
+    layerDepths = numpy.asarray(layerDepths, dtype=float)
+    waterDepths = numpy.asarray(waterDepths, dtype=float)
+
+    with numpy.errstate(invalid='ignore'):
+        ductRange = numpy.where(layerDepths > 0,
+                                numpy.sqrt(soundSpeeds / ISOTHERMAL_GRADIENT * layerDepths / 8), numpy.inf)
+    transition = numpy.minimum(numpy.where(isShallow(waterDepths), waterDepths, ductRange), ranges)
+
+    spreading = 20 * numpy.log10(transition) + 10 * numpy.log10(ranges / transition)
+    return spreading + thorpAbsorption(frequency) * ranges / 1000
+
+
+def figureOfMerit(rangeOfTheDay, frequency=preferences.DETECTION_FREQUENCY):
+    """
+    The transmission loss (dB) a sonar can tolerate, taken from the range of the day (metres):
+    the range at which detection is 50/50 in open deep water (spherical spreading, no duct).
+    """
+    return 20 * numpy.log10(rangeOfTheDay) + thorpAbsorption(frequency) * rangeOfTheDay / 1000
+
+
+def detectionProbability(ranges, waterDepths, layerDepths, soundSpeeds, merit,
+                frequency=preferences.DETECTION_FREQUENCY, sigma=preferences.DETECTION_SIGMA):
+    """
+    Probability of detection from the sonar equation. The signal excess (figure of merit less
+    transmission loss) is taken as normally distributed with a standard deviation of sigma dB,
+    so Pd = 0.5 * erfc(-SE / (sigma * sqrt(2))). NaN where there is no sound speed (e.g. land).
+    A whole route of spirographs is a few hundred thousand points at most, which numpy gets
+    through in tens of milliseconds on the fill worker's thread.
+    """
+    soundSpeeds = numpy.asarray(soundSpeeds, dtype=float)
+    signalExcess = merit - transmissionLoss(ranges, waterDepths, layerDepths, soundSpeeds, frequency)
+    with numpy.errstate(invalid='ignore'):
+        return numpy.where(soundSpeeds > 0, 0.5 * erfc(-signalExcess / (sigma * numpy.sqrt(2))), numpy.nan)
@@ -260,6 +260,8 @@ class Entity(UIObject):
             else:
                 layer.showHide('hide')
 
+        self.view.entityMoved(self)
+
     def showHideAllLayers(self):
         """
         Used to show/hide the entity icon and all graphicsLayers.
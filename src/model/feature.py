@@ -1,10 +1,10 @@
-from PySide2.QtSvg import QGraphicsSvgItem
 from PySide2.QtWidgets import QLabel
 
+from graphics.symbol_cache import SymbolItem
 import preferences
 
 
-class Feature(QGraphicsSvgItem):
+class Feature(SymbolItem):
     """
     This represents a Web Feature Service (WFS) item on the map. It consists of an icon (SVG) that when clicked,
     displays a dialog with some information about the Feature.
@@ -14,7 +14,7 @@ class Feature(QGraphicsSvgItem):
         """
         Constructor
         """
-        QGraphicsSvgItem.__init__(self, str(iconPath), parent=None)
+        SymbolItem.__init__(self, iconPath, parent=None)
         self.view = view
         self.metadata = ''
         self.metaDialogProxy = None
@@ -1,11 +1,18 @@
-from PySide2.QtCore import QPointF, Qt
+from math import floor
+
+from PySide2.QtCore import QPointF, Qt, QThread, Signal
 from PySide2.QtGui import QPen, QFont, QColor, QTransform
 from PySide2.QtWidgets import QGraphicsLineItem
-import pyproj
+import numpy
 
-from gis.ncwms_tools import NCWMSTools
+from gis.mts_controller import TILE_DIMENSION, WGS84_GEOD, vincentyDirect
+from gis.ncwms_tools import NCWMSTools, MAX_DEPTH_LAYER, SOUND_SPEED_LAYER
+from graphics.cluster_badge import ClusterBadges
 from graphics.paint.annotation_tool import AnnotationCanvas
-from model.spirograph import Spirograph
+from model.clustering import PointClusters
+from model.detection import detectionProbability, figureOfMerit, isShallow, layerDepth, METRES_PER_YARD
+from model.spatial_index import SpatialGrid
+from model.spirograph import Spirograph, CoverageMesh
 import preferences
 
 SONAR_RANGE_OF_THE_DAY = 25000  # yards
@@ -110,14 +117,9 @@ class AnnotationsLayer:
             scale = layer.initialZoom / self.view.vectorZoom
             self.updateZoom(scale)
 
-        # move the map to the right position
-        self.view.vectorZoom = layer.initialZoom
-        self.view.mapController.updateZoom()
-        canvasCoords = self.view.mapController.toCanvasCoordinates(layer.lat, layer.lon)
-        geoCoords = self.view.mapController.toGeographicalCoordinates(canvasCoords.x(), canvasCoords.y() + 35)
-        self.view.mapController.moveToGeographicLocation(geoCoords.x(), geoCoords.y())
-
-        self.view.scene.update()
+        # move the map to the right position (35 pixels below the layer centre at the new zoom)
+        latOffset = 35 * 180 / (TILE_DIMENSION * 2 ** floor(layer.initialZoom))
+        self.view.mapController.flyTo(layer.lat - latOffset, layer.lon, layer.initialZoom)
 
 
 class RulerLayer:
@@ -173,8 +175,14 @@ class RulerLayer:
 
     def updateLines(self):
         """ Move lines with map. """
-        for line in self.lineSegmentList:
-            line.updatePosition()
+        if not self.lineSegmentList:
+            return
+        latLons = [(latLon.x(), latLon.y())
+                   for line in self.lineSegmentList
+                   for latLon in (line.startLatLon, line.endLatLon)]
+        xy = self.view.mapController.toCanvasCoordinatesArray(latLons).reshape(-1, 4)
+        for line, (startX, startY, endX, endY) in zip(self.lineSegmentList, xy):
+            line.proxy.setLine(startX, startY, endX, endY)
 
     def updateLine(self, endX, endY):
         """ Allows preview of line to move with mouse. """
@@ -215,6 +223,127 @@ class RulerLayer:
         self.lineObject = None
 
 
+class SpirographFillWorker(QThread):
+    """
+    Looks up the depth and sound speed for the segments of each spirograph off the GUI thread
+    and works out the probability of detection for each. Each spirograph is handed back as soon
+    as it is done so they colour in one by one.
+    """
+    spirographFilled = Signal(int, int, object, object, object)  # fill, index, depths, sound speeds, p(detection)
+    progress = Signal(int, int)  # done, total
+
+    def __init__(self, generation, ncwmsTools, origins, segmentCentres, depth):
+        QThread.__init__(self)
+
+        self.generation = generation  # which fill of the SpirographLayer this is
+        self.ncwmsTools = ncwmsTools
+        self.origins = origins  # (lat, lon) of the sensor for each spirograph
+        self.segmentCentres = segmentCentres  # (lats, lons) arrays for each spirograph
+        self.depth = depth
+        self.merit = figureOfMerit(SONAR_RANGE_OF_THE_DAY * METRES_PER_YARD)
+
+    def run(self):
+        total = len(self.segmentCentres)
+        self.progress.emit(0, total)
+        if total == 0:
+            return
+
+        # Spirographs along a route overlap, so many segment centres fall in the same data cell.
+        # Each distinct cell is only looked up once.
+        lats = numpy.concatenate([centreLats for centreLats, _ in self.segmentCentres])
+        lons = numpy.concatenate([centreLons for _, centreLons in self.segmentCentres])
+        cells = numpy.round(numpy.column_stack((lats, lons)) / preferences.NCWMS_CACHE_RESOLUTION).astype(int)
+        _, firstIndices, cellIndices = numpy.unique(cells, axis=0, return_index=True, return_inverse=True)
+        cellIndices = cellIndices.ravel()
+        cellLats = lats[firstIndices]
+        cellLons = lons[firstIndices]
+        cellDepths = numpy.full(len(firstIndices), numpy.nan)
+        cellSoundSpeeds = numpy.full(len(firstIndices), numpy.nan)
+        cellFetched = numpy.zeros(len(firstIndices), dtype=bool)
+
+        # Range from each spirograph's sensor position to each of its segments.
+        counts = [len(centreLats) for centreLats, _ in self.segmentCentres]
+        originLats = numpy.repeat([lat for lat, _ in self.origins], counts)
+        originLons = numpy.repeat([lon for _, lon in self.origins], counts)
+        _, _, ranges = WGS84_GEOD.inv(originLons, originLats, lons, lats)
+
+        cellLayerDepths = numpy.zeros(len(firstIndices))
+        self.profile = None
+        self.profileFetched = False
+
+        # Try for one depth grid and one sound speed grid covering every spirograph.
+        depthGrid = self.ncwmsTools.getGridCovering(MAX_DEPTH_LAYER, cellLats, cellLons, 1)
+        soundSpeedGrid = self.ncwmsTools.getGridCovering(SOUND_SPEED_LAYER, cellLats, cellLons, self.depth)
+
+        # With both grids every cell is known up front, so the whole route is done in one go.
+        probabilities = None
+        if depthGrid is not None and soundSpeedGrid is not None:
+            cellDepths = depthGrid.sample(cellLats, cellLons)
+            cellSoundSpeeds = soundSpeedGrid.sample(cellLats, cellLons)
+            cellLayerDepths = self.layerDepths(cellLats, cellLons, cellDepths)
+            cellFetched[:] = True
+            probabilities = detectionProbability(ranges, cellDepths[cellIndices], cellLayerDepths[cellIndices],
+                                                 cellSoundSpeeds[cellIndices], self.merit)
+
+        start = 0
+        for index, (centreLats, _) in enumerate(self.segmentCentres):
+            if self.isInterruptionRequested():
+                return
+
+            segments = slice(start, start + len(centreLats))
+            spiroCells = cellIndices[segments]
+            start += len(centreLats)
+
+            newCells = numpy.unique(spiroCells[~cellFetched[spiroCells]])
+            if len(newCells) > 0:
+                newLats = cellLats[newCells]
+                newLons = cellLons[newCells]
+                if depthGrid is not None:
+                    cellDepths[newCells] = depthGrid.sample(newLats, newLons)
+                else:
+                    cellDepths[newCells] = self.ncwmsTools.queryPoints(MAX_DEPTH_LAYER, newLats, newLons, 1)
+                if soundSpeedGrid is not None:
+                    cellSoundSpeeds[newCells] = soundSpeedGrid.sample(newLats, newLons)
+                else:
+                    cellSoundSpeeds[newCells] = self.ncwmsTools.queryPoints(SOUND_SPEED_LAYER, newLats, newLons,
+                                                                            self.depth)
+                cellLayerDepths[newCells] = self.layerDepths(newLats, newLons, cellDepths[newCells], cellLats,
+                                                             cellLons)
+                cellFetched[newCells] = True
+
+            if probabilities is not None:
+                spiroProbabilities = probabilities[segments]
+            else:
+                spiroProbabilities = detectionProbability(ranges[segments], cellDepths[spiroCells],
+                                                          cellLayerDepths[spiroCells], cellSoundSpeeds[spiroCells],
+                                                          self.merit)
+
+            self.spirographFilled.emit(self.generation, index, cellDepths[spiroCells],
+                                       numpy.nan_to_num(cellSoundSpeeds[spiroCells], nan=-1), spiroProbabilities)
+            self.progress.emit(index + 1, total)
+
+    def layerDepths(self, lats, lons, waterDepths, coverLats=None, coverLons=None):
+        """
+        The depth of any surface duct at each location. Only deep water needs one (in shallow
+        water the bottom traps the sound), so the sound speed profile is fetched the first time
+        there is some, covering coverLats/coverLons (the locations themselves by default).
+        Without a profile no duct is assumed.
+        """
+        depths = numpy.zeros(len(lats))
+        deep = ~isShallow(waterDepths)
+        if not deep.any():
+            return depths
+
+        if not self.profileFetched:
+            self.profileFetched = True
+            self.profile = self.ncwmsTools.getProfileCovering(SOUND_SPEED_LAYER,
+                                                              lats if coverLats is None else coverLats,
+                                                              lons if coverLons is None else coverLons)
+        if self.profile is not None:
+            depths[deep] = layerDepth(self.profile.levels, self.profile.grid.sample(lats[deep], lons[deep]))
+        return depths
+
+
 class SpirographLayer:
 
     def __init__(self, view):
@@ -225,76 +354,107 @@ class SpirographLayer:
         self.spirographList = []
         self.depth = 0
         self.maxDepth = 0
+        self.fillWorker = None
+        self.fillGeneration = 0  # bumped on each cancel so values still queued from an old fill are dropped
+        self.fillMaxDepth = 155
+        self.coverageMesh = CoverageMesh(view)
 
     def fill(self):
         """
-        Once each segment that comprises each Spirograph is determined, it can be coloured based on the speed of sound
-        for that region. The speed of sound value is saved with the segment so each Spirograph can be redrawn quickly
-        without having to poll the server for the speed of sound.
+        Once each segment that comprises each Spirograph is determined, it can be coloured by the probability of
+        detection worked out from the speed of sound and depth for that region and its range from the sensor. The
+        values are saved with the segment so each Spirograph can be redrawn quickly without having to poll the server
+        again. The lookups are done by a SpirographFillWorker and each Spirograph is coloured as its values arrive.
         """
-        ncwmsTools = NCWMSTools(self.view)
+        self.cancelFill()
 
+        origins = []
+        segmentCentres = []
         for spiro in self.spirographList:
-            segmentList = [segment.segmentCentreLatLon for segment in spiro.spiroSegmentList]
-            spiro.maxDepth = ncwmsTools.getMaxDepth(segmentList)
-            self.maxDepth = max([spiro.maxDepth, self.maxDepth])
-
-            # If the ncWMS data does not have a value for this location, do not include it.
-            validSegments = []
-            for segment in spiro.spiroSegmentList:
-                segmentCentreXY = self.controller.toCanvasCoordinates(segment.segmentCentreLatLon.x(),
-                                                                      segment.segmentCentreLatLon.y())
-                segment.soundSpeed = ncwmsTools.getSoundSpeedForPoint(self.depth, segmentCentreXY.x(),
-                                                                      segmentCentreXY.y())
-                if segment.soundSpeed > 0:
-                    validSegments.append(segment)
-
-            maxSoundSpeed = max([segment.soundSpeed for segment in spiro.spiroSegmentList])
-            minSoundSpeed = min([segment.soundSpeed for segment in spiro.spiroSegmentList])
-            for segment in validSegments:
-                endDelta = maxSoundSpeed - minSoundSpeed
-                markerValue = (segment.soundSpeed - minSoundSpeed) / (endDelta if endDelta > 0 else 1)
-                segment.fillWithColourForRatio(markerValue)
-
-            self.view.mainWindow.setDepthLabel()
+            origins.append((spiro.rangeOfTheDayRadiusLatLon.x(), spiro.rangeOfTheDayRadiusLatLon.y()))
+            centres = [segment.segmentCentreLatLon for segment in spiro.spiroSegmentList]
+            segmentCentres.append((numpy.array([centre.x() for centre in centres]),
+                                   numpy.array([centre.y() for centre in centres])))
+
+        self.fillMaxDepth = 155
+        self.fillWorker = SpirographFillWorker(self.fillGeneration, NCWMSTools(self.view), origins, segmentCentres,
+                                               self.depth)
+        self.fillWorker.spirographFilled.connect(self.colourSpirograph)
+        self.fillWorker.progress.connect(self.view.mainWindow.updateProgress)
+        self.fillWorker.finished.connect(lambda: self.view.mainWindow.statusValueLabel.setText(''))
+        self.fillWorker.start()
+
+    def cancelFill(self):
+        """
+        Stop a fill that is still running, e.g. because the Spirographs are being cleared. Anything
+        it has already sent that is still queued is ignored when it arrives.
+        """
+        self.fillGeneration += 1
+        if self.fillWorker is None:
+            return
+        self.fillWorker.spirographFilled.disconnect()
+        self.fillWorker.progress.disconnect()
+        if self.fillWorker.isRunning():
+            self.fillWorker.requestInterruption()
+            self.fillWorker.wait()
+        self.fillWorker = None
+
+    def colourSpirograph(self, generation, index, depths, soundSpeeds, probabilities):
+        """ Colour the segments of one Spirograph by the probability of detection the fill worker worked out. """
+        if generation != self.fillGeneration or index >= len(self.spirographList):
+            return  # from a fill that has since been cancelled
+        spiro = self.spirographList[index]
+
+        # it is possible that there are no data points available e.g. over land.
+        depths = depths[depths > 1]
+        if len(depths) > 0:
+            self.fillMaxDepth = float(depths.max())
+        spiro.maxDepth = self.fillMaxDepth
+        self.maxDepth = max([spiro.maxDepth, self.maxDepth])
+
+        # If the ncWMS data does not have a value for this location, do not colour it.
+        for segment, soundSpeed, probability in zip(spiro.spiroSegmentList, soundSpeeds, probabilities):
+            segment.soundSpeed = float(soundSpeed)
+            segment.detectionProbability = float(probability)
+            if segment.soundSpeed > 0 and not numpy.isnan(probability):
+                segment.fillWithColourForRatio(segment.detectionProbability)
+        self.coverageMesh.redraw()
+
+        self.view.mainWindow.setDepthLabel()
 
     def update(self):
         """
         Called when the map is zoomed. The Spirographs are redrawn using the sound speed determined
         when they were created. This saves having to repeat the expensive call to the ncMWS server. """
-        for spiro in self.spirographList:
-            spiro.redrawSpiroPolygons()
+        self.coverageMesh.redraw()
 
     def clear(self):
         """ Removed all p(detection) circles and their fills. """
+        self.cancelFill()
+        self.coverageMesh.clear()
         for spiro in self.spirographList:
-            self.view.scene.removeItem(spiro.spiroSegmentGraphicsGroup)
             spiro.spiroSegmentList.clear()
         self.spirographList.clear()
 
     def addProbOfDetectionBoundaries(self):
         """
         Draws circles (with a diameter=sonar range of the day) covering a ruler lineSegment entered. Circles
-        are filled to denote probability of detection.
+        are filled to denote probability of detection. The Spirographs are drawn as one CoverageMesh.
         """
-        for spiro in self.spirographList:
-            self.view.scene.removeItem(spiro.spiroSegmentGraphicsGroup)
-
         for lineSegment in self.view.rulerLayer.lineSegmentList:
             lengthCount = 1
 
-            g = pyproj.Geod(ellps='WGS84')
-            (radialBearing, _, dist) = g.inv(lineSegment.startLatLon.y(),
-                                             lineSegment.startLatLon.x(),
-                                             lineSegment.endLatLon.y(),
-                                             lineSegment.endLatLon.x())
+            (radialBearing, _, dist) = WGS84_GEOD.inv(lineSegment.startLatLon.y(),
+                                                      lineSegment.startLatLon.x(),
+                                                      lineSegment.endLatLon.y(),
+                                                      lineSegment.endLatLon.x())
 
             # Put a spirograph at each point of each lineSegment segment that is half the range of the day in length.
             while (lengthCount * SONAR_RANGE_OF_THE_DAY * 0.5) < dist:
-                rangeOfTheDayRadiusLatLon = self.controller.vincentyDirect(lineSegment.startLatLon.x(),
-                                                                           lineSegment.startLatLon.y(),
-                                                                           radialBearing,
-                                                                           lengthCount * SONAR_RANGE_OF_THE_DAY * 0.5)
+                rangeOfTheDayRadiusLatLon = vincentyDirect(lineSegment.startLatLon.x(),
+                                                           lineSegment.startLatLon.y(),
+                                                           radialBearing,
+                                                           lengthCount * SONAR_RANGE_OF_THE_DAY * 0.5)
                 spiro = Spirograph(self.view,
                                    lineSegment.startLatLon,
                                    rangeOfTheDayRadiusLatLon,
@@ -305,6 +465,7 @@ class SpirographLayer:
 
         for spiro in self.spirographList:
             spiro.drawSpiroPolygons()
+        self.coverageMesh.build(self.spirographList)
 
 
 class TacticalLayer:
@@ -333,25 +494,86 @@ class TacticalLayer:
 
 
 class FeatureLayer():
-    """ SVGs that denote airports, ports, cities etcl. """
+    """
+    SVGs that denote airports, ports, cities etcl. The features are held in a spatial index so
+    that each pan/zoom only positions the ones in view; the rest are just hidden. Zoomed out,
+    features that would be drawn on top of each other are replaced by a badge with their count.
+    """
 
     def __init__(self, view, features, visible):
         self.view = view
-        self.features = features
+        self.features = []
         self.visible = visible
+        self.latLons = numpy.empty((0, 2))  # rows past len(self.features) are room to grow
+        self.index = SpatialGrid()  # positions in self.features
+        self.shown = set()  # positions of the features currently on screen
+        self.clusters = PointClusters()
+        self.badges = ClusterBadges(view)
+        self.addFeatures(features, draw=False)
 
     def draw(self):
         for feature in self.features:
             feature.draw()
+        self.shown = set(range(len(self.features)))
+        self.update()
+
+    def addFeatures(self, features, draw=True):
+        """
+        Add more features, e.g. a batch that has just arrived from the WFS. Only the new ones
+        are indexed; the lat/lon array doubles in size when it fills up rather than being copied
+        for every batch.
+        """
+        start = len(self.features)
+        for position, feature in enumerate(features, start):
+            self.index.insert(position, feature.lat, feature.long)
+            if draw:
+                feature.draw()
+                self.shown.add(position)
+        self.features.extend(features)
+
+        if len(self.features) > len(self.latLons):
+            latLons = numpy.empty((max(len(self.features), 2 * len(self.latLons)), 2))
+            latLons[:start] = self.latLons[:start]
+            self.latLons = latLons
+        if features:
+            self.latLons[start:len(self.features)] = [(feature.lat, feature.long) for feature in features]
+        self.clusters.addPoints(self.latLons[start:len(self.features)])
+        if draw:
+            self.update()
 
     def update(self):
-        for feature in self.features:
-            feature.update()
+        if not self.features:
+            return
+
+        # Only what's on screen (with a margin for the icons) is positioned, and of that only
+        # the features not grouped into a cluster at this zoom.
+        inView = self.index.query(self.view.viewportBbox(0.1)) if self.visible else []
+        positions, clusters, level = self.clusters.split(self.view.mapController.tileZoomIndex, inView)
+        if len(clusters):
+            self.badges.update(level.latLons[clusters], level.counts[clusters])
+        else:
+            self.badges.clear()
+
+        inView = set(positions.tolist())
+        for position in self.shown - inView:
+            self.features[position].hide()
+        if inView:
+            xy = self.view.mapController.toCanvasCoordinatesArray(self.latLons[positions])
+            for position, (x, y) in zip(positions, xy):
+                feature = self.features[position]
+                feature.setPos(x, y)
+                if position not in self.shown:
+                    feature.show()
+        self.shown = inView
+
+    def featureAt(self, lat, lon, maxDistance):
+        """ The feature nearest a location on screen, if there is one within maxDistance degrees. """
+        position = self.index.nearest(lat, lon, maxDistance, geographic=False)
+        return self.features[position] if position is not None and position in self.shown else None
 
     def showHide(self, showHide):
         self.visible = True if showHide == 'show' else False
-        for feature in self.features:
-            feature.show() if self.visible else feature.hide()
+        self.update()
 
     def setGeometry(self):
         pass
@@ -456,8 +678,14 @@ class BreadcrumbLayer:
 
     def updateLines(self):
         """ Ensure all lines update with map pan/zoom. """
-        for line in self.graphicObjects:
-            line.updatePosition()
+        if not self.graphicObjects:
+            return
+        latLons = [(latLon.x(), latLon.y())
+                   for line in self.graphicObjects
+                   for latLon in (line.startLatLon, line.endLatLon)]
+        xy = self.view.mapController.toCanvasCoordinatesArray(latLons).reshape(-1, 4)
+        for line, (startX, startY, endX, endY) in zip(self.graphicObjects, xy):
+            line.proxy.setLine(startX, startY, endX, endY)
 
     def showHide(self, showHide):
         """
@@ -501,6 +729,11 @@ class NavChartsTemplateLayer():
         self.chartOutlines['AUS00112P0'] = (
             115.4259400743493, -32.078144013356045, 115.83690500989755, -31.857167891674703)
 
+        # top left and bottom right lat/lon of each chart, in the same order as chartOutlines
+        self.cornerLatLons = numpy.array([((rectPoints[3], rectPoints[0]), (rectPoints[1], rectPoints[2]))
+                                          for rectPoints in self.chartOutlines.values()],
+                                         dtype=float).reshape(-1, 2)
+
         pen = QPen(QColor(255, 0, 0))
         pen.setWidth(1)
 
@@ -519,11 +752,10 @@ class NavChartsTemplateLayer():
     def update(self):
         """ Relocate the graphics with pan/zoom. """
         if self.visible:
-            for text, rectPoints in self.chartOutlines.items():
-                tl = QPointF(self.mapController.toCanvasCoordinates(rectPoints[3], rectPoints[0]))
-                br = QPointF(self.mapController.toCanvasCoordinates(rectPoints[1], rectPoints[2]))
-                self.rectangles[text].setRect(tl.x(), tl.y(), abs(br.x() - tl.x()), abs(br.y() - tl.y()))
-                self.chartNames[text].setPos(tl)
+            corners = self.mapController.toCanvasCoordinatesArray(self.cornerLatLons).reshape(-1, 4)
+            for text, (tlX, tlY, brX, brY) in zip(self.chartOutlines, corners):
+                self.rectangles[text].setRect(tlX, tlY, abs(brX - tlX), abs(brY - tlY))
+                self.chartNames[text].setPos(tlX, tlY)
             self.showHide('show')
         else:
             self.showHide('hide')
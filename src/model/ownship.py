@@ -193,6 +193,8 @@ class Ownship(UIObject):
             else:
                 layer.showHide('hide')
 
+        self.view.entityMoved(self)
+
     def showHide(self, layerName, showHide):
         """
         Used to show/hide the entity or entity icon and graphicsLayers separately.
@@ -0,0 +1,119 @@
+from math import cos, floor, radians
+
+import preferences
+
+
+class SpatialGrid:
+    """
+    A uniform lat/lon grid index of point items (features, entities etc.). Each item is kept in
+    the cell it falls in, so finding the items in an area or near a point only looks at the
+    cells covering it rather than at every item. Items are any hashable key; the index only
+    holds their locations.
+    """
+
+    def __init__(self, cellSize=preferences.SPATIAL_INDEX_CELL_SIZE):
+        """
+        Constructor
+        """
+        self.cellSize = cellSize  # degrees
+        self.cells = {}  # (row, column): set of items
+        self.locations = {}  # item: (lat, lon)
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __contains__(self, item):
+        return item in self.locations
+
+    def cell(self, lat, lon):
+        return floor(lat / self.cellSize), floor(lon / self.cellSize)
+
+    def insert(self, item, lat, lon):
+        """ Add an item, or move it if it's already in the index. """
+        if item in self.locations:
+            if self.locations[item] == (lat, lon):
+                return
+            self.remove(item)
+        self.locations[item] = (lat, lon)
+        self.cells.setdefault(self.cell(lat, lon), set()).add(item)
+
+    def remove(self, item):
+        lat, lon = self.locations.pop(item)
+        cell = self.cell(lat, lon)
+        self.cells[cell].discard(item)
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def clear(self):
+        self.cells.clear()
+        self.locations.clear()
+
+    def query(self, bbox):
+        """ Every item inside a bbox (lon min, lat min, lon max, lat max). """
+        lonMin, latMin, lonMax, latMax = bbox
+        rowMin, columnMin = self.cell(latMin, lonMin)
+        rowMax, columnMax = self.cell(latMax, lonMax)
+
+        # Zoomed well out the bbox can cover far more cells than are occupied.
+        if (rowMax - rowMin + 1) * (columnMax - columnMin + 1) > len(self.cells):
+            cells = [items for (row, column), items in self.cells.items()
+                     if rowMin <= row <= rowMax and columnMin <= column <= columnMax]
+        else:
+            cells = [self.cells[(row, column)]
+                     for row in range(rowMin, rowMax + 1) for column in range(columnMin, columnMax + 1)
+                     if (row, column) in self.cells]
+
+        found = []
+        for items in cells:
+            for item in items:
+                lat, lon = self.locations[item]
+                if latMin <= lat <= latMax and lonMin <= lon <= lonMax:
+                    found.append(item)
+        return found
+
+    def nearest(self, lat, lon, maxDistance=None, geographic=True):
+        """
+        The item closest to a location, or None. Distances are in degrees of latitude with
+        longitude scaled by cos(lat), or, if geographic is False, in plain degrees, which is how
+        far apart things are on the (equirectangular) screen. Searches outwards one ring of cells
+        at a time; if maxDistance (degrees) is given nothing further away than that is returned.
+        """
+        if not self.locations:
+            return None
+
+        lonScale = max(cos(radians(lat)), 0.01) if geographic else 1.0
+        row, column = self.cell(lat, lon)
+        occupiedRows = [cellRow for cellRow, _ in self.cells]
+        occupiedColumns = [cellColumn for _, cellColumn in self.cells]
+        maxRing = max(abs(row - min(occupiedRows)), abs(row - max(occupiedRows)),
+                      abs(column - min(occupiedColumns)), abs(column - max(occupiedColumns)))
+        if maxDistance is not None:
+            maxRing = min(maxRing, int(maxDistance / (self.cellSize * lonScale)) + 1)
+
+        best = None
+        bestDistance = maxDistance ** 2 if maxDistance is not None else float('inf')
+        for ring in range(maxRing + 1):
+            # Anything in this ring or beyond is at least (ring - 1) cells away in each direction.
+            if best is not None and ((ring - 1) * self.cellSize * lonScale) ** 2 > bestDistance:
+                break
+            for cell in self.ring(row, column, ring):
+                for item in self.cells.get(cell, ()):
+                    itemLat, itemLon = self.locations[item]
+                    distance = (itemLat - lat) ** 2 + ((itemLon - lon) * lonScale) ** 2
+                    if distance <= bestDistance:
+                        best = item
+                        bestDistance = distance
+        return best
+
+    @staticmethod
+    def ring(row, column, ring):
+        """ The cells making up the square ring ring cells out from a cell. """
+        if ring == 0:
+            yield row, column
+            return
+        for cellColumn in range(column - ring, column + ring + 1):
+            yield row - ring, cellColumn
+            yield row + ring, cellColumn
+        for cellRow in range(row - ring + 1, row + ring):
+            yield cellRow, column - ring
+            yield cellRow, column + ring
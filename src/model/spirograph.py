@@ -1,26 +1,62 @@
 from math import sqrt
 
-from PySide2.QtCore import Qt
-from PySide2.QtGui import QPolygonF, QColor, QPen, QBrush
-from PySide2.QtWidgets import QGraphicsItemGroup
+from PySide2.QtCore import Qt, QPointF, QRectF
+from PySide2.QtGui import QColor, QPen, QBrush, QPainterPath
+from PySide2.QtWidgets import QGraphicsItemGroup, QGraphicsPathItem
+from cachetools import cached, LRUCache
+import numpy
 
+from gis.mts_controller import vincentyDirectArray
 import preferences
 
 SEGMENT_ANGLE = 20  # how many segments in a Spirograph
 
+meshCache = LRUCache(maxsize=256)
+
+
+@cached(meshCache)
+def spiroMesh(originLat, originLon, diameter, segmentAngle):
+    """
+    The corners and centre of every segment of a Spirograph, solved in one vectorised pass.
+    Rings go from the inside out and segments clockwise from north within each ring. Returns
+    an (N * 4, 2) array of corner lat/lons, in the a, b, c, d order SpirographSegment uses,
+    and an (N, 2) array of segment centres. The arrays are shared through the cache so are
+    read only.
+    """
+    radiusDivisors = numpy.arange(2, 6)[:, None]
+    angles = numpy.arange(0, 360, segmentAngle)[None, :]
+    ccw = angles - 0.5 * segmentAngle
+    cw = angles + 0.5 * segmentAngle
+    outer = radiusDivisors ** 2 * diameter * 2
+    inner = (radiusDivisors - 1) ** 2 * diameter * 2
+    centre = radiusDivisors ** 2 * diameter * 0.9
+
+    # Outer CCW, outer CW, inner CW, inner CCW, then the centre for each segment.
+    bearings = numpy.stack(numpy.broadcast_arrays(ccw, cw, cw, ccw, angles), axis=-1)
+    distances = numpy.stack(numpy.broadcast_arrays(outer, outer, inner, inner, centre), axis=-1)
+    lats, lons = vincentyDirectArray(originLat, originLon, bearings, distances)
+
+    latLons = numpy.stack((lats, lons), axis=-1).reshape(-1, 5, 2)
+    corners = numpy.ascontiguousarray(latLons[:, :4]).reshape(-1, 2)
+    centres = numpy.ascontiguousarray(latLons[:, 4])
+    corners.flags.writeable = False
+    centres.flags.writeable = False
+    return corners, centres
+
 
 class SpirographSegment:
-    def __init__(self, polygonLatLonList, segmentCentreLatLon, proxy):
+    def __init__(self, polygonLatLonList, segmentCentreLatLon):
 
         self.polygonLatLonList = polygonLatLonList
         self.segmentCentreLatLon = segmentCentreLatLon
         self.soundSpeed = -1
-        self.soundSpeedColour = (0, 0, 0)
-        self.proxy = proxy
+        self.detectionProbability = numpy.nan
+        self.soundSpeedColour = None  # not coloured yet
 
     def fillWithColourForRatio(self, ratio):
         """
-        Select a colour between green and red to denote the probability of detection.
+        Select a colour between green and red to denote the probability of detection. The
+        CoverageMesh's redraw() puts the new colour on screen.
         """
         if 0 <= ratio <= 0.25:
             rgb = (49, 173, 0)
@@ -31,13 +67,8 @@ class SpirographSegment:
         else:
             rgb = (232, 11, 11)
 
-        self.proxy.setBrush(QBrush(QColor(rgb[0], rgb[1], rgb[2])))
         self.soundSpeedColour = rgb
 
-    def refillWithColourForRatio(self):
-        self.proxy.setBrush(
-            QBrush(QColor(self.soundSpeedColour[0], self.soundSpeedColour[1], self.soundSpeedColour[2])))
-
 
 class Spirograph:
     """
@@ -54,15 +85,16 @@ class Spirograph:
         self.spiroSegmentList = []
         self.zoomIndex = 1
         self.maxDepth = 155
-        self.spiroSegmentGraphicsGroup = QGraphicsItemGroup()
         self.rangeOfTheDayRadiusXY = 0
         self.newCentreXY = 0
+        self.cornerLatLons = None
 
     def drawSpiroPolygons(self):
-        """ Draws the outline of each segment required to create a Spirograph. """
-
-        self.spiroSegmentGraphicsGroup.setZValue(preferences.ZVALUE_MetaDialogs + 1)
-        self.view.scene.addItem(self.spiroSegmentGraphicsGroup)
+        """
+        Works out the outline of each segment required to create a Spirograph. The segments are
+        put on screen by the CoverageMesh they are added to.
+        """
+        self.spiroSegmentList = []
 
         self.newCentreXY = self.view.mapController.toCanvasCoordinates(self.centreLatLon.x(),
                                                                        self.centreLatLon.y())
@@ -75,92 +107,157 @@ class Spirograph:
 
         # Divide a circle into SEGMENT_ANGLE pie pieces and then radiusDivisor number of co-centric circles to form 
         # a shape that approximates a cirlcel made of individual polygons that will be coloured based on the 
-        # speed of sound each polygon's region.
-        for radiusDivisor in range(2, 6):
-            for angle in range(0, 360, SEGMENT_ANGLE):
-                innerCCWSegmentLatLon = self.view.mapController.vincentyDirect(self.rangeOfTheDayRadiusLatLon.x(),
-                                                                               self.rangeOfTheDayRadiusLatLon.y(),
-                                                                               angle - (0.5 * SEGMENT_ANGLE),
-                                                                               (radiusDivisor - 1) ** 2 * diameter * 2)
-                innerCCWSegmentXY = self.view.mapController.toCanvasCoordinates(innerCCWSegmentLatLon.x(),
-                                                                                innerCCWSegmentLatLon.y())
-                innerCWSegmentLatLon = self.view.mapController.vincentyDirect(self.rangeOfTheDayRadiusLatLon.x(),
-                                                                              self.rangeOfTheDayRadiusLatLon.y(),
-                                                                              angle + (0.5 * SEGMENT_ANGLE),
-                                                                              (radiusDivisor - 1) ** 2 * diameter * 2)
-                innerCWSegmentXY = self.view.mapController.toCanvasCoordinates(innerCWSegmentLatLon.x(),
-                                                                               innerCWSegmentLatLon.y())
-
-                outerCCWSegmentLatLon = self.view.mapController.vincentyDirect(self.rangeOfTheDayRadiusLatLon.x(),
-                                                                               self.rangeOfTheDayRadiusLatLon.y(),
-                                                                               angle - (0.5 * SEGMENT_ANGLE),
-                                                                               radiusDivisor ** 2 * diameter * 2)
-                outerCCWSegmentXY = self.view.mapController.toCanvasCoordinates(outerCCWSegmentLatLon.x(),
-                                                                                outerCCWSegmentLatLon.y())
-                outerCWSegmentLatLon = self.view.mapController.vincentyDirect(self.rangeOfTheDayRadiusLatLon.x(),
-                                                                              self.rangeOfTheDayRadiusLatLon.y(),
-                                                                              angle + (0.5 * SEGMENT_ANGLE),
-                                                                              radiusDivisor ** 2 * diameter * 2)
-                outerCWSegmentXY = self.view.mapController.toCanvasCoordinates(outerCWSegmentLatLon.x(),
-                                                                               outerCWSegmentLatLon.y())
-
-                segmentCentreLatLon = self.view.mapController.vincentyDirect(self.rangeOfTheDayRadiusLatLon.x(),
-                                                                             self.rangeOfTheDayRadiusLatLon.y(),
-                                                                             angle,
-                                                                             radiusDivisor ** 2 * diameter * 0.9)
-
-                polyPoints = QPolygonF([outerCCWSegmentXY,
-                                        outerCWSegmentXY,
-                                        innerCWSegmentXY,
-                                        innerCCWSegmentXY])
-                polygon = self.view.scene.addPolygon(polyPoints)
-                penCol = QColor(Qt.black)
-                penCol.setAlphaF(0.3)
-                polygon.setPen(QPen(penCol))
-                polygon.setZValue(preferences.ZVALUE_MetaDialogs - 1)
-                polygon.setOpacity(0.4)
-                spiroSegment = SpirographSegment({'a': outerCCWSegmentLatLon,
-                                                  'b': outerCWSegmentLatLon,
-                                                  'c': innerCWSegmentLatLon,
-                                                  'd': innerCCWSegmentLatLon},
-                                                 segmentCentreLatLon,
-                                                 polygon)
-                self.spiroSegmentGraphicsGroup.addToGroup(polygon)
-                self.spiroSegmentList.append(spiroSegment)
-
-    def redrawSpiroPolygons(self):
+        # speed of sound each polygon's region. Spirographs of the same size at the same place share a mesh.
+        cornerLatLons, centreLatLons = spiroMesh(self.rangeOfTheDayRadiusLatLon.x(),
+                                                 self.rangeOfTheDayRadiusLatLon.y(),
+                                                 round(diameter, 2),
+                                                 SEGMENT_ANGLE)
+        for corners, centre in zip(cornerLatLons.reshape(-1, 4, 2), centreLatLons):
+            spiroSegment = SpirographSegment(dict(zip('abcd', (QPointF(lat, lon) for lat, lon in corners))),
+                                             QPointF(centre[0], centre[1]))
+            self.spiroSegmentList.append(spiroSegment)
 
-        for segment in self.spiroSegmentList:
-            self.spiroSegmentGraphicsGroup.removeFromGroup(segment.proxy)
-            self.view.scene.removeItem(segment.proxy)
-
-        for segment in self.spiroSegmentList:
-            innerCCWSegmentXY = self.view.mapController.toCanvasCoordinates(segment.polygonLatLonList['b'].x(),
-                                                                            segment.polygonLatLonList['b'].y())
-            innerCWSegmentXY = self.view.mapController.toCanvasCoordinates(segment.polygonLatLonList['a'].x(),
-                                                                           segment.polygonLatLonList['a'].y())
-            outerCCWSegmentXY = self.view.mapController.toCanvasCoordinates(segment.polygonLatLonList['c'].x(),
-                                                                            segment.polygonLatLonList['c'].y())
-            outerCWSegmentXY = self.view.mapController.toCanvasCoordinates(segment.polygonLatLonList['d'].x(),
-                                                                           segment.polygonLatLonList['d'].y())
-
-            polyPoints = QPolygonF([outerCCWSegmentXY,
-                                    outerCWSegmentXY,
-                                    innerCWSegmentXY,
-                                    innerCCWSegmentXY])
-            polygon = self.view.scene.addPolygon(polyPoints)
-            penCol = QColor(Qt.black)
-            penCol.setAlphaF(0.3)
-            polygon.setPen(QPen(penCol))
-            polygon.setBrush(
-                QColor(segment.soundSpeedColour[0], segment.soundSpeedColour[1], segment.soundSpeedColour[2]))
-            polygon.setZValue(preferences.ZVALUE_MetaDialogs - 1)
-            polygon.setOpacity(0.4)
-            segment.proxy = polygon
-            self.spiroSegmentGraphicsGroup.addToGroup(polygon)
+        self.cornerLatLons = cornerLatLons
 
     def clearSpiroPolygons(self):
         """ Make every segment in a Spirograph transparent so it can be redrawn and re-coloured. """
         for segment in self.spiroSegmentList:
             segment.soundSpeed = 0
-            segment.proxy.setBrush(QBrush(Qt.transparent))
+            segment.soundSpeedColour = None
+
+
+def coveredCells(cornerLatLons, cellSize):
+    """
+    The cells of a cellSize lat/lon grid covered by a set of convex quadrilaterals, given as an
+    (N * 4, 2) array of corner lat/lons in order around each. Cell (row, column) is centred on
+    (row * cellSize, column * cellSize), as in the NCWMS_CACHE_RESOLUTION grid, and is covered
+    if its centre is inside a quadrilateral. Returns the (M, 2) covered cells and, for every
+    quadrilateral covering every cell, the index of the cell and of the quadrilateral.
+    """
+    quads = numpy.asarray(cornerLatLons, dtype=float).reshape(-1, 4, 2) / cellSize
+    if not len(quads):
+        return numpy.empty((0, 2), dtype=int), numpy.empty(0, dtype=int), numpy.empty(0, dtype=int)
+
+    # The cell centres inside each quadrilateral's bounding box, for all of them at once.
+    low = numpy.ceil(quads.min(axis=1)).astype(int)
+    high = numpy.floor(quads.max(axis=1)).astype(int)
+    shape = numpy.maximum(high - low + 1, 0)
+    counts = shape[:, 0] * shape[:, 1]
+    quadIndices = numpy.repeat(numpy.arange(len(quads)), counts)
+    offsets = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    columns = shape[quadIndices, 1]
+    cells = low[quadIndices] + numpy.stack((offsets // columns, offsets % columns), axis=-1)
+
+    # A point is inside a convex polygon if it is on the same side of every edge as the
+    # polygon's winding, whichever way round the corners go.
+    corners = quads[quadIndices]
+    edges = numpy.roll(corners, -1, axis=1) - corners
+    toCell = cells[:, None, :] - corners
+    sides = edges[..., 0] * toCell[..., 1] - edges[..., 1] * toCell[..., 0]
+    winding = numpy.sign((corners[..., 0] * numpy.roll(corners[..., 1], -1, axis=1) -
+                          numpy.roll(corners[..., 0], -1, axis=1) * corners[..., 1]).sum(axis=1))
+    inside = (sides * winding[:, None] >= 0).all(axis=1)
+
+    uniqueCells, cellIndices = numpy.unique(cells[inside], axis=0, return_inverse=True)
+    return uniqueCells, cellIndices.reshape(-1), quadIndices[inside]
+
+
+class CoverageMesh:
+    """
+    The union of all the Spirographs along a route. Neighbouring Spirographs overlap a lot, and
+    each is centred on its own point so their segments never line up. The area they cover is
+    instead drawn as the cells of the shared NCWMS_CACHE_RESOLUTION lat/lon grid (the one the
+    environmental data is looked up on) inside any segment, each cell in the colour of the best
+    probability of detection of the segments covering it. Cells are drawn as one path per
+    colour for the whole route rather than items per Spirograph.
+    """
+
+    def __init__(self, view):
+        """
+        Constructor
+        """
+        self.view = view
+        self.segments = []  # every segment of every Spirograph
+        self.cells = numpy.empty((0, 2), dtype=int)  # (row, column) of each covered cell
+        self.cellIndices = numpy.empty(0, dtype=int)  # with segmentIndices, which segments cover which cells
+        self.segmentIndices = numpy.empty(0, dtype=int)
+
+        self.graphicsGroup = QGraphicsItemGroup()
+        self.graphicsGroup.setZValue(preferences.ZVALUE_MetaDialogs + 1)
+        self.view.scene.addItem(self.graphicsGroup)
+        # One path item per fill colour (None for uncoloured) holding every cell of that colour.
+        self.colourPathItems = {}
+
+    def build(self, spirographs):
+        """ Work out the grid cells covered by a set of Spirographs. """
+        self.segments = [segment for spiro in spirographs for segment in spiro.spiroSegmentList]
+        if not self.segments:
+            self.clear()
+            return
+        corners = numpy.concatenate([spiro.cornerLatLons for spiro in spirographs])
+        self.cells, self.cellIndices, self.segmentIndices = coveredCells(corners, preferences.NCWMS_CACHE_RESOLUTION)
+        self.redraw()
+
+    def cellColours(self):
+        """ For each cell, the colour of the covering segment with the best probability of detection. """
+        probabilities = numpy.array([numpy.nan_to_num(segment.detectionProbability, nan=-1)
+                                     if segment.soundSpeedColour is not None else -numpy.inf
+                                     for segment in self.segments])
+        # Sort the (cell, segment) pairs by cell then probability; the last of each cell wins.
+        order = numpy.lexsort((probabilities[self.segmentIndices], self.cellIndices))
+        last = numpy.flatnonzero(numpy.append(numpy.diff(self.cellIndices[order]), 1))
+        return [self.segments[index].soundSpeedColour for index in self.segmentIndices[order[last]]]
+
+    def colourPathItem(self, colour):
+        """ The path item for cells of a colour, created the first time the colour is used. """
+        if colour not in self.colourPathItems:
+            item = QGraphicsPathItem(self.graphicsGroup)
+            penCol = QColor(Qt.black)
+            penCol.setAlphaF(0.3)
+            item.setPen(QPen(penCol))
+            if colour is not None:
+                item.setBrush(QBrush(QColor(colour[0], colour[1], colour[2])))
+            item.setZValue(preferences.ZVALUE_MetaDialogs - 1)
+            item.setOpacity(0.4)
+            self.colourPathItems[colour] = item
+        return self.colourPathItems[colour]
+
+    def redraw(self):
+        """
+        Put the cells where they belong at the current zoom, in their current colours. Cells of
+        the same colour next to each other in a row are drawn as one rectangle. The path items
+        are reused; only their geometry is replaced.
+        """
+        paths = {colour: QPainterPath() for colour in self.colourPathItems}
+        if len(self.cells):
+            colours = self.cellColours()
+            colourIds = {colour: index for index, colour in enumerate(dict.fromkeys(colours))}
+            ids = numpy.array([colourIds[colour] for colour in colours])
+            rows, columns = self.cells[:, 0], self.cells[:, 1]
+
+            # Runs of cells of one colour along a row.
+            order = numpy.lexsort((columns, rows, ids))
+            ids, rows, columns = ids[order], rows[order], columns[order]
+            starts = numpy.flatnonzero(numpy.concatenate(([True], (ids[1:] != ids[:-1]) | (rows[1:] != rows[:-1]) |
+                                                          (columns[1:] != columns[:-1] + 1))))
+            ends = numpy.append(starts[1:], len(ids)) - 1
+
+            # Equirectangular, so opposite corners in lat/lon give the rectangle on the canvas.
+            size = preferences.NCWMS_CACHE_RESOLUTION
+            latLons = numpy.stack(((rows[starts] + 0.5) * size, (columns[starts] - 0.5) * size,
+                                   (rows[starts] - 0.5) * size, (columns[ends] + 0.5) * size), axis=-1)
+            xy = self.view.mapController.toCanvasCoordinatesArray(latLons.reshape(-1, 2)).reshape(-1, 4)
+            colourList = list(colourIds)
+            for colourId, (left, top, right, bottom) in zip(ids[starts], xy):
+                path = paths.setdefault(colourList[colourId], QPainterPath())
+                path.addRect(QRectF(QPointF(left, top), QPointF(right, bottom)).normalized())
+
+        for colour, path in paths.items():
+            self.colourPathItem(colour).setPath(path)
+
+    def clear(self):
+        self.segments = []
+        self.cells = numpy.empty((0, 2), dtype=int)
+        self.cellIndices = numpy.empty(0, dtype=int)
+        self.segmentIndices = numpy.empty(0, dtype=int)
+        self.redraw()
@@ -124,6 +124,8 @@ class TruthEntity(UIObject):
                                lineY, 
                                (lineX + sin(radians(self.course)) * self.speed * enums.PREDICTED_COURSE_SCALE),
                                (lineY - cos(radians(self.course)) * self.speed * enums.PREDICTED_COURSE_SCALE))
+
+        self.view.entityMoved(self)
     
     def showHideLayer(self, layerName, showHide):
         """
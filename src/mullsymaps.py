@@ -25,4 +25,5 @@ if __name__ == '__main__':
     app = QApplication(sys.argv)
     preferences.SCREEN_RESOLUTION = app.desktop().screenGeometry()
     mm = MainWindow()
+    app.aboutToQuit.connect(mm.windowFrame.map.shutdown)
     sys.exit(app.exec_())
@@ -20,9 +20,71 @@ CACHE_PATH = str(Path.home()) + '/cache'
 APP_PATH = os.getcwd()
 ICON_PATH = '../images/'
 DEFAULT_CACHE_PATH = Path(COMMON_ROOT / '../default_cache')
+# Local copy of the bathymetric heightmap used for depth lookups.
+BATHYMETRY_PATH = CACHE_PATH + '/bathymetry.npy'
+BATHYMETRY_BBOX = (100.0, -50.0, 160.0, -5.0)  # lon min, lat min, lon max, lat max
+BATHYMETRY_RESOLUTION = 0.02  # degrees
+# Anywhere outside BATHYMETRY_BBOX is downloaded when first looked up, in squares this size (degrees).
+BATHYMETRY_TILE_SIZE = 5.0
+# Land/sea bitmap built from the cached landmass tiles at this raster zoom level.
+LAND_MASK_LAYER = 'WA_Landmass'
+LAND_MASK_PATH = CACHE_PATH + '/land_mask.npz'
+LAND_MASK_ZOOM = 9
+# Number of cells along each side of a gridded ncWMS (sound speed, max depth) fetch.
+NCWMS_GRID_SIZE = 128
+# Upper limit on concurrent ncWMS point queries.
+NCWMS_MAX_IN_FLIGHT = 8
+# ncWMS data time step queried when no other time is given.
+NCWMS_TIME = '2017-06-28T00:00:00.000Z'
+# Frames of a time range kept in memory for playback, and the playback rate (frames per second).
+NCWMS_FRAME_CACHE_SIZE = 48
+NCWMS_PLAYBACK_RATE = 10
+# How long (seconds) before an ncWMS frame that failed to load is requested again.
+NCWMS_RETRY_DELAY = 5
+# ncWMS point query results are cached on a grid of this many degrees, and kept on disk here
+# between sessions (None keeps them in memory only).
+NCWMS_CACHE_RESOLUTION = 0.01
+NCWMS_CACHE_PATH = CACHE_PATH + '/ncwms_points'
+# Width/height in pixels of the sound speed heatmap image.
+SOUND_SPEED_IMAGE_SIZE = 256
+# After the coarse sound speed grid is drawn, areas whose sound speed varies by more than this
+# fraction of the overall range are split into quarters and fetched again, up to
+# SOUND_SPEED_MAX_LEVEL times, for as long as the time budget (seconds) allows.
+SOUND_SPEED_REFINE_THRESHOLD = 0.2
+SOUND_SPEED_MAX_LEVEL = 4
+SOUND_SPEED_TIME_BUDGET = 3.0
+# Detection model: sonar frequency (kHz) and the spread (dB) of the signal excess about its mean.
+DETECTION_FREQUENCY = 3.5
+DETECTION_SIGMA = 6.0
+# WFS features are requested for the view plus this fraction of its size on each side, this many
+# per request, and drawn in batches of WFS_BATCH_SIZE as they arrive.
+WFS_MARGIN = 0.5
+WFS_PAGE_SIZE = 500
+WFS_BATCH_SIZE = 50
+# What has been loaded from the WFS is kept track of in cells this size (degrees).
+WFS_CELL_SIZE = 1.0
+# Size (degrees) of the cells of the spatial index used to cull and hit-test features and entities,
+# and how close (pixels) a click must be to a feature or entity to select it.
+SPATIAL_INDEX_CELL_SIZE = 0.25
+HIT_TEST_RADIUS = 16
+# Map symbols drawn no bigger than SYMBOL_ATLAS_MAX_SIZE pixels come from pre-rasterised copies
+# packed into atlas pixmaps of SYMBOL_ATLAS_SIZE x SYMBOL_ATLAS_SIZE.
+SYMBOL_ATLAS_SIZE = 1024
+SYMBOL_ATLAS_MAX_SIZE = 64
+# Points (features, contacts) closer than CLUSTER_RADIUS pixels are drawn as one badge with their
+# count, at raster zoom levels up to CLUSTER_MAX_ZOOM.
+CLUSTER_RADIUS = 40
+CLUSTER_MAX_ZOOM = 10
 
 SCREEN_RESOLUTION = None
 
+# Upper limit on how many times per second the map is re-rendered.
+MAX_FRAME_RATE = 60
+# How long an animated move to a new location takes (ms).
+FLY_TO_DURATION = 500
+# While zooming, missing tiles are drawn from a parent tile up to this many raster zoom levels lower.
+PREVIEW_ZOOM_LEVELS = 3
+
 # -------------------------------- Constants --------------------------------------
 DISTANCE_UNITS_LOW = 'm'
 DISTANCE_UNITS_HIGH = 'km'
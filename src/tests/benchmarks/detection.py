@@ -0,0 +1,27 @@
+"""
+Time detectionProbability() for a spirograph, a route of 100 and of 10000 spirographs, a
+128 x 128 data grid and a 1024 x 1024 viewport. Run from src/: python -m tests.benchmarks.detection
+"""
+import time
+
+import numpy
+
+from model.detection import detectionProbability, figureOfMerit, METRES_PER_YARD
+
+
+def benchmark(sizes=(72, 72 * 100, 128 * 128, 72 * 10000, 1024 * 1024), repeats=5):
+    random = numpy.random.default_rng(0)
+    merit = figureOfMerit(25000 * METRES_PER_YARD)
+    for size in sizes:
+        arguments = (random.uniform(100, 40000, size), random.uniform(20, 4000, size),
+                     random.uniform(0, 150, size), random.uniform(1480, 1540, size), merit)
+        detectionProbability(*arguments)  # warm up
+        start = time.perf_counter()
+        for _ in range(repeats):
+            detectionProbability(*arguments)
+        elapsed = (time.perf_counter() - start) / repeats
+        print('{:>9} points: {:8.2f} ms {:10.1f} Mpoints/s'.format(size, elapsed * 1000, size / elapsed / 1e6))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,42 @@
+"""
+Time the vectorised Vincenty solvers against looping over the scalar ones for N random point
+pairs, N = 1 to 1e6. Run from src/: python -m tests.benchmarks.vincenty
+"""
+import time
+
+import numpy
+
+from gis.mts_controller import distanceBetweenTwoPoints, distanceBetweenPointsArray, vincentyDirect, \
+    vincentyDirectArray
+
+
+def benchmark(sizes=(1, 10, 100, 1000, 10000, 100000, 1000000), scalarLimit=100000):
+    """ The scalar loops are skipped above scalarLimit points. """
+    random = numpy.random.default_rng(0)
+    for size in sizes:
+        lat1, lat2 = random.uniform(-80, 80, size), random.uniform(-80, 80, size)
+        lon1, lon2 = random.uniform(-180, 180, size), random.uniform(-180, 180, size)
+        bearing, distance = random.uniform(0, 360, size), random.uniform(1, 5e6, size)
+
+        timings = []
+        for label, solve in (('inverse', lambda: distanceBetweenPointsArray(lat1, lon1, lat2, lon2)),
+                             ('direct', lambda: vincentyDirectArray(lat1, lon1, bearing, distance))):
+            start = time.perf_counter()
+            solve()
+            timings.append((label + ' array', time.perf_counter() - start))
+        if size <= scalarLimit:
+            start = time.perf_counter()
+            for i in range(size):
+                distanceBetweenTwoPoints(lat1[i], lon1[i], lat2[i], lon2[i])
+            timings.append(('inverse scalar', time.perf_counter() - start))
+            start = time.perf_counter()
+            for i in range(size):
+                vincentyDirect(lat1[i], lon1[i], bearing[i], distance[i])
+            timings.append(('direct scalar', time.perf_counter() - start))
+
+        for label, elapsed in timings:
+            print('{:>8} points {:>15}: {:10.2f} ms'.format(size, label, elapsed * 1000))
+
+
+if __name__ == '__main__':
+    benchmark()
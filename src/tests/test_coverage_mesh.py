@@ -0,0 +1,71 @@
+"""
+The grid cells a CoverageMesh draws cover the same area as the Spirographs they stand for.
+Areas are in square degrees, as the map is equirectangular. Run from src/: python -m pytest tests
+"""
+import numpy
+import pytest
+
+from model.spirograph import SEGMENT_ANGLE, coveredCells, spiroMesh
+import preferences
+
+ORIGIN = (-32.12673, 115.25)
+
+
+def quadAreas(cornerLatLons):
+    """ The area of each quadrilateral, by the shoelace formula. """
+    quads = cornerLatLons.reshape(-1, 4, 2)
+    lats, lons = quads[..., 0], quads[..., 1]
+    return 0.5 * numpy.abs((lats * numpy.roll(lons, -1, axis=1) - numpy.roll(lats, -1, axis=1) * lons).sum(axis=1))
+
+
+def unionArea(cornerLatLons, step):
+    """ The area inside any of the quadrilaterals, counted on a fine grid of points one at a time. """
+    low, high = cornerLatLons.min(axis=0), cornerLatLons.max(axis=0)
+    lats = numpy.arange(low[0], high[0], step) + step / 2
+    lons = numpy.arange(low[1], high[1], step) + step / 2
+
+    covered = numpy.zeros((len(lats), len(lons)), dtype=bool)
+    for quad in cornerLatLons.reshape(-1, 4, 2):
+        # Only the points around the quadrilateral need testing.
+        rows = slice(*numpy.searchsorted(lats, (quad[:, 0].min(), quad[:, 0].max())))
+        columns = slice(*numpy.searchsorted(lons, (quad[:, 1].min(), quad[:, 1].max())))
+        pointLats, pointLons = numpy.meshgrid(lats[rows], lons[columns], indexing='ij')
+        sides = numpy.array([(nextCorner[0] - corner[0]) * (pointLons - corner[1]) -
+                             (nextCorner[1] - corner[1]) * (pointLats - corner[0])
+                             for corner, nextCorner in zip(quad, numpy.roll(quad, -1, axis=0))])
+        covered[rows, columns] |= (sides >= 0).all(axis=0) | (sides <= 0).all(axis=0)
+    return covered.sum() * step ** 2
+
+
+def route(diameter, count):
+    """ The corners of count Spirographs in a line east, each half its radius on from the one before. """
+    spacing = 50 * diameter / 2 / 94500  # metres to degrees of longitude at ORIGIN
+    return numpy.concatenate([spiroMesh(ORIGIN[0], ORIGIN[1] + index * spacing, diameter,
+                                        SEGMENT_ANGLE)[0] for index in range(count)])
+
+
+@pytest.mark.parametrize('diameter', [324.0, 1000.0])
+def test_one_spirograph(diameter):
+    # The segments of one Spirograph don't overlap, so the area covered is the sum of theirs.
+    corners = spiroMesh(*ORIGIN, diameter, SEGMENT_ANGLE)[0]
+    cells, _, _ = coveredCells(corners, preferences.NCWMS_CACHE_RESOLUTION)
+    drawn = len(cells) * preferences.NCWMS_CACHE_RESOLUTION ** 2
+    assert drawn == pytest.approx(quadAreas(corners).sum(), rel=0.03)
+
+
+@pytest.mark.parametrize('diameter', [324.0, 1000.0])
+def test_overlapping_spirographs(diameter):
+    corners = route(diameter, 4)
+    cells, cellIndices, quadIndices = coveredCells(corners, preferences.NCWMS_CACHE_RESOLUTION)
+    drawn = len(cells) * preferences.NCWMS_CACHE_RESOLUTION ** 2
+    assert drawn == pytest.approx(unionArea(corners, preferences.NCWMS_CACHE_RESOLUTION / 10), rel=0.03)
+    assert drawn < 0.8 * quadAreas(corners).sum()  # the overlaps are only drawn once
+
+    # Every cell is covered by something, and by nothing it isn't inside.
+    assert set(cellIndices.tolist()) == set(range(len(cells)))
+    assert len(set(zip(cellIndices.tolist(), quadIndices.tolist()))) == len(cellIndices)
+
+
+def test_nothing_covered():
+    cells, cellIndices, quadIndices = coveredCells(numpy.empty((0, 2)), preferences.NCWMS_CACHE_RESOLUTION)
+    assert cells.shape == (0, 2) and len(cellIndices) == len(quadIndices) == 0
@@ -0,0 +1,104 @@
+"""
+Parity of the vectorised Vincenty solvers with the scalar ones they replace, element by
+element. Run from src/: python -m pytest tests
+"""
+import math
+
+import numpy
+import pytest
+
+from gis.mts_controller import distanceBetweenTwoPoints, distanceBetweenPointsArray, vincentyDirect, \
+    vincentyDirectArray
+
+NAN = float('nan')
+
+INVERSE_CASES = [
+    (-32.12673, 115.25, -31.9, 115.8),  # Perth
+    (0.0, 0.0, 0.0, 0.0),  # coincident
+    (10.0, 20.0, 10.0, 20.0),  # coincident off the equator
+    (0.0, 0.0, 0.0, 90.0),  # along the equator
+    (-89.9, 0.0, 89.9, 0.0),  # pole to pole
+    (0.0, 0.0, 0.5, 179.7),  # nearly antipodal
+    (0.0, 0.0, 0.0, 180.0),  # antipodal on the equator
+    (30.0, 40.0, -30.0, -140.0),  # antipodal
+    (NAN, 0.0, 10.0, 10.0),
+    (0.0, NAN, 10.0, 10.0),
+    (0.0, 0.0, NAN, NAN),
+]
+
+DIRECT_CASES = [
+    (-32.12673, 115.25, 45.0, 20000.0),
+    (-32.12673, 115.25, 359.0, 1.0),
+    (0.0, 0.0, 90.0, 10000000.0),
+    (0.0, 0.0, -90.0, 20003931.0),  # to the antipode along the equator
+    (0.0, 0.0, 0.0, 20003931.0),  # to the antipode over the pole
+    (45.0, 45.0, 225.0, 19990000.0),  # nearly antipodal
+    (NAN, 0.0, 10.0, 1000.0),
+    (1.0, NAN, 10.0, 1000.0),
+    (1.0, 0.0, NAN, 1000.0),
+    (1.0, 0.0, 10.0, NAN),
+]
+
+
+def assertSame(vectorised, scalar):
+    """ None (failure to converge) and NaN from the scalar solver are NaN when vectorised. """
+    if scalar is None or math.isnan(scalar):
+        assert math.isnan(vectorised)
+    else:
+        assert vectorised == pytest.approx(scalar, rel=1e-12, abs=1e-6)
+
+
+def randomInverseCases(count=2000):
+    random = numpy.random.default_rng(0)
+    return numpy.column_stack([random.uniform(-89, 89, count), random.uniform(-180, 180, count),
+                               random.uniform(-89, 89, count), random.uniform(-180, 180, count)])
+
+
+def randomDirectCases(count=2000):
+    random = numpy.random.default_rng(1)
+    return numpy.column_stack([random.uniform(-89, 89, count), random.uniform(-180, 180, count),
+                               random.uniform(-360, 720, count), random.uniform(1, 2e7, count)])
+
+
+@pytest.mark.parametrize('cases', [numpy.array(INVERSE_CASES), randomInverseCases()])
+def test_distanceBetweenPointsArray(cases):
+    distances = distanceBetweenPointsArray(*cases.T)
+    assert distances.shape == (len(cases),)
+    for (lat1, lon1, lat2, lon2), distance in zip(cases, distances):
+        assertSame(distance, distanceBetweenTwoPoints(lat1, lon1, lat2, lon2))
+
+
+@pytest.mark.parametrize('cases', [numpy.array(DIRECT_CASES), randomDirectCases()])
+def test_vincentyDirectArray(cases):
+    lats, lons = vincentyDirectArray(*cases.T)
+    assert lats.shape == lons.shape == (len(cases),)
+    for (lat, lon, bearing, distance), lat2, lon2 in zip(cases, lats, lons):
+        point = vincentyDirect(lat, lon, bearing, distance)
+        assertSame(lat2, point.x())
+        assertSame(lon2, point.y())
+
+
+def test_broadcasting():
+    distances = distanceBetweenPointsArray(-32.0, 115.0, numpy.array([[-32.0, -31.0], [-33.0, -34.0]]), 115.0)
+    assert distances.shape == (2, 2)
+    assert distances[0, 0] == 0.0
+
+    lats, lons = vincentyDirectArray(-32.0, 115.0, numpy.arange(0, 360, 45), 1000.0)
+    assert lats.shape == lons.shape == (8,)
+
+
+def test_zeroDistance():
+    """ The scalar solver divides by zero here; the vectorised one returns the start point. """
+    lats, lons = vincentyDirectArray([-32.0, 10.0], [115.0, 20.0], [45.0, 0.0], [0.0, 0.0])
+    assert lats.tolist() == pytest.approx([-32.0, 10.0])
+    assert lons.tolist() == pytest.approx([115.0, 20.0])
+
+
+def test_nonFiniteInputsReturn():
+    """ A NaN used to keep the direct solver iterating forever. """
+    lats, lons = vincentyDirectArray([NAN, 1.0], [0.0, 0.0], [10.0, 10.0], [1000.0, 1000.0])
+    assert math.isnan(lats[0]) and math.isnan(lons[0])
+    assertSame(lats[1], vincentyDirect(1.0, 0.0, 10.0, 1000.0).x())
+
+    distances = distanceBetweenPointsArray([numpy.inf, 1.0], [0.0, 0.0], [10.0, 1.0], [10.0, 0.0])
+    assert math.isnan(distances[0]) and distances[1] == 0.0